@@ -1,2 +1,22 @@
 # FastAPI backend - Word document formatter
-# File này cần cho import compatibility
\ No newline at end of file
+# File này cần cho import compatibility
+
+
+def create_app():
+    """
+    Flask app (main.py): API định dạng/preview/download, job bất đồng bộ và frontend tĩnh.
+    Import Flask trong hàm để backend FastAPI không phụ thuộc Flask.
+    """
+    from flask import Flask
+
+    from app.config import FRONTEND_DIR
+    from app.routes.jobs import jobs_bp
+    from app.routes.report import report_bp
+    from app.routes.static import static_bp
+
+    app = Flask(__name__)
+    app.config["FRONTEND_DIR"] = str(FRONTEND_DIR)
+    app.register_blueprint(report_bp)
+    app.register_blueprint(jobs_bp)
+    app.register_blueprint(static_bp)
+    return app
@@ -183,3 +183,151 @@ TOF_HEADING_CONFIG = {
     "alignment": "center",
 }
 
+
+
+# ============================================================================
+# CẤU HÌNH CACHE KẾT QUẢ (RESULT CACHE)
+# ============================================================================
+# Bật/tắt cache kết quả định dạng (cùng file + cùng options -> trả lại kết quả cũ)
+RESULT_CACHE_ENABLED = True
+
+# Thư mục lưu các file .docx đã định dạng
+RESULT_CACHE_DIR = TEMP_DIR / "result_cache"
+
+# Dung lượng tối đa của cache trong RAM (bytes)
+RESULT_CACHE_MEMORY_LIMIT = 64 * 1024 * 1024  # 64 MB
+
+# Dung lượng tối đa của cache trên đĩa (bytes)
+RESULT_CACHE_DISK_LIMIT = 512 * 1024 * 1024  # 512 MB
+
+
+# ============================================================================
+# CẤU HÌNH KHO FILE PREVIEW (PREVIEW STORE)
+# ============================================================================
+# Thư mục lưu file preview/download (chia thư mục con theo 2 ký tự đầu của file_id)
+PREVIEW_STORE_DIR = TEMP_DIR / "previews"
+
+# Thời gian sống mặc định của mỗi file preview (giây)
+PREVIEW_TTL_SECONDS = 2 * 60 * 60  # 2 giờ
+
+# Tổng dung lượng tối đa của kho preview (bytes) - vượt quá sẽ xóa file cũ nhất trước
+PREVIEW_STORE_MAX_BYTES = 1024 * 1024 * 1024  # 1 GB
+
+# Chu kỳ chạy tiến trình dọn dẹp nền (giây)
+PREVIEW_SWEEP_INTERVAL = 5 * 60  # 5 phút
+
+
+# ============================================================================
+# CẤU HÌNH JOB XỬ LÝ BẤT ĐỒNG BỘ (ASYNC JOBS)
+# ============================================================================
+# File SQLite lưu bảng job (job đang chờ vẫn còn sau khi restart)
+JOBS_DB_PATH = TEMP_DIR / "jobs.sqlite3"
+
+# Thư mục lưu file upload của job đang chờ xử lý
+JOBS_INPUT_DIR = TEMP_DIR / "job_inputs"
+
+# Số process worker định dạng tài liệu
+JOB_WORKERS = 2
+
+# Thời gian giữ lại thông tin job đã xong (giây)
+JOB_RETENTION_SECONDS = 24 * 60 * 60  # 1 ngày
+
+# Worker đang chạy job cập nhật heartbeat theo chu kỳ này (giây); job "running"
+# có heartbeat cũ hơn JOB_HEARTBEAT_TIMEOUT được coi là của worker đã chết
+JOB_HEARTBEAT_INTERVAL = 10
+JOB_HEARTBEAT_TIMEOUT = 60
+
+
+# ============================================================================
+# CẤU HÌNH GIỚI HẠN TẢI CỦA API (ADMISSION CONTROL)
+# ============================================================================
+# Việc định dạng được chia vào 2 làn (lane) có worker riêng, để tài liệu nhỏ
+# không phải xếp sau tài liệu lớn. Chi phí ước lượng từ báo cáo pre-flight
+# (đơn vị: "điểm" ~ một đoạn văn); <= FORMAT_FAST_LANE_MAX_COST -> làn fast
+FORMAT_FAST_LANE_MAX_COST = 1000
+
+# Số process định dạng chạy song song của từng làn
+FORMAT_FAST_WORKERS = 2
+FORMAT_BULK_WORKERS = 1
+
+# Số request tối đa được xếp hàng chờ worker của từng làn; vượt quá thì trả 429 ngay
+FORMAT_FAST_QUEUE_LIMIT = 16
+FORMAT_BULK_QUEUE_LIMIT = 4
+
+# Thời gian tối đa một request chờ tới lượt ở từng làn (giây); quá hạn thì trả 503
+FORMAT_FAST_QUEUE_TIMEOUT = 30
+FORMAT_BULK_QUEUE_TIMEOUT = 120
+
+# Giá trị header Retry-After gửi kèm 429/503 (giây)
+FORMAT_RETRY_AFTER = 5
+
+
+# ============================================================================
+# CẤU HÌNH CHUYỂN ĐỔI PDF (CONVERTAPI CLIENT)
+# ============================================================================
+# Backend chuyển đổi: "convertapi" (dịch vụ thật) hoặc "fake" (server giả lập
+# chạy ngay trong process, dùng để test/load-test không cần mạng)
+PDF_CONVERTER_BACKEND = "convertapi"
+
+# Địa chỉ ConvertAPI (đổi sang http://127.0.0.1:8100 khi chạy backend/fake_convertapi.py)
+CONVERTAPI_BASE_URL = "https://v2.convertapi.com"
+
+# Timeout cho request gọi ConvertAPI (giây)
+CONVERTAPI_TIMEOUT = 60
+
+# Số kết nối giữ trong pool (keep-alive) và số lần chuyển đổi chạy cùng lúc
+CONVERTAPI_MAX_CONNECTIONS = 8
+CONVERTAPI_MAX_CONCURRENCY = 4
+
+# Số lần thử lại khi lỗi mạng/429/5xx và thời gian chờ cơ sở (giây, tăng gấp đôi mỗi lần)
+CONVERTAPI_RETRIES = 2
+CONVERTAPI_RETRY_BACKOFF = 0.5
+
+
+# ============================================================================
+# CẤU HÌNH GHI FILE .DOCX
+# ============================================================================
+# Mức nén deflate (0-9) cho các part được ghi mới; 0 = không nén (ghi nhanh nhất).
+# Ảnh và part nhị phân không đổi luôn được copy nguyên từ file gốc.
+# Có thể ghi đè theo từng request bằng option "deflate_level".
+DOCX_DEFLATE_LEVEL = 6
+
+
+# ============================================================================
+# CẤU HÌNH GIỚI HẠN FILE UPLOAD
+# ============================================================================
+# Dung lượng tối đa của một file upload (bytes) - kiểm tra ngay trong lúc đọc
+UPLOAD_MAX_BYTES = 100 * 1024 * 1024  # 100 MB
+
+# Tổng dung lượng sau giải nén tối đa của file .docx (chống ZIP bomb)
+UPLOAD_MAX_DECOMPRESSED_BYTES = 512 * 1024 * 1024  # 512 MB
+
+# Thư mục lưu tạm file upload đang xử lý
+UPLOAD_TEMP_DIR = TEMP_DIR / "uploads"
+
+
+# ============================================================================
+# CẤU HÌNH KIỂM TRA NHANH FILE .DOCX (PRE-FLIGHT)
+# ============================================================================
+# Số part tối đa trong gói .docx
+PREFLIGHT_MAX_MEMBERS = 5000
+
+# Dung lượng tối đa của word/document.xml sau giải nén (bytes)
+PREFLIGHT_MAX_DOCUMENT_XML_BYTES = 200 * 1024 * 1024  # 200 MB
+
+# Tỉ lệ nén tối đa của một part lớn (dấu hiệu ZIP bomb)
+PREFLIGHT_MAX_COMPRESSION_RATIO = 200
+
+# Lượng document.xml (đã giải nén) đọc thử để ước lượng số đoạn văn (bytes)
+PREFLIGHT_SAMPLE_BYTES = 256 * 1024
+
+# Ngưỡng phân loại tài liệu theo số đoạn văn ước lượng (dùng để xếp lịch xử lý)
+PREFLIGHT_SMALL_PARAGRAPHS = 500
+PREFLIGHT_LARGE_PARAGRAPHS = 5000
+
+
+# ============================================================================
+# CẤU HÌNH ĐO THỜI GIAN PIPELINE (METRICS)
+# ============================================================================
+# Gửi kèm header Server-Timing (thời gian từng stage) trong response định dạng
+SERVER_TIMING_ENABLED = False
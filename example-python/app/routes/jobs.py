@@ -0,0 +1,59 @@
+import logging
+import traceback
+
+from flask import Blueprint, jsonify, request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from app.config import UPLOAD_MAX_BYTES
+from app.services.docx_preflight import InvalidDocumentError, preflight_docx
+from app.services.jobs import get_job_manager
+from app.services.uploads import UploadTooLargeError
+
+jobs_bp = Blueprint("jobs", __name__, url_prefix="/api")
+
+
+@jobs_bp.route("/jobs", methods=["POST"])
+def create_job():
+    """Nhận file và trả về job_id ngay (202), việc định dạng chạy nền trong process pool"""
+    request.max_content_length = UPLOAD_MAX_BYTES
+    try:
+        if "file" not in request.files:
+            return jsonify({"error": "Thiếu file upload"}), 400
+    except RequestEntityTooLarge:
+        return jsonify({"error": "File quá lớn", "max_bytes": UPLOAD_MAX_BYTES}), 413
+
+    upload = request.files["file"]
+    if not upload.filename.lower().endswith(".docx"):
+        return jsonify({"error": "Chỉ hỗ trợ file .docx"}), 400
+
+    options_payload = request.form.get("options")
+
+    try:
+        # Từ chối file hỏng/quá lớn ngay, không để job chiếm worker rồi mới lỗi
+        report = preflight_docx(upload.stream)
+        job_id = get_job_manager().submit(upload.stream, upload.filename, options_payload)
+        return jsonify({
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/api/jobs/{job_id}",
+            "size_class": report["size_class"],
+            "estimated_paragraphs": report["estimated_paragraphs"],
+            "image_count": report["image_count"],
+        }), 202
+    except UploadTooLargeError as exc:
+        return jsonify({"error": "File quá lớn", "details": str(exc)}), 413
+    except InvalidDocumentError as exc:
+        return jsonify({"error": "File .docx không hợp lệ", "details": str(exc)}), 400
+    except Exception as exc:
+        logging.error("Error creating job: %s", exc)
+        logging.debug(traceback.format_exc())
+        return jsonify({"error": "Không thể tạo job", "details": str(exc)}), 500
+
+
+@jobs_bp.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """Trạng thái job: queued/running/done/failed, kèm tiến độ và URL kết quả khi xong"""
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({"error": "Job không tồn tại hoặc đã hết hạn"}), 404
+    return jsonify(job)
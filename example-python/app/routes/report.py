@@ -1,13 +1,17 @@
 import logging
 import traceback
-import uuid
 from pathlib import Path
 
-from flask import Blueprint, jsonify, request, send_file
+from flask import Blueprint, Response, jsonify, request, send_file
+from werkzeug.exceptions import RequestEntityTooLarge
 
-from app.config import TEMP_DIR
-from app.services.report_formatter import format_uploaded_stream, generate_template_stream, docx_to_html_stream
-from docx import Document
+from app.config import UPLOAD_MAX_BYTES
+
+from app.services.html_preview import ensure_html_preview, select_html_variant, variant_etag
+from app.services.preview_store import get_preview_store
+from app.services.report_formatter import format_uploaded_to_file, generate_template_stream
+from app.services.docx_preflight import InvalidDocumentError
+from app.services.uploads import UploadTooLargeError
 
 report_bp = Blueprint("report", __name__, url_prefix="/api")
 
@@ -31,8 +35,14 @@ def generate_report():
 
 @report_bp.route("/format-report", methods=["POST"])
 def format_report():
-    if "file" not in request.files:
-        return jsonify({"error": "Thiếu file upload"}), 400
+    # Giới hạn dung lượng được kiểm tra ngay trong lúc đọc request (werkzeug tự ghi
+    # file upload lớn ra file tạm), không đợi đọc hết rồi mới so sánh
+    request.max_content_length = UPLOAD_MAX_BYTES
+    try:
+        if "file" not in request.files:
+            return jsonify({"error": "Thiếu file upload"}), 400
+    except RequestEntityTooLarge:
+        return jsonify({"error": "File quá lớn", "max_bytes": UPLOAD_MAX_BYTES}), 413
 
     upload = request.files["file"]
     if not upload.filename.lower().endswith(".docx"):
@@ -41,18 +51,15 @@ def format_report():
     options_payload = request.form.get("options")
 
     try:
-        file_bytes = upload.read()
-        stream, filename = format_uploaded_stream(file_bytes, upload.filename, options_payload)
-        
-        # Tạo ID duy nhất cho file preview
-        file_id = str(uuid.uuid4())
-        preview_filename = f"{file_id}.docx"
-        preview_path = TEMP_DIR / preview_filename
-        
-        # Lưu file vào thư mục tạm
-        with open(preview_path, "wb") as f:
-            stream.seek(0)
-            f.write(stream.read())
+        # Ghi kết quả thẳng vào kho preview (có TTL, tự dọn dẹp), không qua BytesIO
+        store = get_preview_store()
+        file_id = store.new_id()
+        tmp_path = store.temp_path_for(file_id)
+        try:
+            filename = format_uploaded_to_file(upload.stream, upload.filename, options_payload, tmp_path)
+            store.save_file(tmp_path, file_id=file_id)
+        finally:
+            tmp_path.unlink(missing_ok=True)
         
         # Trả về JSON với preview URL thay vì tải về trực tiếp
         return jsonify({
@@ -62,6 +69,10 @@ def format_report():
             "filename": filename,
             "file_id": file_id
         })
+    except UploadTooLargeError as exc:
+        return jsonify({"error": "File quá lớn", "details": str(exc)}), 413
+    except InvalidDocumentError as exc:
+        return jsonify({"error": "File .docx không hợp lệ", "details": str(exc)}), 400
     except Exception as exc:
         logging.error("Error formatting: %s", exc)
         logging.debug(traceback.format_exc())
@@ -70,23 +81,36 @@ def format_report():
 
 @report_bp.route("/preview/<file_id>", methods=["GET"])
 def preview_file(file_id):
-    """Hiển thị preview file - convert Word sang HTML và trả về HTML"""
+    """Hiển thị preview file - HTML được render một lần rồi lấy từ cache, hỗ trợ ETag/304"""
     try:
-        docx_path = TEMP_DIR / f"{file_id}.docx"
-        if not docx_path.exists():
+        store = get_preview_store()
+        etag = ensure_html_preview(store, file_id)
+        if etag is None:
             return jsonify({"error": "File không tồn tại hoặc đã hết hạn"}), 404
         
-        # Đọc Word document và convert sang HTML
-        doc = Document(docx_path)
-        html_stream = docx_to_html_stream(doc)
+        accepted = {enc for enc in ("br", "gzip") if request.accept_encodings.quality(enc) > 0}
+        html_path, encoding = select_html_variant(store, file_id, accepted)
+        if html_path is None:
+            return jsonify({"error": "File không tồn tại hoặc đã hết hạn"}), 404
+        tag = variant_etag(etag, encoding)
         
-        # Trả về HTML
-        from flask import Response
-        return Response(
-            html_stream.read(),
-            mimetype="text/html; charset=utf-8",
-            headers={"Content-Disposition": "inline"}
-        )
+        headers = {
+            "Content-Disposition": "inline",
+            "Cache-Control": "private, no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if request.if_none_match.contains(tag):
+            response = Response(status=304, headers=headers)
+        else:
+            response = Response(
+                html_path.read_bytes(),
+                mimetype="text/html; charset=utf-8",
+                headers=headers,
+            )
+            if encoding:
+                response.headers["Content-Encoding"] = encoding
+        response.set_etag(tag)
+        return response
     except Exception as exc:
         logging.error("Error previewing file: %s", exc)
         logging.debug(traceback.format_exc())
@@ -97,13 +121,14 @@ def preview_file(file_id):
 def download_file(file_id):
     """Tải về file đã chuẩn hóa"""
     try:
-        preview_path = TEMP_DIR / f"{file_id}.docx"
-        if not preview_path.exists():
+        preview_path = get_preview_store().get(file_id)
+        if preview_path is None:
             return jsonify({"error": "File không tồn tại hoặc đã hết hạn"}), 404
         
         # Đọc filename gốc từ query param nếu có
         original_filename = request.args.get("filename", "bao-cao-chuan.docx")
         
+        # Gửi theo đường dẫn để server dùng wsgi.file_wrapper/sendfile (không đọc file vào RAM)
         return send_file(
             preview_path,
             mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
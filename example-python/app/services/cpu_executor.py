@@ -0,0 +1,224 @@
+"""
+Module chạy việc nặng CPU ngoài event loop, có giới hạn hàng đợi (admission control)
+- Việc định dạng chạy trong process pool nên không chiếm event loop
+  (và không tranh GIL với các request nhẹ như /api/health)
+- Việc được xếp vào một trong hai làn theo chi phí ước lượng (docx_preflight):
+  làn "fast" cho tài liệu nhỏ, làn "bulk" cho tài liệu lớn; mỗi làn có process
+  pool, số worker và hàng đợi riêng nên tài liệu nhỏ không phải chờ tài liệu lớn
+- Hàng đợi của làn đầy -> ServerBusyError 429; chờ quá queue_timeout -> 503
+- Worker chết (OOM, segfault) làm hỏng pool: pool của làn được bỏ và tạo lại ở
+  lần dùng sau, việc đang chạy trả về 503 kèm Retry-After
+"""
+import asyncio
+import functools
+import itertools
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.config import (
+    FORMAT_BULK_QUEUE_LIMIT,
+    FORMAT_BULK_QUEUE_TIMEOUT,
+    FORMAT_BULK_WORKERS,
+    FORMAT_FAST_LANE_MAX_COST,
+    FORMAT_FAST_QUEUE_LIMIT,
+    FORMAT_FAST_QUEUE_TIMEOUT,
+    FORMAT_FAST_WORKERS,
+    FORMAT_RETRY_AFTER,
+)
+
+logger = logging.getLogger(__name__)
+
+FAST_LANE = "fast"
+BULK_LANE = "bulk"
+
+
+class ServerBusyError(Exception):
+    """Server đang quá tải; status_code là 429 hoặc 503, retry_after tính bằng giây."""
+
+    def __init__(self, status_code, retry_after, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _Lane:
+    """Một làn xử lý: process pool + semaphore riêng, kèm thống kê hàng đợi."""
+
+    def __init__(self, name, workers, queue_limit, queue_timeout):
+        self.name = name
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self.executor = None
+        self.slots = None
+        self.running = 0
+        self.waiting = {}  # ticket -> thời điểm bắt đầu chờ
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.crashed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def ensure_started(self):
+        if self.executor is None:
+            # "spawn" để worker không kế thừa thread/socket của web server
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.workers)
+
+    def discard_executor(self, broken):
+        """
+        Bỏ pool đã hỏng (worker chết) để ensure_started tạo pool mới.
+        Semaphore được giữ nguyên: các việc đang chạy trên pool cũ vẫn trả slot về đó.
+        """
+        if self.executor is broken:
+            logger.warning("Process pool of the %s lane is broken, starting a new one", self.name)
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def is_full(self):
+        return self.running + len(self.waiting) >= self.workers + self.queue_limit
+
+    def record_wait(self, waited):
+        self.completed += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def release(self):
+        self.running -= 1
+        if self.slots is not None:
+            self.slots.release()
+
+    def stats(self):
+        now = time.monotonic()
+        oldest = max((now - started for started in self.waiting.values()), default=0.0)
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "waiting": len(self.waiting),
+            "queue_limit": self.queue_limit,
+            "started": self.completed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "crashed": self.crashed,
+            "avg_wait_ms": round(self.total_wait / self.completed * 1000, 1) if self.completed else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+            "oldest_waiting_ms": round(oldest * 1000, 1),
+        }
+
+    def shutdown(self, wait=False):
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait, cancel_futures=True)
+            self.executor = None
+            self.slots = None
+
+
+class CpuExecutor:
+    def __init__(self, lanes, fast_lane_max_cost, retry_after):
+        """
+        Args:
+            lanes: {tên làn: (workers, queue_limit, queue_timeout)}, phải có FAST_LANE và BULK_LANE
+            fast_lane_max_cost: Chi phí ước lượng tối đa để được vào làn fast
+            retry_after: Giá trị Retry-After (giây) gửi kèm 429/503
+        """
+        self._lanes = {
+            name: _Lane(name, workers, queue_limit, queue_timeout)
+            for name, (workers, queue_limit, queue_timeout) in lanes.items()
+        }
+        self._fast_lane_max_cost = fast_lane_max_cost
+        self._retry_after = retry_after
+        self._tickets = itertools.count()
+
+    def lane_for(self, cost):
+        """Chọn làn theo chi phí ước lượng; không rõ chi phí thì vào làn bulk."""
+        if cost is not None and cost <= self._fast_lane_max_cost:
+            return FAST_LANE
+        return BULK_LANE
+
+    async def run(self, fn, *args, cost=None, **kwargs):
+        """
+        Chạy fn(*args, **kwargs) trong process pool của làn tương ứng với cost và chờ kết quả.
+        fn và tham số phải pickle được (hàm cấp module, bytes, dict...).
+        """
+        lane = self._lanes[self.lane_for(cost)]
+        lane.ensure_started()
+        if lane.is_full():
+            lane.rejected += 1
+            raise ServerBusyError(429, self._retry_after, f"Too many documents queued in the {lane.name} lane")
+
+        ticket = next(self._tickets)
+        started = time.monotonic()
+        lane.waiting[ticket] = started
+        try:
+            await asyncio.wait_for(lane.slots.acquire(), timeout=lane.queue_timeout)
+        except asyncio.TimeoutError:
+            lane.timed_out += 1
+            raise ServerBusyError(503, self._retry_after, f"Timed out waiting for a {lane.name} lane worker")
+        finally:
+            del lane.waiting[ticket]
+
+        lane.record_wait(time.monotonic() - started)
+        lane.running += 1
+        loop = asyncio.get_running_loop()
+        call = functools.partial(fn, *args, **kwargs)
+        try:
+            try:
+                executor = lane.executor
+                future = executor.submit(call)
+            except BrokenProcessPool:
+                # Pool đã hỏng từ trước, việc này chưa chạy: thử lại một lần trên pool mới
+                lane.discard_executor(executor)
+                lane.ensure_started()
+                executor = lane.executor
+                future = executor.submit(call)
+        except Exception:
+            lane.release()
+            raise
+        # Trả slot khi worker thực sự xong việc, kể cả khi client đã ngắt kết nối
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(lane.release))
+        try:
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            # Worker chết giữa chừng (có thể do chính tài liệu này): không chạy lại
+            lane.crashed += 1
+            lane.discard_executor(executor)
+            raise ServerBusyError(503, self._retry_after, f"A {lane.name} lane worker crashed, please retry")
+
+    def stats(self):
+        return {
+            "fast_lane_max_cost": self._fast_lane_max_cost,
+            "lanes": {name: lane.stats() for name, lane in self._lanes.items()},
+        }
+
+    def shutdown(self, wait=False):
+        for lane in self._lanes.values():
+            lane.shutdown(wait=wait)
+
+
+_cpu_executor = None
+_cpu_executor_lock = threading.Lock()
+
+
+def get_cpu_executor():
+    """Executor dùng chung cho toàn process, process pool của mỗi làn được tạo ở lần dùng đầu."""
+    global _cpu_executor
+    if _cpu_executor is None:
+        with _cpu_executor_lock:
+            if _cpu_executor is None:
+                _cpu_executor = CpuExecutor(
+                    lanes={
+                        FAST_LANE: (FORMAT_FAST_WORKERS, FORMAT_FAST_QUEUE_LIMIT, FORMAT_FAST_QUEUE_TIMEOUT),
+                        BULK_LANE: (FORMAT_BULK_WORKERS, FORMAT_BULK_QUEUE_LIMIT, FORMAT_BULK_QUEUE_TIMEOUT),
+                    },
+                    fast_lane_max_cost=FORMAT_FAST_LANE_MAX_COST,
+                    retry_after=FORMAT_RETRY_AFTER,
+                )
+    return _cpu_executor
@@ -6,6 +6,7 @@ from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
 
 from app.config import PAGE_NUMBER_FONT_SIZE, STANDARD_FONT
+from app.services.docx_run_props import run_props_fragment
 
 
 def _add_page_number_field(run, instr_text):
@@ -58,19 +59,6 @@ def format_page_number_run(run):
     Args:
         run: Run object cần format
     """
-    run.font.name = STANDARD_FONT
-    run.font.size = PAGE_NUMBER_FONT_SIZE
-    
-    # Đảm bảo tất cả các loại font đều được set
-    rPr = run._element.get_or_add_rPr()
-    rFonts = rPr.find(qn('w:rFonts'))
-    if rFonts is None:
-        rFonts = OxmlElement('w:rFonts')
-        rPr.append(rFonts)
-    
-    # Set tất cả các loại font về STANDARD_FONT
-    rFonts.set(qn('w:ascii'), STANDARD_FONT)
-    rFonts.set(qn('w:hAnsi'), STANDARD_FONT)
-    rFonts.set(qn('w:cs'), STANDARD_FONT)
-    rFonts.set(qn('w:eastAsia'), STANDARD_FONT)
+    # Đảm bảo tất cả các loại font đều được set về STANDARD_FONT
+    run_props_fragment(STANDARD_FONT, PAGE_NUMBER_FONT_SIZE).apply_to_run(run)
 
@@ -0,0 +1,198 @@
+"""
+Module nhận diện nội dung do formatter sinh ra, để định dạng lại một tài liệu
+đã định dạng mà không bị chèn trùng
+- Vùng Mục lục / Danh mục bảng biểu / Danh mục hình ảnh được bọc bằng bookmark
+  ẩn TOC_BOOKMARK (tên bắt đầu bằng "_" nên Word không hiển thị, nhưng vẫn giữ
+  khi mở/lưu). Lần định dạng sau tìm lại vùng này, xóa đi và chèn vùng mới
+  vào đúng chỗ cũ.
+- Sau khi định dạng, dấu (SHA-256 của body ngoài vùng sinh ra + styles + options +
+  fingerprint cấu hình/mã nguồn) được ghi vào biến tài liệu (w:docVar trong
+  settings.xml). Nếu tài liệu không đổi kể từ lần định dạng trước thì dấu trùng
+  khớp và mọi stage được bỏ qua.
+"""
+import hashlib
+import json
+
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from lxml import etree
+
+from app.services.result_cache import CONFIG_FINGERPRINT
+
+TOC_BOOKMARK = "_EasyWordTOC"
+STAMP_VARIABLE = "EasyWordFormatStamp"
+
+# Tài liệu định dạng bằng phiên bản cũ (chưa có bookmark): vùng mục lục bắt đầu
+# bằng paragraph "MỤC LỤC" đầu body và kết thúc ở paragraph ngắt section ngay
+# sau dòng ghi chú
+LEGACY_TOC_TITLE = "MỤC LỤC"
+LEGACY_HINT_PREFIX = "(* Lưu ý: Mục lục được tạo thủ công"
+
+P_TAG = qn("w:p")
+T_TAG = qn("w:t")
+PPR_TAG = qn("w:pPr")
+SECTPR_TAG = qn("w:sectPr")
+BOOKMARK_START = qn("w:bookmarkStart")
+BOOKMARK_END = qn("w:bookmarkEnd")
+HEADER_REFERENCE = qn("w:headerReference")
+FOOTER_REFERENCE = qn("w:footerReference")
+R_ID = qn("r:id")
+DOC_VARS = qn("w:docVars")
+DOC_VAR = qn("w:docVar")
+W_ID = qn("w:id")
+W_NAME = qn("w:name")
+W_VAL = qn("w:val")
+
+# Các phần tử đứng sau w:docVars trong w:settings (thứ tự theo schema)
+_DOC_VARS_SUCCESSORS = (
+    "w:rsids", "m:mathPr", "w:attachedSchema", "w:themeFontLang", "w:clrSchemeMapping",
+    "w:doNotIncludeSubdocsInStats", "w:doNotAutoCompressPictures", "w:forceUpgrade",
+    "w:captions", "w:readModeInkLockDown", "w:smartTagType", "sl:schemaLibrary",
+    "w:shapeDefaults", "w:doNotEmbedSmartTags", "w:decimalSymbol", "w:listSeparator",
+)
+
+
+def _paragraph_text(p):
+    return "".join(t.text or "" for t in p.iter(T_TAG))
+
+
+def _next_bookmark_id(body):
+    ids = [int(value) for value in body.xpath(".//w:bookmarkStart/@w:id") if value.lstrip("-").isdigit()]
+    return max(ids, default=0) + 1
+
+
+def mark_generated_region(first_p, last_p):
+    """Bọc vùng từ paragraph first_p tới last_p (phần tử con của body) bằng bookmark TOC_BOOKMARK."""
+    body = first_p.getparent()
+    bookmark_id = str(_next_bookmark_id(body))
+
+    start = OxmlElement("w:bookmarkStart")
+    start.set(W_ID, bookmark_id)
+    start.set(W_NAME, TOC_BOOKMARK)
+    p_pr = first_p.find(PPR_TAG)
+    if p_pr is not None:
+        p_pr.addnext(start)
+    else:
+        first_p.insert(0, start)
+
+    end = OxmlElement("w:bookmarkEnd")
+    end.set(W_ID, bookmark_id)
+    last_p.append(end)
+
+
+def _find_marked_region(body):
+    for start in body.iterfind(f"{P_TAG}/{BOOKMARK_START}"):
+        if start.get(W_NAME) != TOC_BOOKMARK:
+            continue
+        first = start.getparent()
+        bookmark_id = start.get(W_ID)
+        # bookmarkEnd nằm ở chính paragraph đầu hoặc một paragraph phía sau
+        for element in (first, *first.itersiblings()):
+            if element.tag != P_TAG:
+                continue
+            for end in element.iterchildren(BOOKMARK_END):
+                if end.get(W_ID) == bookmark_id:
+                    return first, element
+        return None
+    return None
+
+
+def _find_legacy_region(body):
+    first = body.find(P_TAG)
+    if first is None or _paragraph_text(first).strip() != LEGACY_TOC_TITLE:
+        return None
+    for element in first.itersiblings():
+        if element.tag != P_TAG or not _paragraph_text(element).startswith(LEGACY_HINT_PREFIX):
+            continue
+        last = element.getnext()
+        if last is None or last.tag != P_TAG:
+            return None
+        p_pr = last.find(PPR_TAG)
+        if p_pr is None or p_pr.find(SECTPR_TAG) is None:
+            return None
+        return first, last
+    return None
+
+
+def find_generated_region(doc):
+    """
+    Vùng mục lục do formatter chèn ở lần định dạng trước.
+    Returns: (phần tử đầu, phần tử cuối) - đều là con trực tiếp của body - hoặc None
+    """
+    body = doc.element.body
+    return _find_marked_region(body) or _find_legacy_region(body)
+
+
+def remove_generated_region(doc, region):
+    """
+    Xóa vùng (kể cả section break ở paragraph cuối). Header/footer chỉ được
+    section của vùng tham chiếu cũng bị bỏ khỏi package, tránh mỗi lần định
+    dạng lại để thừa một part footer.
+    Returns: phần tử đứng ngay sau vùng (để chèn vùng mới vào đúng chỗ), hoặc None
+    """
+    first, last = region
+    body = first.getparent()
+    anchor = last.getnext()
+    start, stop = body.index(first), body.index(last)
+    removed = body[start:stop + 1]
+    r_ids = {
+        reference.get(R_ID)
+        for element in removed
+        for reference in element.iter(HEADER_REFERENCE, FOOTER_REFERENCE)
+    }
+    for r_id in r_ids:
+        # Gọi trước khi xóa vùng: drop_rel chỉ bỏ quan hệ khi số tham chiếu < 2,
+        # tức là tham chiếu duy nhất còn lại nằm trong vùng sắp xóa
+        doc.part.drop_rel(r_id)
+    del body[start:stop + 1]
+    return anchor
+
+
+def format_stamp(doc, options, region=None):
+    """
+    SHA-256 của nội dung ảnh hưởng tới kết quả định dạng: các phần tử body ngoài
+    region, styles.xml, options và CONFIG_FINGERPRINT.
+    Dùng C14N (exclusive) để dấu không phụ thuộc khai báo namespace/thứ tự thuộc
+    tính sau khi lưu rồi mở lại.
+    """
+    digest = hashlib.sha256()
+    inside = False
+    first, last = region if region is not None else (None, None)
+    for element in doc.element.body:
+        if element is first:
+            inside = True
+        if not inside:
+            digest.update(etree.tostring(element, method="c14n", exclusive=True))
+        if element is last:
+            inside = False
+    digest.update(etree.tostring(doc.styles.element, method="c14n", exclusive=True))
+    digest.update(json.dumps(options, sort_keys=True, default=str).encode("utf-8"))
+    digest.update(CONFIG_FINGERPRINT.encode("ascii"))
+    return digest.hexdigest()
+
+
+def read_format_stamp(doc):
+    """Dấu đã ghi ở lần định dạng trước (None nếu tài liệu chưa từng qua formatter)."""
+    doc_vars = doc.settings.element.find(DOC_VARS)
+    if doc_vars is None:
+        return None
+    for doc_var in doc_vars.iterfind(DOC_VAR):
+        if doc_var.get(W_NAME) == STAMP_VARIABLE:
+            return doc_var.get(W_VAL)
+    return None
+
+
+def write_format_stamp(doc, stamp):
+    settings = doc.settings.element
+    doc_vars = settings.find(DOC_VARS)
+    if doc_vars is None:
+        doc_vars = OxmlElement("w:docVars")
+        settings.insert_element_before(doc_vars, *_DOC_VARS_SUCCESSORS)
+    for doc_var in doc_vars.iterfind(DOC_VAR):
+        if doc_var.get(W_NAME) == STAMP_VARIABLE:
+            doc_var.set(W_VAL, stamp)
+            return
+    doc_var = OxmlElement("w:docVar")
+    doc_var.set(W_NAME, STAMP_VARIABLE)
+    doc_var.set(W_VAL, stamp)
+    doc_vars.append(doc_var)
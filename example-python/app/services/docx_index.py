@@ -0,0 +1,138 @@
+"""
+Module chỉ mục cấu trúc của document (structural index)
+Quét body MỘT LẦN để ghi nhận: paragraph/run chứa hình ảnh, field instruction,
+numPr (danh sách Word) và vị trí sectPr. Các stage đọc từ chỉ mục thay vì
+chạy xpath lặp lại trên từng paragraph/run.
+"""
+from docx.oxml.ns import qn
+
+W_P = qn("w:p")
+W_R = qn("w:r")
+W_PPR = qn("w:pPr")
+W_BODY = qn("w:body")
+W_DRAWING = qn("w:drawing")
+W_PICT = qn("w:pict")
+W_INSTR_TEXT = qn("w:instrText")
+W_FLD_SIMPLE = qn("w:fldSimple")
+W_NUM_PR = qn("w:numPr")
+W_SECT_PR = qn("w:sectPr")
+W_INSTR = qn("w:instr")
+
+_INDEXED_TAGS = (W_DRAWING, W_PICT, W_INSTR_TEXT, W_FLD_SIMPLE, W_NUM_PR, W_SECT_PR)
+
+
+class DocumentIndex:
+    """
+    Chỉ mục cấu trúc cho một Document, được xây dựng lười (lazy) khi truy vấn lần đầu.
+
+    Stage nào chèn/xóa phần tử làm thay đổi cấu trúc phải gọi invalidate()
+    (toàn bộ) hoặc refresh_paragraph() (chỉ một paragraph) để chỉ mục đúng.
+    """
+
+    def __init__(self, doc):
+        self._body = doc.element.body
+        self._built = False
+
+    def invalidate(self):
+        """Đánh dấu chỉ mục đã cũ, sẽ quét lại body ở lần truy vấn tiếp theo."""
+        self._built = False
+
+    def _ensure_built(self):
+        if self._built:
+            return
+        self._image_paragraphs = set()
+        self._image_runs = set()
+        self._fields = {}
+        self._numbered_paragraphs = set()
+        self._section_paragraphs = []
+        self._has_body_sect_pr = False
+        self._scan(self._body)
+        self._built = True
+
+    def _scan(self, root):
+        for element in root.iter(*_INDEXED_TAGS):
+            tag = element.tag
+            if tag == W_DRAWING or tag == W_PICT:
+                for ancestor in element.iterancestors(W_P, W_R):
+                    if ancestor.tag == W_P:
+                        self._image_paragraphs.add(ancestor)
+                    else:
+                        self._image_runs.add(ancestor)
+            elif tag == W_INSTR_TEXT:
+                run = element.getparent()
+                paragraph = run.getparent() if run is not None else None
+                if paragraph is not None and paragraph.tag == W_P:
+                    self._fields.setdefault(paragraph, []).append((run, "complex", element.text or ""))
+            elif tag == W_FLD_SIMPLE:
+                parent = element.getparent()
+                run = parent if parent.tag == W_R else None
+                paragraph = next(element.iterancestors(W_P), None)
+                if paragraph is not None:
+                    self._fields.setdefault(paragraph, []).append((run, "simple", element.get(W_INSTR) or ""))
+            elif tag == W_NUM_PR:
+                p_pr = element.getparent()
+                if p_pr.tag == W_PPR and p_pr.getparent() is not None and p_pr.getparent().tag == W_P:
+                    self._numbered_paragraphs.add(p_pr.getparent())
+            else:  # W_SECT_PR
+                parent = element.getparent()
+                if parent is self._body:
+                    self._has_body_sect_pr = True
+                elif parent.tag == W_PPR:
+                    paragraph = parent.getparent()
+                    if paragraph is not None and paragraph.getparent() is self._body:
+                        self._section_paragraphs.append(paragraph)
+
+    def refresh_paragraph(self, p):
+        """Quét lại riêng một paragraph sau khi stage thay đổi nội dung của nó."""
+        if not self._built:
+            return
+        self._image_paragraphs.discard(p)
+        for run in p.iter(W_R):
+            self._image_runs.discard(run)
+        self._fields.pop(p, None)
+        self._numbered_paragraphs.discard(p)
+        if p in self._section_paragraphs:
+            self._section_paragraphs.remove(p)
+        self._scan(p)
+
+    # ------------------------------------------------------------------
+    # Truy vấn
+    # ------------------------------------------------------------------
+    def paragraph_has_image(self, p):
+        self._ensure_built()
+        return p in self._image_paragraphs
+
+    def run_has_image(self, r):
+        self._ensure_built()
+        return r in self._image_runs
+
+    def paragraph_fields(self, p):
+        """
+        Danh sách field của paragraph: (run hoặc None, kind, instruction)
+        kind là "simple" (w:fldSimple) hoặc "complex" (w:instrText).
+        Chỉ trả về các field còn nằm trong paragraph.
+        """
+        self._ensure_built()
+        fields = self._fields.get(p)
+        if not fields:
+            return []
+        return [
+            (run, kind, instr)
+            for run, kind, instr in fields
+            if run is None or run.getparent() is p
+        ]
+
+    def paragraph_is_numbered(self, p):
+        self._ensure_built()
+        return p in self._numbered_paragraphs
+
+    @property
+    def section_paragraphs(self):
+        """Các paragraph ở cấp body mang sectPr (section break)."""
+        self._ensure_built()
+        return [p for p in self._section_paragraphs if p.getparent() is self._body]
+
+    @property
+    def section_count(self):
+        """Số section của document, tương đương len(doc.sections)."""
+        return len(self.section_paragraphs) + (1 if self._has_body_sect_pr else 0)
@@ -0,0 +1,163 @@
+"""
+Module ghi gói .docx: chỉ serialize lại các part đã thay đổi
+doc.save() của python-docx nén lại (deflate) MỌI part, kể cả ảnh word/media/*
+mà formatter không hề động tới. Ở đây:
+- Part XML (document.xml, styles.xml, footer, settings.xml...) được serialize và nén lại
+- Part nhị phân còn nguyên nội dung (cùng CRC + kích thước với file gốc) được copy
+  nguyên khối dữ liệu đã nén từ file gốc, không giải nén/nén lại. Việc này ghi
+  thẳng vào trạng thái nội bộ của zipfile.ZipFile nên chỉ bật khi raw_copy_supported()
+  (ghi thử rồi đọc lại) đúng; ngược lại part được ghi bằng writestr với kiểu nén gốc
+- Mức nén deflate cho các part ghi mới có thể chỉnh theo từng request
+Thứ tự và nội dung các part giống hệt doc.save().
+"""
+import logging
+import struct
+import zipfile
+import zlib
+from functools import lru_cache
+from io import BytesIO
+
+from docx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI
+from docx.opc.part import XmlPart
+from docx.opc.pkgwriter import _ContentTypesItem
+
+from app.config import DOCX_DEFLATE_LEVEL
+
+# Local file header: 30 byte cố định (2 trường cuối là độ dài tên file và extra)
+_LOCAL_HEADER_SIZE = 30
+_LOCAL_HEADER_NAME_LENGTHS = struct.Struct("<HH")
+_DATA_DESCRIPTOR_FLAG = 0x08
+# Thuộc tính nội bộ của ZipFile mà _write_raw_member cập nhật
+_RAW_COPY_ZIPFILE_ATTRS = ("fp", "filelist", "NameToInfo", "start_dir")
+
+
+def _read_raw_member(source, info):
+    """Đọc khối dữ liệu đã nén (chưa giải nén) của một member trong file zip gốc."""
+    source.fp.seek(info.header_offset)
+    header = source.fp.read(_LOCAL_HEADER_SIZE)
+    if header[:4] != b"PK\x03\x04":
+        raise zipfile.BadZipFile(f"Bad local header for {info.filename}")
+    name_length, extra_length = _LOCAL_HEADER_NAME_LENGTHS.unpack(header[26:30])
+    source.fp.seek(name_length + extra_length, 1)
+    return source.fp.read(info.compress_size)
+
+
+def _write_raw_member(target, info, raw):
+    """Ghi khối dữ liệu đã nén vào zip đích, giữ nguyên CRC/kích thước/kiểu nén."""
+    zinfo = zipfile.ZipInfo(info.filename, info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+    zinfo.external_attr = info.external_attr
+    # CRC và kích thước đã nằm trong local header nên không cần data descriptor
+    zinfo.flag_bits = info.flag_bits & ~_DATA_DESCRIPTOR_FLAG
+    zinfo.header_offset = target.fp.tell()
+    target.fp.write(zinfo.FileHeader(zip64=zinfo.file_size > zipfile.ZIP64_LIMIT))
+    target.fp.write(raw)
+    target.filelist.append(zinfo)
+    target.NameToInfo[zinfo.filename] = zinfo
+    target.start_dir = target.fp.tell()
+
+
+@lru_cache(maxsize=None)
+def raw_copy_supported():
+    """
+    Kiểm tra (một lần mỗi process) _write_raw_member còn dùng được với zipfile
+    của phiên bản Python đang chạy: copy nguyên một member sang zip trong RAM,
+    ghi thêm một member bằng writestr, rồi đọc lại và kiểm tra CRC của cả hai.
+    """
+    if not hasattr(zipfile.ZipInfo, "FileHeader"):
+        return False
+    data = b"raw member copy probe " * 16
+    try:
+        source_buffer = BytesIO()
+        with zipfile.ZipFile(source_buffer, "w", zipfile.ZIP_DEFLATED) as source:
+            source.writestr("probe.bin", data)
+        target_buffer = BytesIO()
+        with zipfile.ZipFile(source_buffer) as source, zipfile.ZipFile(target_buffer, "w") as target:
+            if not all(hasattr(target, attr) for attr in _RAW_COPY_ZIPFILE_ATTRS):
+                return False
+            info = source.getinfo("probe.bin")
+            _write_raw_member(target, info, _read_raw_member(source, info))
+            # Member ghi sau phải nằm đúng sau khối vừa copy
+            target.writestr("after.bin", data)
+        with zipfile.ZipFile(target_buffer) as check:
+            return (
+                check.testzip() is None
+                and check.read("probe.bin") == data
+                and check.read("after.bin") == data
+            )
+    except Exception as exc:
+        logging.warning(f"Raw zip member copy disabled: {exc}")
+        return False
+
+
+def _unchanged_member(part, source_infos):
+    """Trả về ZipInfo gốc nếu part nhị phân chưa đổi nội dung so với file gốc."""
+    if isinstance(part, XmlPart):
+        return None
+    info = source_infos.get(part.partname.membername)
+    if info is None or info.flag_bits & 0x01:  # không copy member bị mã hóa
+        return None
+    blob = part.blob
+    if len(blob) != info.file_size or zlib.crc32(blob) != info.CRC:
+        return None
+    return info
+
+
+def deflate_level_from_options(options):
+    """Mức nén (0-9) lấy từ options['deflate_level'], mặc định DOCX_DEFLATE_LEVEL."""
+    level = (options or {}).get("deflate_level", DOCX_DEFLATE_LEVEL)
+    try:
+        return min(9, max(0, int(level)))
+    except (TypeError, ValueError):
+        return DOCX_DEFLATE_LEVEL
+
+
+def save_document(doc, output, source=None, deflate_level=DOCX_DEFLATE_LEVEL):
+    """
+    Ghi doc ra output (file-like hoặc đường dẫn), tương đương doc.save(output).
+
+    Args:
+        doc: Document cần lưu
+        output: File-like có thể ghi (BytesIO, file) hoặc đường dẫn
+        source: File-like/đường dẫn của .docx gốc để copy nguyên các part không đổi
+        deflate_level: Mức nén 0-9 cho các part phải ghi mới (0 = không nén)
+
+    Returns: (số part copy nguyên, số part ghi mới)
+    """
+    package = doc.part.package
+    parts = list(package.iter_parts())
+    compression = zipfile.ZIP_DEFLATED if deflate_level else zipfile.ZIP_STORED
+    copied = written = 0
+
+    source_zip = zipfile.ZipFile(source) if source is not None else None
+    raw_copy = source_zip is not None and raw_copy_supported()
+    try:
+        source_infos = {info.filename: info for info in source_zip.infolist()} if source_zip else {}
+        with zipfile.ZipFile(output, "w", compression=compression, compresslevel=deflate_level or None) as target:
+
+            def write(pack_uri, blob):
+                target.writestr(pack_uri.membername, blob)
+
+            write(CONTENT_TYPES_URI, _ContentTypesItem.from_parts(parts).blob)
+            write(PACKAGE_URI.rels_uri, package.rels.xml)
+            for part in parts:
+                info = _unchanged_member(part, source_infos)
+                if info is not None and raw_copy:
+                    _write_raw_member(target, info, _read_raw_member(source_zip, info))
+                    copied += 1
+                elif info is not None:
+                    # Giữ kiểu nén gốc (ảnh thường được lưu không nén)
+                    target.writestr(part.partname.membername, part.blob, compress_type=info.compress_type)
+                    written += 1
+                else:
+                    write(part.partname, part.blob)
+                    written += 1
+                if len(part.rels):
+                    write(part.partname.rels_uri, part.rels.xml)
+    finally:
+        if source_zip is not None:
+            source_zip.close()
+    return copied, written
@@ -0,0 +1,157 @@
+"""
+Module kiểm tra nhanh (pre-flight) file .docx trước khi parse
+Chỉ đọc central directory của file ZIP và một đoạn đầu của word/document.xml,
+nên chạy trong vài mili giây kể cả với file rất lớn:
+- Từ chối file không phải ZIP, thiếu part bắt buộc, bị mã hóa, ZIP bomb,
+  document.xml quá lớn
+- Báo cáo kích thước các part, số ảnh, số đoạn văn ước lượng, chi phí xử lý
+  ước lượng và phân loại small/medium/large để xếp lịch xử lý
+"""
+import re
+import zipfile
+import zlib
+
+from app.config import (
+    PREFLIGHT_LARGE_PARAGRAPHS,
+    PREFLIGHT_MAX_COMPRESSION_RATIO,
+    PREFLIGHT_MAX_DOCUMENT_XML_BYTES,
+    PREFLIGHT_MAX_MEMBERS,
+    PREFLIGHT_SAMPLE_BYTES,
+    PREFLIGHT_SMALL_PARAGRAPHS,
+    UPLOAD_MAX_DECOMPRESSED_BYTES,
+)
+from app.services.uploads import UploadTooLargeError, open_source
+
+DOCUMENT_PART = "word/document.xml"
+REQUIRED_PARTS = ("[Content_Types].xml", DOCUMENT_PART)
+MEDIA_PREFIX = "word/media/"
+
+# Chỉ áp dụng kiểm tra tỉ lệ nén cho part đủ lớn (XML nhỏ nén rất tốt là bình thường)
+_RATIO_CHECK_MIN_BYTES = 1024 * 1024
+
+# <w:p>, <w:p ...> hoặc <w:p/> - không khớp <w:pPr>, <w:proofErr>...
+_PARAGRAPH_PATTERN = re.compile(rb"<w:p[\s>/]")
+_TABLE_PATTERN = re.compile(rb"<w:tbl[\s>]")
+
+# Trọng số chi phí (đơn vị "điểm" ~ thời gian định dạng một đoạn văn)
+_COST_PER_TABLE = 20
+_COST_XML_BYTES_PER_POINT = 4096
+_COST_UPLOAD_BYTES_PER_POINT = 256 * 1024
+
+
+class InvalidDocumentError(ValueError):
+    """File upload không phải .docx hợp lệ (trả về HTTP 400)."""
+
+
+def _sample_document_xml(archive, info):
+    """Đọc tối đa PREFLIGHT_SAMPLE_BYTES đầu của document.xml (đã giải nén)."""
+    with archive.open(info) as part:
+        return part.read(PREFLIGHT_SAMPLE_BYTES)
+
+
+def _size_class(paragraphs):
+    if paragraphs <= PREFLIGHT_SMALL_PARAGRAPHS:
+        return "small"
+    if paragraphs <= PREFLIGHT_LARGE_PARAGRAPHS:
+        return "medium"
+    return "large"
+
+
+def estimate_cost(report):
+    """
+    Ước lượng chi phí định dạng từ báo cáo pre-flight: chủ yếu theo số đoạn văn/bảng,
+    cộng thêm phần theo kích thước XML (parse/serialize) và dung lượng upload (I/O).
+    """
+    xml_bytes = report["uncompressed_bytes"] - report["image_bytes"]
+    return (
+        report["estimated_paragraphs"]
+        + report["estimated_tables"] * _COST_PER_TABLE
+        + xml_bytes // _COST_XML_BYTES_PER_POINT
+        + report["compressed_bytes"] // _COST_UPLOAD_BYTES_PER_POINT
+    )
+
+
+def preflight_docx(source, max_decompressed=UPLOAD_MAX_DECOMPRESSED_BYTES):
+    """
+    Kiểm tra nhanh gói .docx và trả về báo cáo dạng dict.
+
+    Args:
+        source: File .docx (bytes, đường dẫn hoặc file-like có seek)
+        max_decompressed: Tổng dung lượng giải nén tối đa (bytes)
+
+    Raises:
+        InvalidDocumentError: File hỏng/không phải .docx
+        UploadTooLargeError: Vượt giới hạn dung lượng hoặc nghi ZIP bomb
+    """
+    try:
+        archive = zipfile.ZipFile(open_source(source))
+    except (zipfile.BadZipFile, EOFError) as exc:
+        raise InvalidDocumentError(f"Not a valid .docx (ZIP) file: {exc}") from exc
+
+    with archive:
+        infos = archive.infolist()
+        if len(infos) > PREFLIGHT_MAX_MEMBERS:
+            raise InvalidDocumentError(f"Package has {len(infos)} parts, limit is {PREFLIGHT_MAX_MEMBERS}")
+
+        members = {info.filename: info for info in infos}
+        missing = [name for name in REQUIRED_PARTS if name not in members]
+        if missing:
+            raise InvalidDocumentError(f"Missing required part(s): {', '.join(missing)}")
+
+        total_compressed = total_uncompressed = 0
+        image_count = image_bytes = 0
+        for info in infos:
+            if info.flag_bits & 0x01:
+                raise InvalidDocumentError(f"Encrypted part: {info.filename}")
+            total_compressed += info.compress_size
+            total_uncompressed += info.file_size
+            if info.file_size >= _RATIO_CHECK_MIN_BYTES:
+                ratio = info.file_size / max(info.compress_size, 1)
+                if ratio > PREFLIGHT_MAX_COMPRESSION_RATIO:
+                    raise UploadTooLargeError(
+                        f"Part {info.filename} has compression ratio {ratio:.0f}:1", max_decompressed
+                    )
+            if info.filename.startswith(MEDIA_PREFIX):
+                image_count += 1
+                image_bytes += info.file_size
+
+        if total_uncompressed > max_decompressed:
+            raise UploadTooLargeError(
+                f"Document expands to {total_uncompressed} bytes, limit is {max_decompressed}",
+                max_decompressed,
+            )
+
+        document_info = members[DOCUMENT_PART]
+        if document_info.file_size > PREFLIGHT_MAX_DOCUMENT_XML_BYTES:
+            raise UploadTooLargeError(
+                f"{DOCUMENT_PART} is {document_info.file_size} bytes, limit is {PREFLIGHT_MAX_DOCUMENT_XML_BYTES}",
+                PREFLIGHT_MAX_DOCUMENT_XML_BYTES,
+            )
+
+        try:
+            sample = _sample_document_xml(archive, document_info)
+        except (zipfile.BadZipFile, zlib.error, EOFError) as exc:
+            raise InvalidDocumentError(f"Cannot read {DOCUMENT_PART}: {exc}") from exc
+        if b"wordprocessingml" not in sample:
+            raise InvalidDocumentError(f"{DOCUMENT_PART} is not a WordprocessingML document")
+
+    # Ngoại suy số đoạn văn/bảng từ phần mẫu theo kích thước document.xml
+    scale = document_info.file_size / max(len(sample), 1)
+    paragraphs = round(len(_PARAGRAPH_PATTERN.findall(sample)) * scale)
+    tables = round(len(_TABLE_PATTERN.findall(sample)) * scale)
+
+    report = {
+        "parts": {info.filename: {"compressed": info.compress_size, "size": info.file_size} for info in infos},
+        "part_count": len(infos),
+        "compressed_bytes": total_compressed,
+        "uncompressed_bytes": total_uncompressed,
+        "document_xml_bytes": document_info.file_size,
+        "image_count": image_count,
+        "image_bytes": image_bytes,
+        "estimated_paragraphs": paragraphs,
+        "estimated_tables": tables,
+        "estimate_exact": len(sample) >= document_info.file_size,
+        "size_class": _size_class(paragraphs),
+    }
+    report["estimated_cost"] = estimate_cost(report)
+    return report
@@ -0,0 +1,189 @@
+"""
+Module dựng sẵn (prebuilt) các fragment rPr cho run và style
+Mỗi tổ hợp (font, cỡ chữ, đậm, nghiêng, màu) được biên dịch MỘT LẦN thành danh
+sách thao tác với các phần tử mẫu (rFonts, sz, szCs, b, i, color) đã tạo sẵn.
+Khi áp dụng chỉ cần clone phần tử mẫu và chèn vào rPr, không gọi qn() hay tính
+lại half-points cho từng run.
+
+Kết quả XML giống hệt khi gọi run.font.* của python-docx rồi force set trong XML:
+- Thao tác "merge" giữ phần tử có sẵn, chỉ ghi đè thuộc tính (như get_or_add_*)
+- Thao tác "force" xóa rFonts/sz/szCs cũ, chèn rFonts vào đầu và sz/szCs vào cuối
+"""
+from copy import deepcopy
+from functools import lru_cache
+
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+
+W_RPR = qn("w:rPr")
+W_VAL = qn("w:val")
+W_RFONTS = qn("w:rFonts")
+W_SZ = qn("w:sz")
+W_SZ_CS = qn("w:szCs")
+
+# Thứ tự phần tử con của rPr theo schema (giống CT_RPr._tag_seq của python-docx),
+# dùng để chèn đúng vị trí như các hàm get_or_add_*
+_RPR_TAG_SEQUENCE = (
+    "w:rStyle", "w:rFonts", "w:b", "w:bCs", "w:i", "w:iCs", "w:caps", "w:smallCaps",
+    "w:strike", "w:dstrike", "w:outline", "w:shadow", "w:emboss", "w:imprint",
+    "w:noProof", "w:snapToGrid", "w:vanish", "w:webHidden", "w:color", "w:spacing",
+    "w:w", "w:kern", "w:position", "w:sz", "w:szCs", "w:highlight", "w:u", "w:effect",
+    "w:bdr", "w:shd", "w:fitText", "w:vertAlign", "w:rtl", "w:cs", "w:em", "w:lang",
+    "w:eastAsianLayout", "w:specVanish", "w:oMath",
+)
+_RPR_RANK = {qn(tag): rank for rank, tag in enumerate(_RPR_TAG_SEQUENCE)}
+
+_MERGE = "merge"
+_MERGE_APPEND = "merge_append"
+_REPLACE = "replace"
+_FORCE = "force"
+
+
+def _insert_in_sequence(r_pr, element):
+    """
+    Chèn element vào rPr trước phần tử đứng sau nó theo schema,
+    tương đương BaseOxmlElement.insert_element_before(element, *successors).
+    """
+    own_rank = _RPR_RANK[element.tag]
+    successor = None
+    best_rank = len(_RPR_RANK)
+    for child in r_pr:
+        rank = _RPR_RANK.get(child.tag)
+        if rank is not None and own_rank < rank < best_rank:
+            successor = child
+            best_rank = rank
+    if successor is not None:
+        successor.addprevious(element)
+    else:
+        r_pr.append(element)
+
+
+def _font_attrs(font_name, order):
+    return tuple((qn(f"w:{name}"), font_name) for name in order)
+
+
+def _make_element(tag, attrs):
+    element = OxmlElement(tag)
+    for key, value in attrs:
+        if value is not None:
+            element.set(key, value)
+    return element
+
+
+class RunPropsFragment:
+    """
+    Fragment rPr đã biên dịch sẵn.
+    apply_to_run() dùng cho run, apply_to_rpr() dùng cho rPr bất kỳ (vd: của style).
+    """
+
+    __slots__ = ("_ops", "_template")
+
+    def __init__(self, ops):
+        self._ops = ops
+        # rPr hoàn chỉnh cho run chưa có rPr - chỉ cần clone một lần
+        template = OxmlElement("w:rPr")
+        self._apply_ops(template)
+        self._template = template
+
+    def _apply_ops(self, r_pr):
+        for kind, tag, element, attrs in self._ops:
+            if kind == _FORCE:
+                for old in r_pr.findall(W_RFONTS) + r_pr.findall(W_SZ) + r_pr.findall(W_SZ_CS):
+                    r_pr.remove(old)
+                r_fonts, sz, sz_cs = element
+                r_pr.insert(0, deepcopy(r_fonts))
+                r_pr.append(deepcopy(sz))
+                r_pr.append(deepcopy(sz_cs))
+            elif kind == _REPLACE:
+                for old in r_pr.findall(tag):
+                    r_pr.remove(old)
+                _insert_in_sequence(r_pr, deepcopy(element))
+            else:
+                existing = r_pr.find(tag)
+                if existing is None:
+                    if kind == _MERGE_APPEND:
+                        r_pr.append(deepcopy(element))
+                    else:
+                        _insert_in_sequence(r_pr, deepcopy(element))
+                    continue
+                for key, value in attrs:
+                    if value is None:
+                        existing.attrib.pop(key, None)
+                    else:
+                        existing.set(key, value)
+
+    def apply_to_rpr(self, r_pr):
+        self._apply_ops(r_pr)
+
+    def apply_to_run(self, run):
+        """Áp dụng fragment cho một Run (hoặc phần tử w:r)."""
+        r = getattr(run, "_element", run)
+        r_pr = r.find(W_RPR)
+        if r_pr is None:
+            r.insert(0, deepcopy(self._template))
+        elif len(r_pr) == 0 and not r_pr.attrib:
+            r.replace(r_pr, deepcopy(self._template))
+        else:
+            self._apply_ops(r_pr)
+
+
+def _half_points(size):
+    return str(int(size.pt * 2))
+
+
+def _bool_attrs(value):
+    # python-docx bỏ thuộc tính w:val khi bằng True (giá trị mặc định)
+    return ((W_VAL, None if value else "0"),)
+
+
+@lru_cache(maxsize=None)
+def run_props_fragment(font_name=None, size=None, bold=None, italic=None, color=None, force_xml=False):
+    """
+    Fragment tương đương chuỗi lệnh:
+        run.font.name = font_name; run.font.size = size
+        run.font.bold = bold; run.font.italic = italic; run.font.color.rgb = color
+        _ensure_east_asia_font(run)
+        [force set rFonts/sz/szCs trong XML nếu force_xml]
+    Tham số None sẽ được bỏ qua (giữ nguyên giá trị cũ của run).
+    """
+    ops = []
+    if font_name is not None:
+        attrs = _font_attrs(font_name, ("ascii", "hAnsi", "cs", "eastAsia"))
+        ops.append((_MERGE, W_RFONTS, _make_element("w:rFonts", attrs), attrs))
+    if size is not None:
+        attrs = ((W_VAL, _half_points(size)),)
+        ops.append((_MERGE, W_SZ, _make_element("w:sz", attrs), attrs))
+    if bold is not None:
+        attrs = _bool_attrs(bold)
+        ops.append((_MERGE, qn("w:b"), _make_element("w:b", attrs), attrs))
+    if italic is not None:
+        attrs = _bool_attrs(italic)
+        ops.append((_MERGE, qn("w:i"), _make_element("w:i", attrs), attrs))
+    if color is not None:
+        attrs = ((W_VAL, str(color)),)
+        ops.append((_REPLACE, qn("w:color"), _make_element("w:color", attrs), attrs))
+    if force_xml:
+        ops.extend(forced_font_fragment(font_name, size)._ops)
+    return RunPropsFragment(tuple(ops))
+
+
+@lru_cache(maxsize=None)
+def forced_font_fragment(font_name, size):
+    """
+    Fragment force set font trong XML: xóa rFonts/sz/szCs cũ,
+    chèn rFonts (ascii, hAnsi, eastAsia, cs) vào đầu rPr và sz/szCs vào cuối.
+    """
+    half_points = ((W_VAL, _half_points(size)),)
+    elements = (
+        _make_element("w:rFonts", _font_attrs(font_name, ("ascii", "hAnsi", "eastAsia", "cs"))),
+        _make_element("w:sz", half_points),
+        _make_element("w:szCs", half_points),
+    )
+    return RunPropsFragment(((_FORCE, None, elements, None),))
+
+
+@lru_cache(maxsize=None)
+def east_asia_fragment(font_name):
+    """Fragment set đủ 4 loại font (ascii, hAnsi, cs, eastAsia) trên rFonts có sẵn hoặc mới."""
+    attrs = _font_attrs(font_name, ("ascii", "hAnsi", "cs", "eastAsia"))
+    return RunPropsFragment(((_MERGE_APPEND, W_RFONTS, _make_element("w:rFonts", attrs), attrs),))
@@ -0,0 +1,85 @@
+"""
+Module gộp run (run coalescing)
+Tài liệu gốc thường bị Word chia một câu thành nhiều w:r (kiểm tra chính tả,
+theo dõi thay đổi, rsid...). Sau khi chuẩn hóa font, các run kề nhau có rPr
+giống hệt nhau được gộp thành một run: document.xml nhỏ hơn, các stage sau và
+Word mở file nhanh hơn.
+
+Chỉ gộp run kề nhau trực tiếp dưới w:p (không có bookmark, comment range...
+xen giữa) và chỉ chứa nội dung văn bản thuần (w:t, w:tab, w:br...), nên run có
+field (fldChar/instrText), hình ảnh, footnote... được giữ nguyên.
+"""
+from docx.oxml.ns import qn
+from lxml import etree
+
+P_TAG = qn("w:p")
+R_TAG = qn("w:r")
+T_TAG = qn("w:t")
+RPR_TAG = qn("w:rPr")
+XML_SPACE = qn("xml:space")
+
+# Nội dung run được phép gộp (giữ nguyên thứ tự khi chuyển sang run trước)
+_MERGEABLE_CONTENT = frozenset(
+    qn(tag)
+    for tag in ("w:t", "w:tab", "w:br", "w:cr", "w:noBreakHyphen", "w:softHyphen", "w:lastRenderedPageBreak")
+)
+
+
+def _merge_key(r):
+    """Khóa so sánh rPr của run, None nếu run không gộp được."""
+    r_pr = None
+    for child in r:
+        if child.tag == RPR_TAG:
+            r_pr = child
+        elif child.tag not in _MERGEABLE_CONTENT:
+            return None
+    return etree.tostring(r_pr) if r_pr is not None else b""
+
+
+def _append_content(target, source):
+    """Chuyển nội dung của run source sang cuối run target, nối w:t liền nhau."""
+    last = target[-1] if len(target) else None
+    for child in list(source):
+        if child.tag == RPR_TAG:
+            continue
+        if child.tag == T_TAG and last is not None and last.tag == T_TAG:
+            text = (last.text or "") + (child.text or "")
+            last.text = text
+            if text != text.strip():
+                last.set(XML_SPACE, "preserve")
+            continue
+        target.append(child)
+        last = child
+
+
+def coalesce_paragraph_runs(p):
+    """
+    Gộp các run kề nhau có cùng rPr trong paragraph p.
+    Returns: (số run trước, số run sau)
+    """
+    before = removed = 0
+    previous = previous_key = None
+    for child in list(p):
+        if child.tag != R_TAG:
+            previous = previous_key = None
+            continue
+        before += 1
+        key = _merge_key(child)
+        if key is not None and key == previous_key:
+            _append_content(previous, child)
+            p.remove(child)
+            removed += 1
+            continue
+        previous, previous_key = (child, key) if key is not None else (None, None)
+    return before, before - removed
+
+
+def coalesce_block_runs(element):
+    """Gộp run cho mọi paragraph trong block (w:p, hoặc w:tbl kể cả bảng lồng)."""
+    before = after = 0
+    paragraphs = [element] if element.tag == P_TAG else list(element.iter(P_TAG))
+    for p in paragraphs:
+        p_before, p_after = coalesce_paragraph_runs(p)
+        before += p_before
+        after += p_after
+    return before, after
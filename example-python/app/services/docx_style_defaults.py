@@ -0,0 +1,245 @@
+"""
+Module chế độ định dạng mặc định ở cấp style (options["style_defaults"])
+Thay vì ghi rFonts/sz/szCs giống hệt nhau lên từng run, STANDARD_FONT và
+BODY_FONT_SIZE được đặt trong w:docDefaults và style Normal (font cho cả các
+style Heading), sau đó thuộc tính của run trùng với giá trị run được kế thừa
+(docDefaults -> style bảng -> style paragraph, theo chuỗi basedOn) bị xóa đi.
+Thuộc tính mà định dạng có điều kiện của style bảng (w:tblStylePr: hàng tiêu
+đề, cột đầu...) có đặt thì không bao giờ bị xóa, vì giá trị kế thừa của chúng
+phụ thuộc vị trí ô. Kết quả hiển thị không đổi nhưng document.xml nhỏ hơn nhiều.
+"""
+from docx.enum.style import WD_STYLE_TYPE
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+
+from app.config import BODY_FONT_SIZE, STANDARD_FONT
+from app.services.docx_run_props import _insert_in_sequence
+
+P_TAG = qn("w:p")
+R_TAG = qn("w:r")
+TBL_TAG = qn("w:tbl")
+HYPERLINK_TAG = qn("w:hyperlink")
+PPR_TAG = qn("w:pPr")
+RPR_TAG = qn("w:rPr")
+PSTYLE_TAG = qn("w:pStyle")
+RSTYLE_TAG = qn("w:rStyle")
+TBLPR_TAG = qn("w:tblPr")
+TBLSTYLE_TAG = qn("w:tblStyle")
+TBL_STYLE_PR_TAG = qn("w:tblStylePr")
+RFONTS_TAG = qn("w:rFonts")
+SZ_TAG = qn("w:sz")
+SZ_CS_TAG = qn("w:szCs")
+B_TAG = qn("w:b")
+I_TAG = qn("w:i")
+STYLE_TAG = qn("w:style")
+BASED_ON_TAG = qn("w:basedOn")
+DOC_DEFAULTS_TAG = qn("w:docDefaults")
+RPR_DEFAULT_TAG = qn("w:rPrDefault")
+W_VAL = qn("w:val")
+W_STYLE_ID = qn("w:styleId")
+
+FONT_SLOTS = ("ascii", "hAnsi", "eastAsia", "cs")
+_SLOT_ATTRS = {qn(f"w:{slot}"): slot for slot in FONT_SLOTS}
+# Font theo theme (asciiTheme...) được ưu tiên hơn tên font cùng slot
+_THEME_ATTRS = {
+    qn("w:asciiTheme"): "ascii",
+    qn("w:hAnsiTheme"): "hAnsi",
+    qn("w:eastAsiaTheme"): "eastAsia",
+    qn("w:cstheme"): "cs",
+}
+_OFF_VALUES = ("0", "false", "off")
+# Giá trị kế thừa phụ thuộc định dạng có điều kiện: không khớp giá trị nào của run
+CONDITIONAL = object()
+
+
+def _set_fonts(r_pr, font_name):
+    """Đặt rFonts với đủ 4 slot, bỏ font theo theme."""
+    for old in r_pr.findall(RFONTS_TAG):
+        r_pr.remove(old)
+    r_fonts = OxmlElement("w:rFonts")
+    for slot in FONT_SLOTS:
+        r_fonts.set(qn(f"w:{slot}"), font_name)
+    _insert_in_sequence(r_pr, r_fonts)
+
+
+def _set_size(r_pr, size):
+    half_points = str(int(size.pt * 2))
+    for tag in ("w:sz", "w:szCs"):
+        for old in r_pr.findall(qn(tag)):
+            r_pr.remove(old)
+        element = OxmlElement(tag)
+        element.set(W_VAL, half_points)
+        _insert_in_sequence(r_pr, element)
+
+
+def _doc_defaults_rpr(styles_element):
+    doc_defaults = styles_element.find(DOC_DEFAULTS_TAG)
+    if doc_defaults is None:
+        doc_defaults = OxmlElement("w:docDefaults")
+        styles_element.insert(0, doc_defaults)
+    r_pr_default = doc_defaults.find(RPR_DEFAULT_TAG)
+    if r_pr_default is None:
+        r_pr_default = OxmlElement("w:rPrDefault")
+        doc_defaults.insert(0, r_pr_default)
+    r_pr = r_pr_default.find(RPR_TAG)
+    if r_pr is None:
+        r_pr = OxmlElement("w:rPr")
+        r_pr_default.append(r_pr)
+    return r_pr
+
+
+def apply_style_defaults(doc, font_name=STANDARD_FONT, size=BODY_FONT_SIZE):
+    """
+    Đặt font/cỡ chữ mặc định: docDefaults và Normal (font + cỡ chữ),
+    các style Heading (chỉ font, giữ cỡ chữ riêng của từng cấp).
+    """
+    _set_fonts(_doc_defaults_rpr(doc.styles.element), font_name)
+    _set_size(_doc_defaults_rpr(doc.styles.element), size)
+
+    normal = doc.styles.default(WD_STYLE_TYPE.PARAGRAPH)
+    if normal is not None:
+        r_pr = normal.element.get_or_add_rPr()
+        _set_fonts(r_pr, font_name)
+        _set_size(r_pr, size)
+    for style in doc.styles:
+        if style.type == WD_STYLE_TYPE.PARAGRAPH and (style.name or "").lower().startswith("heading"):
+            _set_fonts(style.element.get_or_add_rPr(), font_name)
+
+
+def _merge_rpr(props, r_pr):
+    """Ghi đè props (dict) bằng các thuộc tính trong r_pr của một tầng style."""
+    if r_pr is None:
+        return props
+    props = dict(props)
+    r_fonts = r_pr.find(RFONTS_TAG)
+    if r_fonts is not None:
+        for attr, value in r_fonts.attrib.items():
+            if attr in _SLOT_ATTRS:
+                props[_SLOT_ATTRS[attr]] = value
+        # Ghi sau để font theo theme thắng tên font cùng slot trong cùng rFonts
+        for attr, value in r_fonts.attrib.items():
+            if attr in _THEME_ATTRS:
+                props[_THEME_ATTRS[attr]] = "theme:" + value
+    for tag, key in ((SZ_TAG, "sz"), (SZ_CS_TAG, "szCs")):
+        element = r_pr.find(tag)
+        if element is not None:
+            props[key] = element.get(W_VAL)
+    for tag, key in ((B_TAG, "b"), (I_TAG, "i")):
+        if r_pr.find(tag) is not None:
+            # Chỉ cần biết tầng nào đó có đặt b/i (bật hay tắt) - xem strip_inherited_run_props
+            props[key] = True
+    return props
+
+
+class InheritedRunProps:
+    """
+    Thuộc tính run được kế thừa (font 4 slot, sz, szCs, có đặt b/i hay không)
+    theo style paragraph và style bảng, tính một lần cho mỗi tổ hợp style.
+    Dựng SAU apply_style_defaults.
+    """
+
+    def __init__(self, doc):
+        styles_element = doc.styles.element
+        self._styles = {style.get(W_STYLE_ID): style for style in styles_element.iterfind(STYLE_TAG)}
+        self._defaults = _merge_rpr({}, _doc_defaults_rpr(styles_element))
+        default = doc.styles.default(WD_STYLE_TYPE.PARAGRAPH)
+        self._default_paragraph_style = default.style_id if default is not None else None
+        self._chains = {}
+        self._resolved = {}
+
+    def _chain_props(self, style_id, props, seen=()):
+        style = self._styles.get(style_id)
+        if style is None or style_id in seen:
+            return props
+        based_on = style.find(BASED_ON_TAG)
+        if based_on is not None:
+            props = self._chain_props(based_on.get(W_VAL), props, seen + (style_id,))
+        return _merge_rpr(props, style.find(RPR_TAG))
+
+    def _conditional_keys(self, style_id, seen=()):
+        """Các thuộc tính run mà w:tblStylePr trong chuỗi basedOn của style bảng có đặt."""
+        style = self._styles.get(style_id)
+        if style is None or style_id in seen:
+            return set()
+        based_on = style.find(BASED_ON_TAG)
+        keys = self._conditional_keys(based_on.get(W_VAL), seen + (style_id,)) if based_on is not None else set()
+        for style_pr in style.iterfind(TBL_STYLE_PR_TAG):
+            keys.update(_merge_rpr({}, style_pr.find(RPR_TAG)))
+        return keys
+
+    def resolve(self, paragraph_style_id, table_style_id=None):
+        key = (paragraph_style_id, table_style_id)
+        props = self._resolved.get(key)
+        if props is None:
+            props = self._defaults
+            if table_style_id is not None:
+                props = self._chain_props(table_style_id, props)
+            props = self._chain_props(paragraph_style_id or self._default_paragraph_style, props)
+            if table_style_id is not None:
+                conditional = self._conditional_keys(table_style_id)
+                if conditional:
+                    props = {**props, **dict.fromkeys(conditional, CONDITIONAL)}
+            self._resolved[key] = props
+        return props
+
+    def for_paragraph(self, p):
+        p_pr = p.find(PPR_TAG)
+        p_style = p_pr.find(PSTYLE_TAG) if p_pr is not None else None
+        table_style_id = None
+        table = next(p.iterancestors(TBL_TAG), None)
+        if table is not None:
+            tbl_pr = table.find(TBLPR_TAG)
+            tbl_style = tbl_pr.find(TBLSTYLE_TAG) if tbl_pr is not None else None
+            if tbl_style is not None:
+                table_style_id = tbl_style.get(W_VAL)
+        return self.resolve(p_style.get(W_VAL) if p_style is not None else None, table_style_id)
+
+
+def _strip_run(r_pr, inherited):
+    if r_pr.find(RSTYLE_TAG) is not None:
+        # Style ký tự có thể đặt font/cỡ chữ riêng, giữ nguyên định dạng trực tiếp
+        return
+    r_fonts = r_pr.find(RFONTS_TAG)
+    if r_fonts is not None and all(
+        attr in _SLOT_ATTRS and inherited.get(_SLOT_ATTRS[attr]) == value
+        for attr, value in r_fonts.attrib.items()
+    ):
+        r_pr.remove(r_fonts)
+    for tag, key in ((SZ_TAG, "sz"), (SZ_CS_TAG, "szCs")):
+        element = r_pr.find(tag)
+        if element is not None and element.get(W_VAL) == inherited.get(key):
+            r_pr.remove(element)
+    # b/i là thuộc tính bật/tắt: "tắt" trực tiếp chỉ thừa khi không tầng style nào đặt nó
+    # (CONDITIONAL cũng được tính là có đặt)
+    for tag, key in ((B_TAG, "b"), (I_TAG, "i")):
+        element = r_pr.find(tag)
+        if element is not None and element.get(W_VAL) in _OFF_VALUES and not inherited.get(key):
+            r_pr.remove(element)
+
+
+def strip_inherited_run_props(p, inherited_props):
+    """
+    Xóa rFonts/sz/szCs/b/i của các run trong paragraph p khi trùng giá trị kế thừa.
+    inherited_props: InheritedRunProps của tài liệu
+    Returns: số run đã bớt thuộc tính
+    """
+    inherited = inherited_props.for_paragraph(p)
+    stripped = 0
+    for parent in (p, *p.iterchildren(HYPERLINK_TAG)):
+        for r in parent.iterchildren(R_TAG):
+            r_pr = r.find(RPR_TAG)
+            if r_pr is None:
+                continue
+            size = len(r_pr)
+            _strip_run(r_pr, inherited)
+            if len(r_pr) != size:
+                stripped += 1
+            if len(r_pr) == 0 and not r_pr.attrib:
+                r.remove(r_pr)
+    return stripped
+
+
+def strip_block_run_props(element, inherited_props):
+    """strip_inherited_run_props cho mọi paragraph trong block (w:p hoặc w:tbl)."""
+    paragraphs = [element] if element.tag == P_TAG else element.iter(P_TAG)
+    return sum(strip_inherited_run_props(p, inherited_props) for p in paragraphs)
@@ -5,15 +5,20 @@ Tất cả các cấu hình font, màu sắc, cỡ chữ được lấy từ app
 from docx.shared import Pt, RGBColor
 from docx.enum.style import WD_STYLE_TYPE
 from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.oxml import OxmlElement
-from docx.oxml.ns import qn
 
 from app.config import (
     STANDARD_FONT,
     CAPTION_STYLE_CONFIG,
     UEL_FIGURE_STYLE_CONFIG,
+    TOC_HEADING_CONFIG,
     TOC_STYLE_CONFIG,
 )
+from app.services.docx_run_props import (
+    east_asia_fragment,
+    forced_font_fragment,
+    run_props_fragment,
+)
+from app.services.paragraph_classifier import TOC_TITLE, classify_paragraph
 
 
 def _copy_heading_style_to_toc(doc):
@@ -59,31 +64,8 @@ def _force_style_font_in_xml(style, font_name, font_size):
     Đảm bảo TOC styles có font chính xác
     """
     try:
-        rPr = style.element.get_or_add_rPr()
-        
-        # Xóa font cũ
-        for tag in ["rFonts", "sz", "szCs"]:
-            old = rPr.find(qn(f"w:{tag}"))
-            if old is not None:
-                rPr.remove(old)
-        
-        # Set font mới
-        rFonts = OxmlElement('w:rFonts')
-        rFonts.set(qn('w:ascii'), font_name)
-        rFonts.set(qn('w:hAnsi'), font_name)
-        rFonts.set(qn('w:eastAsia'), font_name)
-        rFonts.set(qn('w:cs'), font_name)
-        rPr.insert(0, rFonts)
-        
-        # Set size
-        size_half_pts = int(font_size.pt * 2)  # 13pt = 26 half-points
-        sz = OxmlElement('w:sz')
-        sz.set(qn('w:val'), str(size_half_pts))
-        rPr.append(sz)
-        
-        szCs = OxmlElement('w:szCs')
-        szCs.set(qn('w:val'), str(size_half_pts))
-        rPr.append(szCs)
+        # Xóa font cũ, set rFonts + sz/szCs (13pt = 26 half-points) từ fragment dựng sẵn
+        forced_font_fragment(font_name, font_size).apply_to_rpr(style.element.get_or_add_rPr())
     except Exception:
         pass  # Nếu lỗi, bỏ qua và dùng API setting
 
@@ -96,21 +78,8 @@ def _apply_font_to_style(style, font_name):
         style: Style object
         font_name: Tên font (ví dụ: "Times New Roman")
     """
-    # Set font name
-    style.font.name = font_name
-    
-    # Set East Asian font trong XML
-    rPr = style.element.get_or_add_rPr()
-    rFonts = rPr.find(qn('w:rFonts'))
-    if rFonts is None:
-        rFonts = OxmlElement('w:rFonts')
-        rPr.append(rFonts)
-    
-    # Set tất cả các loại font
-    rFonts.set(qn('w:ascii'), font_name)
-    rFonts.set(qn('w:hAnsi'), font_name)
-    rFonts.set(qn('w:cs'), font_name)
-    rFonts.set(qn('w:eastAsia'), font_name)
+    # Set font name + East Asian font trong XML (ascii, hAnsi, cs, eastAsia)
+    run_props_fragment(font_name).apply_to_rpr(style.element.get_or_add_rPr())
 
 
 def _ensure_caption_style(doc):
@@ -160,17 +129,37 @@ def _ensure_east_asia_font(run):
     Đảm bảo East Asian font được set đúng cho run
     Font được lấy từ STANDARD_FONT trong config
     """
-    rPr = run._element.get_or_add_rPr()
-    rFonts = rPr.find(qn('w:rFonts'))
-    if rFonts is None:
-        rFonts = OxmlElement('w:rFonts')
-        rPr.append(rFonts)
-    
     # Set tất cả các loại font về STANDARD_FONT
-    rFonts.set(qn('w:ascii'), STANDARD_FONT)
-    rFonts.set(qn('w:hAnsi'), STANDARD_FONT)
-    rFonts.set(qn('w:cs'), STANDARD_FONT)
-    rFonts.set(qn('w:eastAsia'), STANDARD_FONT)
+    east_asia_fragment(STANDARD_FONT).apply_to_run(run)
+
+
+def _format_toc_paragraph(paragraph, label=None):
+    """
+    Format một đoạn văn nếu thuộc mục lục (TOC) hoặc danh mục hình ảnh
+    Cấu hình lấy từ TOC_STYLE_CONFIG (tiêu đề: TOC_HEADING_CONFIG) trong config.py
+    label: nhãn ParagraphLabel đã tính sẵn (tùy chọn)
+    """
+    if label is None:
+        label = classify_paragraph(paragraph)
+    
+    # Paragraph có style TOC hoặc là tiêu đề "MỤC LỤC"/"DANH MỤC ..."
+    if label.is_toc:
+        config = TOC_HEADING_CONFIG if label.kind == TOC_TITLE else TOC_STYLE_CONFIG
+        # Set font cho tất cả runs trong paragraph
+        # (bao gồm force set trong XML để đảm bảo Word kế thừa đúng)
+        fragment = run_props_fragment(
+            config['font_name'],
+            config['font_size'],
+            bold=config['bold'],
+            italic=config['italic'],
+            force_xml=True,
+        )
+        for run in paragraph.runs:
+            fragment.apply_to_run(run)
+        
+        # Set line spacing
+        if paragraph.paragraph_format:
+            paragraph.paragraph_format.line_spacing = TOC_STYLE_CONFIG['line_spacing']
 
 
 def _format_toc_paragraphs(doc):
@@ -179,36 +168,9 @@ def _format_toc_paragraphs(doc):
     Đảm bảo font Times New Roman 13pt cho tất cả nội dung
     Cấu hình lấy từ TOC_STYLE_CONFIG trong config.py
     """
-    config = TOC_STYLE_CONFIG
-    
     # Duyệt qua tất cả paragraphs trong document
     for paragraph in doc.paragraphs:
-        style_name = paragraph.style.name if paragraph.style else ""
-        para_text = paragraph.text[:50] if paragraph.text else ""
-        
-        # Kiểm tra nếu là TOC paragraph hoặc có chứa field TOC
-        is_toc_para = (
-            style_name.startswith('TOC') or 
-            style_name.startswith('toc') or
-            'MỤC LỤC' in para_text or
-            'DANH MỤC HÌNH' in para_text
-        )
-        
-        if is_toc_para or style_name.startswith('TOC'):
-            # Set font cho tất cả runs trong paragraph
-            for run in paragraph.runs:
-                run.font.name = config['font_name']
-                run.font.size = config['font_size']
-                run.font.bold = config['bold']
-                run.font.italic = config['italic']
-                _ensure_east_asia_font(run)
-                
-                # Force set trong XML để đảm bảo Word kế thừa đúng
-                _force_run_font_in_xml(run, config['font_name'], config['font_size'])
-            
-            # Set line spacing
-            if paragraph.paragraph_format:
-                paragraph.paragraph_format.line_spacing = config['line_spacing']
+        _format_toc_paragraph(paragraph)
 
 
 def _force_run_font_in_xml(run, font_name, font_size):
@@ -216,31 +178,8 @@ def _force_run_font_in_xml(run, font_name, font_size):
     Force set font trong XML level để đảm bảo Word kế thừa đúng format
     Đặc biệt quan trọng cho TOC fields
     """
-    r_pr = run._element.get_or_add_rPr()
-    
-    # Xóa các font properties cũ
-    for tag in ["rFonts", "sz", "szCs"]:
-        old = r_pr.find(qn(f"w:{tag}"))
-        if old is not None:
-            r_pr.remove(old)
-    
-    # Set font Times New Roman cho tất cả font types
-    r_fonts = OxmlElement("w:rFonts")
-    r_fonts.set(qn("w:ascii"), font_name)
-    r_fonts.set(qn("w:hAnsi"), font_name)
-    r_fonts.set(qn("w:eastAsia"), font_name)
-    r_fonts.set(qn("w:cs"), font_name)
-    r_pr.insert(0, r_fonts)
-    
-    # Set size (trong half-points: 13pt = 26)
-    size_half_pts = int(font_size.pt * 2)
-    sz = OxmlElement("w:sz")
-    sz.set(qn("w:val"), str(size_half_pts))
-    r_pr.append(sz)
-    
-    sz_cs = OxmlElement("w:szCs")
-    sz_cs.set(qn("w:val"), str(size_half_pts))
-    r_pr.append(sz_cs)
+    # Xóa font cũ, set rFonts cho tất cả font types + size (half-points: 13pt = 26)
+    forced_font_fragment(font_name, font_size).apply_to_run(run)
 
 
 def _set_run_format(run, size, bold=False, italic=False, color=None):
@@ -255,16 +194,7 @@ def _set_run_format(run, size, bold=False, italic=False, color=None):
         italic: In nghiêng hay không
         color: Màu chữ (RGBColor object)
     """
-    from app.config import STANDARD_FONT
-    
-    run.font.name = STANDARD_FONT
-    run.font.size = size
-    run.font.bold = bold
-    run.font.italic = italic
-    
-    if color:
-        run.font.color.rgb = color
-    
-    # Đảm bảo East Asian font được set
-    _ensure_east_asia_font(run)
+    # Fragment rPr dựng sẵn theo (font, size, bold, italic, color),
+    # đã bao gồm East Asian font
+    run_props_fragment(STANDARD_FONT, size, bold=bold, italic=italic, color=color or None).apply_to_run(run)
 
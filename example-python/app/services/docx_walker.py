@@ -0,0 +1,90 @@
+"""
+Module duyệt body của document MỘT LẦN duy nhất
+Mỗi paragraph/table ở cấp body được gửi lần lượt qua các stage đã bật,
+thay vì mỗi stage tự dựng lại danh sách doc.paragraphs.
+"""
+from docx.oxml.ns import qn
+from docx.table import Table, _Cell
+from docx.text.paragraph import Paragraph
+
+P_TAG = qn("w:p")
+TBL_TAG = qn("w:tbl")
+TR_TAG = qn("w:tr")
+TC_TAG = qn("w:tc")
+
+
+def iter_body_blocks(doc):
+    """
+    Duyệt các paragraph và table ở cấp body theo đúng thứ tự trong tài liệu.
+    Danh sách phần tử được chụp lại trước khi duyệt nên stage có thể xóa
+    hoặc chèn phần tử mà không làm hỏng vòng lặp.
+    """
+    body = doc._body
+    for child in list(doc.element.body.iterchildren()):
+        if child.tag == P_TAG:
+            yield Paragraph(child, body)
+        elif child.tag == TBL_TAG:
+            yield Table(child, body)
+
+
+def iter_table_cells(table):
+    """
+    Duyệt từng ô vật lý (w:tc) của table MỘT LẦN, đi thẳng w:tbl/w:tr/w:tc thay vì
+    row.cells (python-docx dựng lại lưới ô cho mỗi dòng và trả về ô gộp nhiều lần).
+    - Ô gộp ngang (gridSpan) chỉ là một w:tc nên chỉ được duyệt một lần
+    - Ô tiếp nối của gộp dọc (vMerge="continue") bị bỏ qua: nội dung nằm ở ô đầu
+    - Table lồng trong ô được duyệt ngay sau ô chứa nó
+    """
+    for tr in list(table._tbl.iterchildren(TR_TAG)):
+        for tc in list(tr.iterchildren(TC_TAG)):
+            if tc.vMerge == "continue":
+                continue
+            cell = _Cell(tc, table)
+            yield cell
+            for nested in list(tc.iterchildren(TBL_TAG)):
+                yield from iter_table_cells(Table(nested, cell))
+
+
+def ensure_cell_paragraph(cell):
+    """Ô phải kết thúc bằng một w:p (sau khi stage xóa paragraph rỗng hoặc ô có table lồng ở cuối)."""
+    tc = cell._tc
+    last = tc[-1] if len(tc) else None
+    if last is None or last.tag != P_TAG:
+        tc.append(tc.makeelement(P_TAG, {}))
+
+
+def iter_paragraphs_between(first, last):
+    """Trả về các paragraph từ first đến last (bao gồm cả hai) trong cùng parent."""
+    element = first._p
+    while element is not None:
+        if element.tag == P_TAG:
+            yield Paragraph(element, first._parent)
+        if element is last._p:
+            break
+        element = element.getnext()
+
+
+def walk_body(doc, paragraph_stages=(), table_stages=(), progress=None):
+    """
+    Gửi từng block của body qua các stage theo thứ tự.
+
+    Args:
+        doc: Document cần xử lý
+        paragraph_stages: Danh sách hàm stage(paragraph) cho paragraph
+        table_stages: Danh sách hàm stage(table) cho table
+        progress: Hàm progress(done, total) được gọi định kỳ (tùy chọn)
+
+    Nếu một stage xóa block khỏi body, các stage sau sẽ bỏ qua block đó.
+    """
+    blocks = list(iter_body_blocks(doc))
+    total = len(blocks)
+    report_every = max(1, total // 50)
+    for position, block in enumerate(blocks, 1):
+        stages = paragraph_stages if isinstance(block, Paragraph) else table_stages
+        element = block._element
+        for stage in stages:
+            stage(block)
+            if element.getparent() is None:
+                break
+        if progress is not None and (position % report_every == 0 or position == total):
+            progress(position, total)
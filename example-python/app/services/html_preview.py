@@ -0,0 +1,79 @@
+"""
+Module cache HTML preview theo file_id
+File .docx trong kho preview không đổi sau khi định dạng, nên HTML chỉ cần
+render MỘT LẦN (ở lần xem đầu tiên) rồi lưu cạnh file .docx cùng với:
+- Bản nén gzip (và brotli nếu cài thư viện brotli)
+- ETag (SHA-256 của HTML) để trình duyệt hỏi lại bằng If-None-Match
+"""
+import gzip
+import hashlib
+
+from docx import Document
+
+from app.services.report_formatter import docx_to_html
+
+try:
+    import brotli
+except ImportError:  # brotli là tùy chọn, không có thì chỉ dùng gzip
+    brotli = None
+
+HTML_SUFFIX = ".html"
+ETAG_SUFFIX = ".html.etag"
+
+# Thứ tự ưu tiên khi client chấp nhận nhiều kiểu nén
+ENCODED_VARIANTS = [("br", ".html.br"), ("gzip", ".html.gz")]
+
+
+def _compress(encoding, html_bytes):
+    if encoding == "br":
+        return brotli.compress(html_bytes) if brotli is not None else None
+    return gzip.compress(html_bytes, compresslevel=9, mtime=0)
+
+
+def ensure_html_preview(store, file_id):
+    """
+    Đảm bảo HTML preview của file_id đã được render và lưu vào kho.
+
+    Returns: ETag (chuỗi hex, chưa có dấu ngoặc kép) hoặc None nếu file không tồn tại
+    """
+    etag_path = store.get(file_id, ETAG_SUFFIX)
+    if etag_path is not None and store.get(file_id, HTML_SUFFIX) is not None:
+        return etag_path.read_text(encoding="ascii")
+
+    docx_path = store.get(file_id)
+    if docx_path is None:
+        return None
+
+    html_bytes = docx_to_html(Document(docx_path)).encode("utf-8")
+    etag = hashlib.sha256(html_bytes).hexdigest()[:32]
+    store.save(html_bytes, HTML_SUFFIX, file_id)
+    for encoding, suffix in ENCODED_VARIANTS:
+        encoded = _compress(encoding, html_bytes)
+        if encoded is not None:
+            store.save(encoded, suffix, file_id)
+    # Ghi ETag sau cùng: có ETag nghĩa là mọi biến thể đã sẵn sàng
+    store.save(etag.encode("ascii"), ETAG_SUFFIX, file_id)
+    return etag
+
+
+def select_html_variant(store, file_id, accepted_encodings):
+    """
+    Chọn biến thể HTML phù hợp với Accept-Encoding của client.
+
+    Args:
+        accepted_encodings: Tập các encoding client chấp nhận (vd: {"gzip", "br"})
+
+    Returns: (path, encoding) - encoding là None nếu trả HTML không nén
+    """
+    for encoding, suffix in ENCODED_VARIANTS:
+        if encoding not in accepted_encodings:
+            continue
+        path = store.get(file_id, suffix)
+        if path is not None:
+            return path, encoding
+    return store.get(file_id, HTML_SUFFIX), None
+
+
+def variant_etag(etag, encoding):
+    """ETag mạnh phải khác nhau giữa các biến thể nén của cùng nội dung."""
+    return f"{etag}-{encoding}" if encoding else etag
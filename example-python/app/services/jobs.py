@@ -0,0 +1,336 @@
+"""
+Module job định dạng tài liệu bất đồng bộ (async job API)
+- submit() lưu file upload xuống đĩa, ghi job vào bảng SQLite và trả về job_id ngay
+- Process pool chạy format_uploaded_to_file -> apply_standard_formatting
+- Worker ghi tiến độ (stage, progress) vào SQLite để endpoint status đọc
+- Kết quả được lưu vào kho preview nên dùng chung URL preview/download hiện có
+- Worker nhận job bằng một lệnh UPDATE có điều kiện (queued -> running) nên mỗi
+  job chỉ chạy một lần dù nhiều process cùng dispatch
+- Job đang chờ, và job đang chạy mà worker đã chết (heartbeat quá hạn), được đưa
+  lại vào hàng đợi khi process khởi động lại
+- Một worker chết (vd: hết RAM) làm process pool hỏng hẳn: pool được tạo lại và
+  các job chưa bắt đầu được dispatch lại, job đang chạy trên worker đó bị đánh lỗi
+"""
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from app.config import (
+    JOB_HEARTBEAT_INTERVAL,
+    JOB_HEARTBEAT_TIMEOUT,
+    JOB_RETENTION_SECONDS,
+    JOB_WORKERS,
+    JOBS_DB_PATH,
+    JOBS_INPUT_DIR,
+)
+from app.services.uploads import open_source, save_upload
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+# Ghi tiến độ vào SQLite tối đa mỗi khoảng thời gian này (giây)
+PROGRESS_WRITE_INTERVAL = 0.5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    filename TEXT NOT NULL,
+    options TEXT,
+    input_path TEXT NOT NULL,
+    result_file_id TEXT,
+    download_name TEXT,
+    error TEXT,
+    owner_pid INTEGER,
+    heartbeat REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+# Cột thêm sau phiên bản đầu, bổ sung vào bảng jobs đã có sẵn
+_ADDED_COLUMNS = (("owner_pid", "INTEGER"), ("heartbeat", "REAL"))
+
+
+def _connect(db_path):
+    conn = sqlite3.connect(str(db_path), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def _create_schema(conn):
+    conn.execute(_SCHEMA)
+    existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+    for name, column_type in _ADDED_COLUMNS:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {column_type}")
+
+
+def _update_job(db_path, job_id, **fields):
+    fields["updated_at"] = time.time()
+    columns = ", ".join(f"{name} = ?" for name in fields)
+    with _connect(db_path) as conn:
+        conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+
+def _claim_job(db_path, job_id):
+    """
+    Chuyển job từ queued sang running cho process hiện tại.
+    Returns: row của job nếu nhận được, None nếu job đã bị process khác nhận/đã xong
+    """
+    now = time.time()
+    with _connect(db_path) as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET status = ?, stage = 'loading', progress = 0, owner_pid = ?,"
+            " heartbeat = ?, updated_at = ? WHERE id = ? AND status = ?",
+            (STATUS_RUNNING, os.getpid(), now, now, job_id, STATUS_QUEUED),
+        )
+        if cursor.rowcount != 1:
+            return None
+        return conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+
+def _heartbeat_loop(db_path, job_id, stopped):
+    while not stopped.wait(JOB_HEARTBEAT_INTERVAL):
+        try:
+            with _connect(db_path) as conn:
+                conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time(), job_id))
+        except sqlite3.Error as exc:
+            logging.warning(f"Job {job_id} heartbeat failed: {exc}")
+
+
+def run_format_job(job_id, db_path):
+    """
+    Hàm chạy trong worker process: định dạng file của job và lưu kết quả vào kho preview.
+    Phải là hàm cấp module để process pool pickle được.
+    """
+    from app.services.preview_store import get_preview_store
+    from app.services.report_formatter import format_uploaded_to_file
+
+    row = _claim_job(db_path, job_id)
+    if row is None:
+        return
+
+    stopped = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat_loop, args=(db_path, job_id, stopped), daemon=True)
+    heartbeat.start()
+    last_write = [0.0]
+
+    def progress(stage, fraction):
+        now = time.monotonic()
+        if now - last_write[0] < PROGRESS_WRITE_INTERVAL and fraction < 1.0:
+            return
+        last_write[0] = now
+        # 5% cho việc đọc file, 85% cho định dạng, 10% cho lưu kết quả
+        _update_job(db_path, job_id, stage=stage, progress=round(0.05 + 0.85 * fraction, 4))
+
+    input_path = Path(row["input_path"])
+    try:
+        options = json.loads(row["options"]) if row["options"] else None
+        store = get_preview_store(start_sweeper=False)
+        file_id = store.new_id()
+        tmp_path = store.temp_path_for(file_id)
+        try:
+            download_name = format_uploaded_to_file(
+                input_path, row["filename"], options, tmp_path, progress=progress
+            )
+            _update_job(db_path, job_id, stage="saving", progress=0.9)
+            store.save_file(tmp_path, file_id=file_id)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        _update_job(
+            db_path,
+            job_id,
+            status=STATUS_DONE,
+            stage="done",
+            progress=1.0,
+            result_file_id=file_id,
+            download_name=download_name,
+        )
+    except Exception as exc:
+        logging.error(f"Job {job_id} failed: {exc}")
+        logging.debug(traceback.format_exc())
+        _update_job(db_path, job_id, status=STATUS_FAILED, stage="failed", error=str(exc))
+    finally:
+        stopped.set()
+        heartbeat.join()
+        input_path.unlink(missing_ok=True)
+
+
+class JobManager:
+    def __init__(self, db_path, input_dir, workers):
+        self._db_path = Path(db_path)
+        self._input_dir = Path(input_dir)
+        self._input_dir.mkdir(parents=True, exist_ok=True)
+        self._db_path.parent.mkdir(parents=True, exist_ok=True)
+        with _connect(self._db_path) as conn:
+            _create_schema(conn)
+        self._workers = workers
+        self._executor_lock = threading.Lock()
+        self._executor = self._new_executor()
+
+    def _new_executor(self):
+        # "spawn" để worker không kế thừa thread (sweeper, web server) của process chính
+        return ProcessPoolExecutor(
+            max_workers=self._workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def _replace_executor(self, broken):
+        """Thay pool đã hỏng bằng pool mới (chỉ một lần dù nhiều job cùng phát hiện)."""
+        with self._executor_lock:
+            if self._executor is broken:
+                logging.warning("Formatting worker pool is broken, starting a new one")
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+            return self._executor
+
+    def recover(self):
+        """
+        Đưa lại các job chưa xong vào hàng đợi theo thứ tự tạo. Job "running" chỉ
+        được đưa lại khi heartbeat quá hạn (worker đã chết), vì các process server
+        khác dùng chung bảng jobs có thể vẫn đang chạy nó.
+        """
+        stale = time.time() - JOB_HEARTBEAT_TIMEOUT
+        with _connect(self._db_path) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, stage = NULL, progress = 0, owner_pid = NULL"
+                " WHERE status = ? AND (heartbeat IS NULL OR heartbeat < ?)",
+                (STATUS_QUEUED, STATUS_RUNNING, stale),
+            )
+            rows = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at", (STATUS_QUEUED,)
+            ).fetchall()
+        for row in rows:
+            self._dispatch(row["id"])
+        if rows:
+            logging.info(f"Re-queued {len(rows)} unfinished formatting jobs")
+
+    def purge_expired(self):
+        """Xóa thông tin các job đã xong quá JOB_RETENTION_SECONDS."""
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        with _connect(self._db_path) as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (STATUS_DONE, STATUS_FAILED, cutoff),
+            )
+
+    def submit(self, upload, filename, options=None):
+        """
+        Tạo job mới và trả về job_id ngay, việc định dạng chạy trong process pool.
+        upload: file upload (bytes hoặc file-like), được ghi ra đĩa theo từng khối
+        """
+        job_id = uuid.uuid4().hex
+        input_path = self._input_dir / f"{job_id}.docx"
+        save_upload(open_source(upload), input_path)
+        if options is not None and not isinstance(options, str):
+            options = json.dumps(options)
+        now = time.time()
+        with _connect(self._db_path) as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, progress, filename, options, input_path, created_at, updated_at)"
+                " VALUES (?, ?, 0, ?, ?, ?, ?, ?)",
+                (job_id, STATUS_QUEUED, filename, options, str(input_path), now, now),
+            )
+        try:
+            self._dispatch(job_id)
+        except Exception as exc:
+            # Không để lại job "queued" mà không process nào sẽ chạy
+            _update_job(self._db_path, job_id, status=STATUS_FAILED, stage="failed", error=str(exc))
+            input_path.unlink(missing_ok=True)
+            raise
+        self.purge_expired()
+        return job_id
+
+    def _dispatch(self, job_id):
+        with self._executor_lock:
+            executor = self._executor
+        try:
+            future = executor.submit(run_format_job, job_id, str(self._db_path))
+        except BrokenProcessPool:
+            executor = self._replace_executor(executor)
+            future = executor.submit(run_format_job, job_id, str(self._db_path))
+        future.add_done_callback(lambda f: self._on_done(job_id, f, executor))
+
+    def _on_done(self, job_id, future, executor):
+        if future.cancelled():
+            return
+        exc = future.exception()
+        if exc is None:
+            return
+        job = self.get(job_id)
+        if job is None or job["status"] in (STATUS_DONE, STATUS_FAILED):
+            return
+        if isinstance(exc, BrokenProcessPool):
+            self._replace_executor(executor)
+            if job["status"] == STATUS_QUEUED:
+                # Job chưa được worker nào nhận: chạy lại trên pool mới
+                try:
+                    self._dispatch(job_id)
+                    return
+                except Exception as dispatch_exc:
+                    exc = dispatch_exc
+        # Worker chết bất thường (vd: hết RAM) khi đang chạy job: đánh dấu lỗi,
+        # không chạy lại để một file gây lỗi không làm chết worker lặp đi lặp lại
+        _update_job(self._db_path, job_id, status=STATUS_FAILED, stage="failed", error=str(exc))
+
+    def get(self, job_id):
+        """Trả về thông tin job dạng dict, hoặc None nếu không tồn tại."""
+        with _connect(self._db_path) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {
+            "job_id": row["id"],
+            "status": row["status"],
+            "stage": row["stage"],
+            "progress": row["progress"],
+            "filename": row["download_name"],
+            "error": row["error"],
+        }
+        if row["status"] == STATUS_QUEUED:
+            with _connect(self._db_path) as conn:
+                job["queue_position"] = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?",
+                    (STATUS_QUEUED, row["created_at"]),
+                ).fetchone()[0]
+        if row["result_file_id"]:
+            job["file_id"] = row["result_file_id"]
+            job["preview_url"] = f"/api/preview/{row['result_file_id']}"
+            job["download_url"] = f"/api/download/{row['result_file_id']}"
+        return job
+
+    def shutdown(self, wait=False):
+        with self._executor_lock:
+            executor = self._executor
+        executor.shutdown(wait=wait, cancel_futures=True)
+
+
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """Job manager dùng chung cho toàn process; job chưa xong được chạy lại ở lần dùng đầu."""
+    global _job_manager
+    if _job_manager is None:
+        with _job_manager_lock:
+            if _job_manager is None:
+                manager = JobManager(JOBS_DB_PATH, JOBS_INPUT_DIR, JOB_WORKERS)
+                manager.recover()
+                _job_manager = manager
+    return _job_manager
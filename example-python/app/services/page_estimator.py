@@ -0,0 +1,402 @@
+"""
+Module ước tính số trang cho mục lục thủ công (không cần render/convert PDF)
+- Chiều rộng chữ tính theo bảng độ rộng glyph của Times New Roman (thường và
+  đậm, đơn vị 1/1000 em); chữ tiếng Việt có dấu quy về chữ gốc (dấu không chiếm
+  chiều ngang)
+- Mỗi paragraph được ngắt dòng tham lam (greedy) theo chiều rộng vùng chữ
+  (khổ trang trừ UEL_MARGINS và thụt lề), chiều cao = số dòng x cỡ chữ x giãn
+  dòng + khoảng cách trước/sau; cỡ chữ, giãn dòng, thụt lề đọc từ pPr/rPr của
+  paragraph, thiếu thì lấy hằng số trong app.config
+- Ảnh (wp:extent), hàng bảng (theo ô cao nhất), ngắt trang và ngắt section
+  được tính vào
+- Số trang của từng block = tổng tích lũy (cumulative sum) chiều cao các block
+  trước nó trong cùng đoạn giữa hai lần ngắt trang, chia cho chiều cao vùng chữ
+"""
+import re
+import unicodedata
+from functools import lru_cache
+from itertools import accumulate
+
+from docx.oxml.ns import qn
+from docx.shared import Cm
+from docx.text.paragraph import Paragraph
+
+from app.config import (
+    BODY_FONT_SIZE,
+    HEADING1_STYLE_CONFIG,
+    HEADING2_STYLE_CONFIG,
+    HEADING3_STYLE_CONFIG,
+    LINE_SPACING,
+    SPACE_AFTER,
+    SPACE_BEFORE,
+    UEL_MARGINS,
+)
+from app.services.paragraph_classifier import HEADING, ParagraphClassifier
+
+P_TAG = qn("w:p")
+TBL_TAG = qn("w:tbl")
+TR_TAG = qn("w:tr")
+TC_TAG = qn("w:tc")
+R_TAG = qn("w:r")
+T_TAG = qn("w:t")
+TAB_TAG = qn("w:tab")
+BR_TAG = qn("w:br")
+CR_TAG = qn("w:cr")
+PPR_TAG = qn("w:pPr")
+RPR_TAG = qn("w:rPr")
+SZ_TAG = qn("w:sz")
+B_TAG = qn("w:b")
+SPACING_TAG = qn("w:spacing")
+IND_TAG = qn("w:ind")
+SECTPR_TAG = qn("w:sectPr")
+TYPE_TAG = qn("w:type")
+PAGE_BREAK_BEFORE_TAG = qn("w:pageBreakBefore")
+TCPR_TAG = qn("w:tcPr")
+TCW_TAG = qn("w:tcW")
+VMERGE_TAG = qn("w:vMerge")
+TRPR_TAG = qn("w:trPr")
+TRHEIGHT_TAG = qn("w:trHeight")
+EXTENT_TAG = qn("wp:extent")
+W_VAL = qn("w:val")
+W_TYPE = qn("w:type")
+W_W = qn("w:w")
+W_LINE = qn("w:line")
+W_LINE_RULE = qn("w:lineRule")
+W_BEFORE = qn("w:before")
+W_AFTER = qn("w:after")
+W_LEFT = qn("w:left")
+W_START = qn("w:start")
+W_RIGHT = qn("w:right")
+W_END = qn("w:end")
+W_FIRST_LINE = qn("w:firstLine")
+W_HANGING = qn("w:hanging")
+W_H_RULE = qn("w:hRule")
+
+EMU_PER_PT = 12700
+TWIPS_PER_PT = 20
+
+# Khổ A4 khi section không ghi kích thước trang
+_DEFAULT_PAGE_WIDTH = Cm(21)
+_DEFAULT_PAGE_HEIGHT = Cm(29.7)
+
+# Chiều cao một dòng đơn của Times New Roman = (ascent + descent + line gap) / em
+TIMES_LINE_HEIGHT = 1.149
+
+# Lề trái + phải mặc định trong ô bảng (0.19cm mỗi bên)
+_CELL_PADDING_PT = 10.8
+
+# Tab tính như một điểm dừng mặc định 0.5 inch
+_TAB_WIDTH_PT = 36.0
+# Dấu cách (bỏ đi) và tab (giữ lại, nhờ nhóm bắt) giữa các từ
+_TOKEN_SPLIT = re.compile(r"(\t)| +")
+
+# Độ rộng glyph (1/1000 em) cho ký tự ASCII 32..126, theo metric chuẩn Times-Roman / Times-Bold
+_TIMES_REGULAR = (
+    250, 333, 408, 500, 500, 833, 778, 180, 333, 333, 500, 564, 250, 333, 250, 278,
+    500, 500, 500, 500, 500, 500, 500, 500, 500, 500, 278, 278, 564, 564, 564, 444,
+    921, 722, 667, 667, 722, 611, 556, 722, 722, 333, 389, 722, 611, 889, 722, 722,
+    556, 722, 667, 556, 611, 722, 722, 944, 722, 722, 611, 333, 278, 333, 469, 500,
+    333, 444, 500, 444, 500, 444, 333, 500, 500, 278, 278, 500, 278, 778, 500, 500,
+    500, 500, 333, 389, 278, 500, 500, 722, 500, 500, 444, 480, 200, 480, 541,
+)
+_TIMES_BOLD = (
+    250, 333, 555, 500, 500, 1000, 833, 278, 333, 333, 500, 570, 250, 333, 250, 278,
+    500, 500, 500, 500, 500, 500, 500, 500, 500, 500, 333, 333, 570, 570, 570, 500,
+    930, 722, 667, 722, 722, 667, 611, 778, 778, 389, 500, 778, 667, 944, 722, 778,
+    611, 778, 722, 556, 667, 722, 722, 1000, 722, 722, 667, 333, 278, 333, 581, 500,
+    333, 500, 556, 444, 556, 444, 333, 500, 556, 278, 333, 556, 278, 833, 556, 500,
+    556, 556, 444, 389, 333, 556, 500, 722, 500, 500, 444, 394, 220, 394, 520,
+)
+# Ký tự không có trong bảng và không quy được về ASCII
+_EXTRA_WIDTHS = {"đ": (500, 556), "Đ": (722, 722), "–": (500, 500), "—": (1000, 1000),
+                 "“": (444, 500), "”": (444, 500), "‘": (333, 333), "’": (333, 333),
+                 "•": (350, 350), "…": (1000, 1000)}
+_DEFAULT_WIDTH = 500
+
+_HEADING_SIZES = {
+    1: HEADING1_STYLE_CONFIG["font_size"].pt,
+    2: HEADING2_STYLE_CONFIG["font_size"].pt,
+    3: HEADING3_STYLE_CONFIG["font_size"].pt,
+}
+
+
+@lru_cache(maxsize=4096)
+def _char_width(char, bold):
+    code = ord(char)
+    if 32 <= code <= 126:
+        return (_TIMES_BOLD if bold else _TIMES_REGULAR)[code - 32]
+    extra = _EXTRA_WIDTHS.get(char)
+    if extra is not None:
+        return extra[bold]
+    # Chữ có dấu (ă, ế, ữ, ...): NFD tách thành chữ gốc + dấu kết hợp (rộng 0)
+    base = unicodedata.normalize("NFD", char)[0]
+    if base != char:
+        return _char_width(base, bold)
+    if unicodedata.combining(char):
+        return 0
+    return _DEFAULT_WIDTH
+
+
+@lru_cache(maxsize=65536)
+def word_width(word, bold=False):
+    """Chiều rộng của một từ tính theo em (nhân với cỡ chữ pt để ra pt)."""
+    return sum(_char_width(char, bold) for char in word) / 1000
+
+
+def count_lines(text, width, font_size, bold=False, first_line_indent=0.0):
+    """
+    Số dòng khi ngắt dòng tham lam text (đã tách theo xuống dòng mềm "\\n")
+    trong vùng rộng width pt với cỡ chữ font_size pt.
+    """
+    if width <= 0:
+        return max(1, text.count("\n") + 1)
+    space = word_width(" ", bold) * font_size
+    lines = 0
+    for line_index, segment in enumerate(text.split("\n")):
+        lines += 1
+        x = first_line_indent if line_index == 0 else 0.0
+        line_start = x
+        after_tab = False
+        # Tách theo dấu cách nhưng giữ lại từng tab thành một token riêng
+        for word in _TOKEN_SPLIT.split(segment):
+            if not word:
+                continue
+            if word == "\t":
+                x += _TAB_WIDTH_PT - (x % _TAB_WIDTH_PT)
+                if x > width:
+                    # Tab vượt lề phải thì sang dòng mới
+                    lines += 1
+                    x = line_start = 0.0
+                after_tab = True
+                continue
+            advance = word_width(word, bold) * font_size
+            gap = space if x > line_start and not after_tab else 0.0
+            after_tab = False
+            if x > line_start and x + gap + advance > width:
+                lines += 1
+                x = line_start = 0.0
+            else:
+                x += gap
+            if advance > width:
+                # Từ dài hơn cả dòng (URL...) bị ngắt cứng
+                extra, advance = divmod(advance, width)
+                lines += int(extra)
+            x += advance
+    return lines
+
+
+def _twips(element, attr, default=0.0):
+    if element is None:
+        return default
+    value = element.get(attr)
+    if value is None:
+        return default
+    try:
+        return int(value) / TWIPS_PER_PT
+    except ValueError:
+        return default
+
+
+class PageEstimator:
+    """
+    Ước tính trang bắt đầu của các block cấp body (paragraph, bảng) trong MỘT lần duyệt.
+
+    options: options đã merge (dùng line_spacing và adjust_margins)
+    classifier: ParagraphClassifier dùng chung (để biết paragraph là heading mà không tra style)
+    """
+
+    def __init__(self, doc, options=None, classifier=None):
+        options = options or {}
+        self._doc = doc
+        self._classifier = classifier if classifier is not None else ParagraphClassifier(doc)
+        self._line_spacing = float(options.get("line_spacing", LINE_SPACING))
+
+        section = doc.sections[0] if len(doc.sections) else None
+        page_width = (section.page_width if section is not None else None) or _DEFAULT_PAGE_WIDTH
+        page_height = (section.page_height if section is not None else None) or _DEFAULT_PAGE_HEIGHT
+        if options.get("adjust_margins", True) or section is None:
+            margins = UEL_MARGINS
+        else:
+            margins = {
+                side: getattr(section, f"{side}_margin") or UEL_MARGINS[side]
+                for side in ("top", "bottom", "left", "right")
+            }
+        self.text_width = (page_width - margins["left"] - margins["right"]) / EMU_PER_PT
+        self.text_height = (page_height - margins["top"] - margins["bottom"]) / EMU_PER_PT
+
+    # ------------------------------------------------------------------
+    # Chiều cao từng block
+    # ------------------------------------------------------------------
+    def _paragraph_font(self, p):
+        """(cỡ chữ pt, đậm) của paragraph: rPr của run đầu tiên có chữ, không có thì theo nhãn."""
+        size = bold = None
+        for r in p.iterchildren(R_TAG):
+            if r.find(T_TAG) is None:
+                continue
+            r_pr = r.find(RPR_TAG)
+            if r_pr is not None:
+                sz = r_pr.find(SZ_TAG)
+                if sz is not None and sz.get(W_VAL, "").isdigit():
+                    size = int(sz.get(W_VAL)) / 2
+                b = r_pr.find(B_TAG)
+                if b is not None:
+                    bold = b.get(W_VAL) not in ("0", "false")
+            break
+        if size is None or bold is None:
+            label = self._classifier.label(Paragraph(p, None))
+            if label.kind == HEADING and label.styled:
+                if size is None:
+                    size = _HEADING_SIZES.get(label.level or 1, _HEADING_SIZES[3])
+                if bold is None:
+                    bold = True
+        return size or BODY_FONT_SIZE.pt, bool(bold)
+
+    def paragraph_height(self, p, width=None):
+        """Chiều cao (pt) của paragraph p khi vùng chữ rộng width pt."""
+        width = self.text_width if width is None else width
+        p_pr = p.find(PPR_TAG)
+        spacing = p_pr.find(SPACING_TAG) if p_pr is not None else None
+        ind = p_pr.find(IND_TAG) if p_pr is not None else None
+
+        font_size, bold = self._paragraph_font(p)
+        line_height = font_size * TIMES_LINE_HEIGHT * self._line_spacing
+        if spacing is not None and spacing.get(W_LINE) is not None:
+            rule = spacing.get(W_LINE_RULE, "auto")
+            line = _twips(spacing, W_LINE)
+            if rule == "auto":
+                # w:line tính theo 1/240 dòng đơn (đã đổi sang pt ở _twips: /20)
+                line_height = font_size * TIMES_LINE_HEIGHT * line * TWIPS_PER_PT / 240
+            elif rule == "exact":
+                line_height = line
+            else:
+                line_height = max(line, font_size * TIMES_LINE_HEIGHT)
+        space_before = _twips(spacing, W_BEFORE, SPACE_BEFORE.pt)
+        space_after = _twips(spacing, W_AFTER, SPACE_AFTER.pt)
+
+        left = _twips(ind, W_LEFT, _twips(ind, W_START))
+        right = _twips(ind, W_RIGHT, _twips(ind, W_END))
+        first_line = _twips(ind, W_FIRST_LINE) - _twips(ind, W_HANGING)
+
+        image_height = sum(int(extent.get("cy", 0)) for extent in p.iter(EXTENT_TAG)) / EMU_PER_PT
+        text = "".join(self._run_text(r) for r in p.iter(R_TAG))
+        if text.strip() or not image_height:
+            lines = count_lines(text, width - left - right, font_size, bold, first_line)
+        else:
+            lines = 0
+        return lines * line_height + image_height + space_before + space_after
+
+    @staticmethod
+    def _run_text(r):
+        parts = []
+        for child in r:
+            if child.tag == T_TAG:
+                parts.append(child.text or "")
+            elif child.tag == TAB_TAG:
+                parts.append("\t")
+            elif child.tag == CR_TAG or (child.tag == BR_TAG and child.get(W_TYPE) in (None, "textWrapping")):
+                parts.append("\n")
+        return "".join(parts)
+
+    def table_height(self, tbl, width=None):
+        """Chiều cao (pt) của bảng: tổng các hàng, mỗi hàng cao bằng ô cao nhất."""
+        width = self.text_width if width is None else width
+        height = 0.0
+        for tr in tbl.iterchildren(TR_TAG):
+            cells = list(tr.iterchildren(TC_TAG))
+            if not cells:
+                continue
+            default_width = width / len(cells)
+            row_height = 0.0
+            for tc in cells:
+                tc_pr = tc.find(TCPR_TAG)
+                if tc_pr is not None:
+                    v_merge = tc_pr.find(VMERGE_TAG)
+                    if v_merge is not None and v_merge.get(W_VAL) in (None, "continue"):
+                        continue
+                    tc_w = tc_pr.find(TCW_TAG)
+                    cell_width = default_width
+                    if tc_w is not None and tc_w.get(W_TYPE) == "dxa":
+                        cell_width = _twips(tc_w, W_W, default_width)
+                else:
+                    cell_width = default_width
+                inner = cell_width - _CELL_PADDING_PT
+                cell_height = sum(
+                    self.paragraph_height(child, inner) if child.tag == P_TAG else self.table_height(child, inner)
+                    for child in tc
+                    if child.tag in (P_TAG, TBL_TAG)
+                )
+                row_height = max(row_height, cell_height)
+            tr_pr = tr.find(TRPR_TAG)
+            tr_height = tr_pr.find(TRHEIGHT_TAG) if tr_pr is not None else None
+            if tr_height is not None:
+                fixed = _twips(tr_height, W_VAL)
+                row_height = fixed if tr_height.get(W_H_RULE) == "exact" else max(row_height, fixed)
+            height += row_height
+        return height
+
+    # ------------------------------------------------------------------
+    # Ngắt trang
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _page_breaks(p):
+        """
+        (ngắt trước, ngắt sau) của paragraph: pageBreakBefore và ngắt trang nằm
+        trước mọi chữ -> paragraph sang trang mới; ngắt trang sau chữ hoặc
+        section break (không phải continuous) -> block kế tiếp sang trang mới.
+        """
+        before = after = False
+        p_pr = p.find(PPR_TAG)
+        if p_pr is not None:
+            page_break_before = p_pr.find(PAGE_BREAK_BEFORE_TAG)
+            if page_break_before is not None and page_break_before.get(W_VAL) not in ("0", "false"):
+                before = True
+            sect_pr = p_pr.find(SECTPR_TAG)
+            if sect_pr is not None:
+                sect_type = sect_pr.find(TYPE_TAG)
+                if sect_type is None or sect_type.get(W_VAL) != "continuous":
+                    after = True
+        seen_text = False
+        for element in p.iter(T_TAG, BR_TAG):
+            if element.tag == T_TAG:
+                seen_text = seen_text or bool((element.text or "").strip())
+            elif element.get(W_TYPE) == "page":
+                if seen_text:
+                    after = True
+                else:
+                    before = True
+        return before, after
+
+    # ------------------------------------------------------------------
+    # Gán số trang
+    # ------------------------------------------------------------------
+    def block_pages(self):
+        """
+        Trang bắt đầu (đánh từ 1) của từng phần tử con trực tiếp của body.
+        Returns: dict {phần tử w:p / w:tbl: số trang}
+        """
+        blocks, heights, segment_starts = [], [], [0]
+        for element in self._doc.element.body:
+            if element.tag == P_TAG:
+                before, after = self._page_breaks(element)
+                if before and len(blocks) != segment_starts[-1]:
+                    segment_starts.append(len(blocks))
+                blocks.append(element)
+                heights.append(self.paragraph_height(element))
+                if after:
+                    segment_starts.append(len(blocks))
+            elif element.tag == TBL_TAG:
+                blocks.append(element)
+                heights.append(self.table_height(element))
+        segment_starts.append(len(blocks))
+
+        pages = {}
+        first_page = 1
+        for start, stop in zip(segment_starts, segment_starts[1:]):
+            if start == stop:
+                continue
+            offsets = list(accumulate(heights[start:stop], initial=0.0))
+            for element, offset in zip(blocks[start:stop], offsets):
+                pages[element] = first_page + int(offset // self.text_height)
+            # Trang cuối của đoạn (bỏ phần dư rất nhỏ do làm tròn)
+            first_page += int(max(offsets[-1] - 1e-6, 0.0) // self.text_height) + 1
+        return pages
@@ -0,0 +1,217 @@
+"""
+Module phân loại paragraph dùng chung cho mọi stage
+Mỗi paragraph được gán MỘT nhãn: heading (kèm cấp), caption bảng, caption hình,
+mục danh sách, mục lục (entry/tiêu đề), ghi chú (hint), văn bản thường hoặc rỗng.
+Caption/heading đánh số/danh sách được nhận diện bằng một pattern gộp đã biên
+dịch sẵn; kết quả phân loại theo (tên style, text) được cache nên các stage
+định dạng, thu thập mục lục và HTML preview không phải match lại.
+"""
+import re
+from functools import lru_cache
+
+from docx.enum.style import WD_STYLE_TYPE
+from docx.oxml.ns import qn
+
+W_PPR = qn("w:pPr")
+W_PSTYLE = qn("w:pStyle")
+W_VAL = qn("w:val")
+
+# Các nhãn
+HEADING = "heading"
+TABLE_CAPTION = "table_caption"
+FIGURE_CAPTION = "figure_caption"
+LIST_ITEM = "list_item"
+TOC_ENTRY = "toc_entry"
+TOC_TITLE = "toc_title"
+HINT = "hint"
+BODY = "body"
+EMPTY = "empty"
+
+CAPTION_KINDS = (TABLE_CAPTION, FIGURE_CAPTION)
+TOC_KINDS = (TOC_ENTRY, TOC_TITLE)
+
+CAPTION_STYLES = ("UEL Figure", "Caption")
+TOC_TITLES = ("MỤC LỤC", "DANH MỤC BẢNG BIỂU", "DANH MỤC HÌNH ẢNH")
+BULLET_PREFIXES = ("-", "+", "•", "*", "–", "—", "›", "»", "○", "●")
+HINT_PREFIX = "(*"
+
+# Pattern riêng lẻ (giữ cho code cũ dùng trực tiếp)
+NUMBERED_HEADING_PATTERN = re.compile(r'^(\d+(?:\.\d+)*)\.\s+(.+)$')
+TABLE_CAPTION_PATTERN = re.compile(r'^Bảng[\s\d\.]*[:\.]?\s*(.+)$', re.IGNORECASE)
+FIGURE_CAPTION_PATTERN = re.compile(r'^(Hình|Sơ đồ|Biểu đồ)[\s\d\.]*[:\.]?\s*(.+)$', re.IGNORECASE)
+CAPTION_PATTERN = re.compile(r'^(Hình|Sơ đồ|Bảng|Biểu đồ)[\s\d\.]*[:\.]?\s+(.+)$', re.IGNORECASE)
+
+# Pattern gộp: nhánh khớp đầu tiên quyết định nhãn (bảng trước hình, caption trước
+# heading đánh số, heading đánh số trước danh sách) - tương đương match lần lượt
+# từng pattern riêng lẻ ở trên
+_PREFIX_PATTERN = re.compile(
+    r"(?P<table>Bảng[\s\d\.]*[:\.]?\s*(?P<table_text>.+)$)"
+    r"|(?P<figure>(?:Hình|Sơ đồ|Biểu đồ)[\s\d\.]*[:\.]?\s*(?P<figure_text>.+)$)"
+    r"|(?P<numbered>(?P<number>\d+(?:\.\d+)*)\.\s+.+$)"
+    r"|(?P<list>[\dIVXivx]+[.)]\s|[a-zA-Z][.)]\s)",
+    re.IGNORECASE,
+)
+
+
+class ParagraphLabel:
+    """
+    Nhãn của một paragraph (không thay đổi sau khi tạo).
+
+    kind: một trong các nhãn ở đầu module
+    level: cấp heading (theo style "Heading N" hoặc số "1.2."), None nếu không có
+    styled: nhãn suy ra từ style của paragraph (Heading/TOC/Caption) chứ không từ text
+    numbered: heading nhận diện từ text đánh số "1.2. ..." (style chưa phải Heading)
+    caption_text: phần nội dung sau "Bảng n:"/"Hình n:" nếu text khớp caption
+    list_prefix: text bắt đầu bằng ký hiệu/số của danh sách ("-", "a)", "1.", ...)
+    caps: text ngắn viết hoa toàn bộ, trông như tiêu đề
+    """
+
+    __slots__ = ("kind", "level", "styled", "numbered", "caption_text", "list_prefix", "caps")
+
+    def __init__(self, kind, level=None, styled=False, numbered=False, caption_text=None,
+                 list_prefix=False, caps=False):
+        self.kind = kind
+        self.level = level
+        self.styled = styled
+        self.numbered = numbered
+        self.caption_text = caption_text
+        self.list_prefix = list_prefix
+        self.caps = caps
+
+    @property
+    def is_caption(self):
+        return self.kind in CAPTION_KINDS
+
+    @property
+    def is_toc(self):
+        return self.kind in TOC_KINDS
+
+    @property
+    def outline_level(self):
+        """Cấp heading giới hạn trong 1..6 (dùng cho mục lục và HTML)."""
+        return min(max(self.level or 1, 1), 6)
+
+    def __repr__(self):
+        return f"ParagraphLabel({self.kind!r}, level={self.level!r}, styled={self.styled!r})"
+
+
+def _style_heading_level(style_name):
+    last = style_name.split()[-1] if style_name.split() else ""
+    return int(last) if last.isdigit() else None
+
+
+def _looks_like_heading(text):
+    if not text or len(text) > 120:
+        return False
+    if text.endswith("."):
+        return False
+    return text.isupper()
+
+
+@lru_cache(maxsize=8192)
+def classify_text(style_name, text):
+    """
+    Phân loại theo tên style và text (đã strip). Kết quả được cache.
+    """
+    lowered_style = style_name.lower()
+    if lowered_style.startswith("toc"):
+        kind = TOC_TITLE if lowered_style == "toc heading" else TOC_ENTRY
+        return ParagraphLabel(kind, styled=True)
+    if not text:
+        if style_name in CAPTION_STYLES:
+            return ParagraphLabel(FIGURE_CAPTION, styled=True)
+        return ParagraphLabel(EMPTY)
+    # Paragraph style Heading giữ nhãn heading dù text là "MỤC LỤC"/"(* ..."
+    if not lowered_style.startswith("heading"):
+        if text in TOC_TITLES:
+            return ParagraphLabel(TOC_TITLE)
+        if text.startswith(HINT_PREFIX):
+            return ParagraphLabel(HINT)
+
+    match = _PREFIX_PATTERN.match(text)
+    caps = _looks_like_heading(text)
+    list_prefix = text.startswith(BULLET_PREFIXES)
+
+    if match is not None and match.group("table") is not None:
+        return ParagraphLabel(TABLE_CAPTION, styled=style_name in CAPTION_STYLES,
+                              caption_text=match.group("table_text").strip(), caps=caps)
+    if match is not None and match.group("figure") is not None:
+        return ParagraphLabel(FIGURE_CAPTION, styled=style_name in CAPTION_STYLES,
+                              caption_text=match.group("figure_text").strip(), caps=caps)
+    if style_name in CAPTION_STYLES:
+        return ParagraphLabel(FIGURE_CAPTION, styled=True, caps=caps, list_prefix=list_prefix)
+
+    numbered = match is not None and match.group("numbered") is not None
+    if numbered:
+        # "1. ..." cũng là mục danh sách đánh số, "1.2. ..." thì không
+        list_prefix = list_prefix or "." not in match.group("number")
+    elif match is not None:
+        list_prefix = True
+
+    if lowered_style.startswith("heading"):
+        return ParagraphLabel(HEADING, level=_style_heading_level(style_name), styled=True,
+                              list_prefix=list_prefix, caps=caps)
+    if numbered:
+        level = min(max(match.group("number").count(".") + 1, 1), 6)
+        return ParagraphLabel(HEADING, level=level, numbered=True, list_prefix=list_prefix, caps=caps)
+    if list_prefix:
+        return ParagraphLabel(LIST_ITEM, list_prefix=True, caps=caps)
+    return ParagraphLabel(BODY, caps=caps)
+
+
+def classify_paragraph(paragraph):
+    """Phân loại một paragraph không qua ParagraphClassifier (tra style bằng python-docx)."""
+    style_name = paragraph.style.name if paragraph.style else ""
+    return classify_text(style_name, paragraph.text.strip())
+
+
+class ParagraphClassifier:
+    """
+    Nhãn của từng paragraph trong một Document, tính lười và giữ lại theo phần tử w:p.
+    Tên style được tra từ pStyle qua bảng style_id -> tên dựng một lần,
+    thay vì paragraph.style (tìm style trong styles.xml mỗi lần gọi).
+
+    Stage nào đổi text hoặc style của paragraph phải gọi refresh_paragraph(),
+    giống DocumentIndex.
+    """
+
+    def __init__(self, doc):
+        self._doc = doc
+        self._labels = {}
+        self._load_styles()
+
+    def _load_styles(self):
+        styles = self._doc.styles
+        self._style_names = {
+            style.style_id: style.name for style in styles if style.type == WD_STYLE_TYPE.PARAGRAPH
+        }
+        default = styles.default(WD_STYLE_TYPE.PARAGRAPH)
+        self._default_style = default.name if default is not None else ""
+
+    def style_name(self, p):
+        p_pr = p.find(W_PPR)
+        p_style = p_pr.find(W_PSTYLE) if p_pr is not None else None
+        if p_style is None:
+            return self._default_style
+        style_id = p_style.get(W_VAL)
+        name = self._style_names.get(style_id)
+        if name is None:
+            # Style được thêm vào sau khi dựng bảng tra; nạp lại một lần, nếu vẫn
+            # không có (pStyle trỏ tới style không tồn tại) thì nhớ luôn kết quả
+            self._load_styles()
+            name = self._style_names.setdefault(style_id, self._default_style)
+        return name
+
+    def label(self, paragraph):
+        p = paragraph._p
+        label = self._labels.get(p)
+        if label is None:
+            label = self._labels[p] = classify_text(self.style_name(p), paragraph.text.strip())
+        return label
+
+    def refresh_paragraph(self, p):
+        """Bỏ nhãn đã lưu của paragraph (sau khi text/style của nó thay đổi)."""
+        self._labels.pop(p, None)
+
+    def invalidate(self):
+        self._labels.clear()
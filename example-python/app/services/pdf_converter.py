@@ -0,0 +1,139 @@
+"""
+Module chuyển đổi .docx -> PDF qua ConvertAPI (hoặc server tương thích)
+- Một httpx.AsyncClient dùng chung: giữ kết nối keep-alive trong pool
+- Giới hạn số lần chuyển đổi chạy cùng lúc bằng semaphore
+- Thử lại khi lỗi mạng/429/5xx với thời gian chờ tăng dần (tôn trọng Retry-After,
+  nhưng không chờ lâu hơn timeout của một request)
+- Body gửi đi và PDF nhận về đều được stream, PDF ghi thẳng ra file
+Backend có thể thay thế: "convertapi" gọi dịch vụ thật, "fake" gọi server giả
+lập (backend/fake_convertapi.py) ngay trong process để test không cần mạng.
+"""
+import asyncio
+import logging
+import os
+from abc import ABC, abstractmethod
+
+import httpx
+
+from app.config import (
+    CONVERTAPI_BASE_URL,
+    CONVERTAPI_MAX_CONCURRENCY,
+    CONVERTAPI_MAX_CONNECTIONS,
+    CONVERTAPI_RETRIES,
+    CONVERTAPI_RETRY_BACKOFF,
+    CONVERTAPI_TIMEOUT,
+    PDF_CONVERTER_BACKEND,
+)
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+CONVERT_PATH = "/convert/docx/to/pdf"
+
+# Mã HTTP nên thử lại (quá tải hoặc lỗi tạm thời phía server)
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class ConversionError(Exception):
+    """Chuyển đổi PDF thất bại (sau khi đã thử lại nếu lỗi là tạm thời)."""
+
+
+class PdfConverter(ABC):
+    """Giao diện backend chuyển đổi: convert() ghi PDF ra pdf_path, aclose() giải phóng tài nguyên."""
+
+    @abstractmethod
+    async def convert(self, docx_stream, pdf_path):
+        """Chuyển docx_stream sang PDF và ghi ra pdf_path, lỗi thì raise ConversionError."""
+
+    async def aclose(self):
+        pass
+
+
+class HttpPdfConverter(PdfConverter):
+    def __init__(
+        self,
+        base_url,
+        secret,
+        timeout=CONVERTAPI_TIMEOUT,
+        max_connections=CONVERTAPI_MAX_CONNECTIONS,
+        max_concurrency=CONVERTAPI_MAX_CONCURRENCY,
+        retries=CONVERTAPI_RETRIES,
+        backoff=CONVERTAPI_RETRY_BACKOFF,
+        transport=None,
+    ):
+        self._secret = secret
+        self._retries = retries
+        self._backoff = backoff
+        # Retry-After lớn (vd: 429 kèm 3600) không được giữ request quá thời gian này
+        self._max_retry_delay = float(timeout)
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            transport=transport,
+        )
+
+    def _retry_delay(self, attempt, response=None):
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return min(float(retry_after), self._max_retry_delay)
+        return min(self._backoff * (2 ** attempt), self._max_retry_delay)
+
+    async def convert(self, docx_stream, pdf_path):
+        """
+        Gửi file .docx và ghi PDF nhận được ra pdf_path.
+
+        Args:
+            docx_stream: File-like (có seek) chứa nội dung .docx
+            pdf_path: Đường dẫn file PDF đích (ghi file tạm rồi rename)
+        """
+        tmp_path = f"{pdf_path}.tmp"
+        params = {"Secret": self._secret, "download": "attachment"}
+        for attempt in range(self._retries + 1):
+            last_attempt = attempt == self._retries
+            docx_stream.seek(0)
+            files = {"File": ("document.docx", docx_stream, DOCX_MIME)}
+            try:
+                async with self._slots:
+                    async with self._client.stream("POST", CONVERT_PATH, params=params, files=files) as response:
+                        if response.status_code == 200:
+                            with open(tmp_path, "wb") as f:
+                                async for chunk in response.aiter_bytes():
+                                    f.write(chunk)
+                            os.replace(tmp_path, pdf_path)
+                            return
+                        await response.aread()
+                if response.status_code not in RETRY_STATUS_CODES or last_attempt:
+                    raise ConversionError(f"PDF conversion failed with HTTP {response.status_code}")
+                delay = self._retry_delay(attempt, response)
+                logging.warning(f"PDF conversion got HTTP {response.status_code}, retrying in {delay}s")
+            except httpx.TransportError as exc:
+                if last_attempt:
+                    raise ConversionError(f"PDF conversion failed: {exc}") from exc
+                delay = self._retry_delay(attempt)
+                logging.warning(f"PDF conversion error: {exc}, retrying in {delay}s")
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self._client.aclose()
+
+
+def create_pdf_converter(secret, backend=PDF_CONVERTER_BACKEND, base_url=CONVERTAPI_BASE_URL):
+    """
+    Tạo backend chuyển đổi theo cấu hình.
+
+    Returns: PdfConverter, hoặc None nếu dùng ConvertAPI mà chưa có secret
+    """
+    if backend == "fake":
+        from backend.fake_convertapi import app as fake_app
+
+        return HttpPdfConverter("http://fake-convertapi", "fake", transport=httpx.ASGITransport(app=fake_app))
+    if backend == "convertapi":
+        return HttpPdfConverter(base_url, secret) if secret else None
+    raise ValueError(f"Unknown PDF converter backend: {backend!r}")
@@ -0,0 +1,45 @@
+"""
+Module cache PDF preview theo file_id
+PDF được chuyển đổi MỘT LẦN từ file .docx trong kho preview rồi lưu cạnh nó
+(cùng thời hạn), các lần xem sau đọc thẳng file .pdf - không chuyển đổi lại.
+Nhiều request xem cùng file_id cùng lúc chỉ tạo một lần chuyển đổi.
+"""
+import asyncio
+
+PDF_SUFFIX = ".pdf"
+
+_conversion_locks = {}
+
+
+async def ensure_pdf_preview(store, file_id, converter):
+    """
+    Đảm bảo PDF preview của file_id đã có trong kho.
+
+    Args:
+        store: PreviewStore chứa file .docx
+        converter: PdfConverter dùng khi chưa có PDF (có thể lỗi ConversionError)
+
+    Returns: Path của file PDF, hoặc None nếu file .docx không tồn tại/đã hết hạn
+    """
+    pdf_path = store.get(file_id, PDF_SUFFIX)
+    if pdf_path is not None:
+        return pdf_path
+
+    lock = _conversion_locks.setdefault(file_id, asyncio.Lock())
+    try:
+        async with lock:
+            # Request khác có thể đã chuyển đổi xong trong lúc chờ lock
+            pdf_path = store.get(file_id, PDF_SUFFIX)
+            if pdf_path is not None:
+                return pdf_path
+            docx_path = store.get(file_id)
+            if docx_path is None:
+                return None
+            tmp_path = store.temp_path_for(file_id, PDF_SUFFIX)
+            with open(docx_path, "rb") as docx_stream:
+                await converter.convert(docx_stream, tmp_path)
+            await asyncio.to_thread(store.save_file, tmp_path, PDF_SUFFIX, file_id)
+            return store.get(file_id, PDF_SUFFIX)
+    finally:
+        if not lock.locked():
+            _conversion_locks.pop(file_id, None)
@@ -0,0 +1,216 @@
+"""
+Module đo thời gian và bộ đếm theo từng stage của pipeline định dạng
+- FormatMetrics ghi lại cho MỘT request: wall time, CPU time và số
+  paragraph/run/phần tử đã đi qua mỗi stage, cùng các bộ đếm tự do
+  (vd: số run trước/sau khi gộp)
+- MetricsRegistry cộng dồn các lần đo của cả process và xuất ra dạng text
+  của Prometheus (endpoint /api/metrics)
+- Việc định dạng chạy trong worker process nên kết quả đo được gửi về dưới
+  dạng dict (snapshot) qua run_measured()
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from docx.oxml.ns import qn
+
+P_TAG = qn("w:p")
+R_TAG = qn("w:r")
+TC_TAG = qn("w:tc")
+
+_FIELDS = ("calls", "wall", "cpu", "paragraphs", "runs", "elements")
+
+
+class _StageRecord:
+    __slots__ = _FIELDS
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.paragraphs = 0
+        self.runs = 0
+        self.elements = 0
+
+    def count_block(self, element):
+        """Đếm paragraph/run/phần tử của một block (w:p hoặc w:tbl) trước khi stage xử lý."""
+        if element.tag == P_TAG:
+            self.paragraphs += 1
+            self.runs += sum(1 for _ in element.iterchildren(R_TAG))
+            self.elements += len(element)
+        else:
+            self.paragraphs += sum(1 for _ in element.iter(P_TAG))
+            self.runs += sum(1 for _ in element.iter(R_TAG))
+            self.elements += sum(1 for _ in element.iter(TC_TAG))
+
+
+class FormatMetrics:
+    """Kết quả đo của một lần định dạng, theo thứ tự các stage được chạy."""
+
+    def __init__(self):
+        self._stages = {}
+        self.counters = {}
+        self.cache_hit = False
+
+    def _record(self, name):
+        record = self._stages.get(name)
+        if record is None:
+            record = self._stages[name] = _StageRecord()
+        return record
+
+    @contextmanager
+    def stage(self, name, paragraphs=0, runs=0, elements=0):
+        """Đo một stage chạy một lần trên cả tài liệu (margins, TOC, số trang, lưu file...)."""
+        record = self._record(name)
+        wall_started = time.perf_counter()
+        cpu_started = time.process_time()
+        try:
+            yield record
+        finally:
+            record.calls += 1
+            record.wall += time.perf_counter() - wall_started
+            record.cpu += time.process_time() - cpu_started
+            record.paragraphs += paragraphs
+            record.runs += runs
+            record.elements += elements
+
+    def wrap(self, name, block_stage):
+        """Bọc một stage của walk_body để đo thời gian và đếm block đi qua nó."""
+        record = self._record(name)
+
+        def measured(block):
+            record.count_block(block._element)
+            wall_started = time.perf_counter()
+            cpu_started = time.process_time()
+            block_stage(block)
+            record.cpu += time.process_time() - cpu_started
+            record.wall += time.perf_counter() - wall_started
+            record.calls += 1
+
+        return measured
+
+    def count(self, name, value=1):
+        """Cộng value vào bộ đếm name (không gắn với thời gian của stage nào)."""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        """
+        Dict pickle được:
+        {"cache_hit": bool, "counters": {tên: số}, "stages": {tên: {calls, wall, cpu, ...}}}
+        """
+        return {
+            "cache_hit": self.cache_hit,
+            "counters": dict(self.counters),
+            "stages": {
+                name: {field: getattr(record, field) for field in _FIELDS}
+                for name, record in self._stages.items()
+            },
+        }
+
+
+def run_measured(fn, *args, **kwargs):
+    """
+    Gọi fn(*args, metrics=FormatMetrics(), **kwargs) và trả về (kết quả, snapshot).
+    Là hàm cấp module nên chạy được trong process pool.
+    """
+    metrics = FormatMetrics()
+    result = fn(*args, metrics=metrics, **kwargs)
+    return result, metrics.snapshot()
+
+
+def server_timing_header(snapshot, total=None):
+    """
+    Giá trị header Server-Timing (thời gian tính bằng ms) từ snapshot.
+    total: tổng thời gian phía server (giây), gồm cả pre-flight và thời gian chờ worker
+    """
+    entries = [
+        f'{name};dur={values["wall"] * 1000:.1f};desc="cpu {values["cpu"] * 1000:.1f}ms"'
+        for name, values in snapshot["stages"].items()
+    ]
+    if snapshot["cache_hit"]:
+        entries.append('cache;desc="hit"')
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class MetricsRegistry:
+    """Cộng dồn snapshot của mọi request trong process (thread-safe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._cache_hits = 0
+        self._stages = {}
+        self._counters = {}
+
+    def observe(self, snapshot):
+        with self._lock:
+            self._requests += 1
+            self._cache_hits += int(snapshot["cache_hit"])
+            for name, values in snapshot["stages"].items():
+                totals = self._stages.setdefault(name, dict.fromkeys(_FIELDS, 0))
+                for field in _FIELDS:
+                    totals[field] += values[field]
+            for name, value in snapshot.get("counters", {}).items():
+                self._counters[name] = self._counters.get(name, 0) + value
+
+    def render_prometheus(self, gauges=()):
+        """
+        Xuất các bộ đếm dạng text exposition của Prometheus.
+        gauges: các bộ (tên, mô tả, [({nhãn: giá trị} hoặc None, giá trị), ...]) thêm vào cuối
+        """
+        with self._lock:
+            stages = {name: dict(values) for name, values in self._stages.items()}
+            counters = dict(self._counters)
+            requests, cache_hits = self._requests, self._cache_hits
+
+        lines = []
+
+        def metric(name, kind, description, samples):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{val}"' for key, val in (labels or {}).items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        metric("docx_format_requests_total", "counter", "Formatting requests measured", [(None, requests)])
+        metric("docx_format_cache_hits_total", "counter", "Formatting requests served from the result cache",
+               [(None, cache_hits)])
+        per_stage = (
+            ("calls", "docx_format_stage_calls_total", "Times a stage ran (per block for body stages)"),
+            ("wall", "docx_format_stage_wall_seconds_total", "Wall-clock time spent in a stage"),
+            ("cpu", "docx_format_stage_cpu_seconds_total", "CPU time spent in a stage"),
+            ("paragraphs", "docx_format_stage_paragraphs_total", "Paragraphs touched by a stage"),
+            ("runs", "docx_format_stage_runs_total", "Runs touched by a stage"),
+            ("elements", "docx_format_stage_elements_total", "XML elements (paragraph children, table cells, sections) touched by a stage"),
+        )
+        for field, name, description in per_stage:
+            samples = [({"stage": stage}, _format_value(values[field])) for stage, values in stages.items()]
+            metric(name, "counter", description, samples)
+
+        if counters:
+            metric("docx_format_counter_total", "counter", "Document counters reported by stages",
+                   [({"counter": name}, value) for name, value in sorted(counters.items())])
+
+        for name, description, samples in gauges:
+            metric(name, "gauge", description, samples)
+        return "\n".join(lines) + "\n"
+
+
+def _format_value(value):
+    return f"{value:.6f}" if isinstance(value, float) else str(value)
+
+
+_metrics_registry = None
+_metrics_registry_lock = threading.Lock()
+
+
+def get_metrics_registry():
+    """Registry dùng chung cho toàn process."""
+    global _metrics_registry
+    if _metrics_registry is None:
+        with _metrics_registry_lock:
+            if _metrics_registry is None:
+                _metrics_registry = MetricsRegistry()
+    return _metrics_registry
@@ -0,0 +1,280 @@
+"""
+Module kho file preview có thời hạn (TTL-based preview store)
+- Mỗi file_id được lưu trong thư mục con theo 2 ký tự đầu (sharding)
+- Thời điểm hết hạn được ghi vào mtime của file, nên nhiều worker process
+  dùng chung thư mục vẫn thấy cùng một TTL
+- Tổng dung lượng bị giới hạn, vượt quá thì xóa entry cũ nhất trước
+- Một thread nền định kỳ dọn các file đã hết hạn
+Các file đi kèm cùng file_id (vd: .html, .pdf) dùng chung thời hạn với file .docx.
+"""
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from app.config import (
+    PREVIEW_STORE_DIR,
+    PREVIEW_STORE_MAX_BYTES,
+    PREVIEW_SWEEP_INTERVAL,
+    PREVIEW_TTL_SECONDS,
+    TEMP_DIR,
+)
+
+PRIMARY_SUFFIX = ".docx"
+FILE_ID_PATTERN = re.compile(r"^[0-9a-f][0-9a-f-]{7,63}$")
+
+
+class PreviewStore:
+    def __init__(self, root, ttl_seconds, max_bytes, legacy_dir=None):
+        self._root = Path(root)
+        self._ttl = ttl_seconds
+        self._max_bytes = max_bytes
+        self._legacy_dir = Path(legacy_dir) if legacy_dir else None
+        self._root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._approx_bytes = None
+        self._sweeper = None
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def new_id():
+        return str(uuid.uuid4())
+
+    @staticmethod
+    def is_valid_id(file_id):
+        return bool(file_id) and FILE_ID_PATTERN.match(file_id) is not None
+
+    def path_for(self, file_id, suffix=PRIMARY_SUFFIX):
+        if not self.is_valid_id(file_id):
+            raise ValueError(f"Invalid file id: {file_id!r}")
+        return self._root / file_id[:2] / f"{file_id}{suffix}"
+
+    def _expiry_for(self, file_id, suffix, ttl):
+        """Thời hạn của file: file phụ dùng chung thời hạn với file .docx chính."""
+        now = time.time()
+        if ttl is not None:
+            return now + ttl
+        if suffix != PRIMARY_SUFFIX:
+            try:
+                return self.path_for(file_id).stat().st_mtime
+            except OSError:
+                pass
+        return now + self._ttl
+
+    def save(self, data, suffix=PRIMARY_SUFFIX, file_id=None, ttl=None):
+        """
+        Lưu nội dung (bytes hoặc file-like) vào kho và trả về file_id.
+
+        Args:
+            data: bytes hoặc đối tượng có .read()
+            suffix: Đuôi file (".docx" cho file chính, ".html"/".pdf" cho file phụ)
+            file_id: Dùng lại file_id có sẵn (khi lưu file phụ), None để tạo mới
+            ttl: Thời gian sống (giây); None = TTL mặc định hoặc theo file chính
+        """
+        if file_id is None:
+            file_id = self.new_id()
+        path = self.path_for(file_id, suffix)
+        # Tên tạm ngẫu nhiên: thread ident trùng nhau giữa các worker process
+        tmp_path = self.temp_path_for(file_id, suffix)
+        try:
+            with open(tmp_path, "wb") as f:
+                if isinstance(data, (bytes, bytearray, memoryview)):
+                    f.write(data)
+                else:
+                    shutil.copyfileobj(data, f)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        self.touch(file_id, suffix, ttl)
+        self._account(path.stat().st_size)
+        return file_id
+
+    def save_file(self, source_path, suffix=PRIMARY_SUFFIX, file_id=None, ttl=None):
+        """
+        Chuyển một file có sẵn vào kho (rename, không copy nội dung) và trả về file_id.
+        source_path phải nằm cùng ổ đĩa với thư mục kho (vd: file tạm tạo bằng temp_path_for).
+        """
+        if file_id is None:
+            file_id = self.new_id()
+        path = self.path_for(file_id, suffix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(source_path, path)
+        self.touch(file_id, suffix, ttl)
+        self._account(path.stat().st_size)
+        return file_id
+
+    def temp_path_for(self, file_id, suffix=PRIMARY_SUFFIX):
+        """Đường dẫn file tạm cạnh file đích (sweep tự dọn nếu bị bỏ dở)."""
+        path = self.path_for(file_id, suffix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+
+    def touch(self, file_id, suffix=PRIMARY_SUFFIX, ttl=None):
+        """Đặt lại thời hạn của một file trong kho."""
+        path = self.path_for(file_id, suffix)
+        os.utime(path, (time.time(), self._expiry_for(file_id, suffix, ttl)))
+
+    def get(self, file_id, suffix=PRIMARY_SUFFIX):
+        """Trả về Path của file nếu còn hạn, ngược lại None (file hết hạn bị xóa luôn)."""
+        if not self.is_valid_id(file_id):
+            return None
+        path = self.path_for(file_id, suffix)
+        try:
+            expiry = path.stat().st_mtime
+        except OSError:
+            return None
+        if expiry < time.time():
+            self.delete(file_id)
+            return None
+        return path
+
+    def delete(self, file_id):
+        """Xóa file chính và mọi file phụ của file_id."""
+        if not self.is_valid_id(file_id):
+            return 0
+        freed = 0
+        shard = self._root / file_id[:2]
+        for path in shard.glob(f"{file_id}.*"):
+            try:
+                size = path.stat().st_size
+                path.unlink()
+                freed += size
+            except OSError:
+                pass
+        self._account(-freed)
+        return freed
+
+    def _account(self, delta):
+        with self._lock:
+            if self._approx_bytes is None:
+                return
+            self._approx_bytes += delta
+            over_limit = self._approx_bytes > self._max_bytes
+        if over_limit:
+            self.sweep()
+
+    def _scan_entries(self):
+        """Gom các file trong kho theo file_id: {file_id: [expiry, size, [paths]]}"""
+        entries = {}
+        now = time.time()
+        for shard in self._root.iterdir():
+            if not shard.is_dir():
+                continue
+            for path in shard.iterdir():
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                if path.name.endswith(".tmp"):
+                    # File ghi dở từ lần lưu bị lỗi
+                    if stat.st_mtime < now - self._ttl:
+                        path.unlink(missing_ok=True)
+                    continue
+                file_id = path.name.split(".", 1)[0]
+                entry = entries.setdefault(file_id, [None, 0, []])
+                if path.suffix == PRIMARY_SUFFIX or entry[0] is None:
+                    entry[0] = stat.st_mtime
+                entry[1] += stat.st_size
+                entry[2].append(path)
+        return entries
+
+    def _sweep_legacy(self, now):
+        """Dọn các file <uuid>.docx kiểu cũ nằm trực tiếp trong TEMP_DIR."""
+        if self._legacy_dir is None:
+            return 0
+        removed = 0
+        for path in self._legacy_dir.glob("*.docx"):
+            try:
+                if path.stat().st_mtime + self._ttl < now:
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def sweep(self):
+        """
+        Xóa các entry hết hạn, sau đó xóa entry cũ nhất cho tới khi
+        tổng dung lượng nhỏ hơn giới hạn.
+        """
+        with self._sweep_lock:
+            now = time.time()
+            entries = self._scan_entries()
+            expired = [file_id for file_id, (expiry, _, _) in entries.items() if expiry < now]
+            for file_id in expired:
+                for path in entries.pop(file_id)[2]:
+                    path.unlink(missing_ok=True)
+
+            total = sum(size for _, size, _ in entries.values())
+            evicted = 0
+            if total > self._max_bytes:
+                for file_id, (_, size, paths) in sorted(entries.items(), key=lambda item: item[1][0]):
+                    if total <= self._max_bytes:
+                        break
+                    for path in paths:
+                        path.unlink(missing_ok=True)
+                    total -= size
+                    evicted += 1
+
+            legacy = self._sweep_legacy(now)
+            with self._lock:
+                self._approx_bytes = total
+            if expired or evicted or legacy:
+                logging.info(
+                    f"Preview store sweep: {len(expired)} expired, {evicted} evicted, "
+                    f"{legacy} legacy files removed, {total} bytes in use"
+                )
+            return {"expired": len(expired), "evicted": evicted, "legacy": legacy, "bytes": total}
+
+    def start_sweeper(self, interval=PREVIEW_SWEEP_INTERVAL):
+        """Chạy sweep() định kỳ trong một daemon thread (gọi nhiều lần cũng chỉ tạo 1 thread)."""
+        with self._lock:
+            if self._sweeper is not None and self._sweeper.is_alive():
+                return
+            self._stop_event.clear()
+            self._sweeper = threading.Thread(
+                target=self._sweep_loop, args=(interval,), name="preview-store-sweeper", daemon=True
+            )
+            self._sweeper.start()
+
+    def stop_sweeper(self):
+        self._stop_event.set()
+
+    def _sweep_loop(self, interval):
+        while True:
+            try:
+                self.sweep()
+            except Exception as exc:
+                logging.warning(f"Preview store sweep failed: {exc}")
+            if self._stop_event.wait(interval):
+                return
+
+
+_preview_store = None
+_preview_store_lock = threading.Lock()
+
+
+def get_preview_store(start_sweeper=True):
+    """
+    Kho preview dùng chung cho toàn process; sweeper nền được khởi động ở lần dùng đầu.
+    Worker process (vd: process pool của job) dùng start_sweeper=False vì
+    process chính đã dọn dẹp thư mục dùng chung.
+    """
+    global _preview_store
+    if _preview_store is None:
+        with _preview_store_lock:
+            if _preview_store is None:
+                _preview_store = PreviewStore(
+                    PREVIEW_STORE_DIR,
+                    ttl_seconds=PREVIEW_TTL_SECONDS,
+                    max_bytes=PREVIEW_STORE_MAX_BYTES,
+                    legacy_dir=TEMP_DIR,
+                )
+    if start_sweeper:
+        _preview_store.start_sweeper()
+    return _preview_store
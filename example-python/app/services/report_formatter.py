@@ -1,5 +1,7 @@
 import logging
 import re
+from copy import deepcopy
+from functools import lru_cache
 from io import BytesIO
 from html import escape
 
@@ -23,9 +25,11 @@ from docx.text.paragraph import Paragraph
 
 from app.config import (
     BODY_FONT_SIZE,
+    DOCX_DEFLATE_LEVEL,
     HEADING_FONT_SIZE,
     PAGE_NUMBER_FONT_SIZE,
     PARAGRAPH_INDENT,
+    RESULT_CACHE_ENABLED,
     STANDARD_FONT,
     TOC_FONT_SIZE,
     UEL_MARGINS,
@@ -34,10 +38,49 @@ from app.utils.options import merge_options
 from app.services.docx_styles import (
     _copy_heading_style_to_toc,
     _ensure_caption_style,
-    _ensure_east_asia_font,
-    _format_toc_paragraphs,
+    _format_toc_paragraph,
     _set_run_format,
 )
+from app.services.docx_index import DocumentIndex
+from app.services.docx_package import deflate_level_from_options, save_document
+from app.services.pipeline_metrics import FormatMetrics
+from app.services.docx_run_props import forced_font_fragment, run_props_fragment
+from app.services.result_cache import get_result_cache, result_cache_key
+from app.services.docx_preflight import preflight_docx
+from app.services.docx_runs import coalesce_block_runs
+from app.services.docx_style_defaults import (
+    InheritedRunProps,
+    apply_style_defaults,
+    strip_block_run_props,
+    strip_inherited_run_props,
+)
+from app.services.page_estimator import PageEstimator
+from app.services.docx_generated import (
+    find_generated_region,
+    format_stamp,
+    mark_generated_region,
+    read_format_stamp,
+    remove_generated_region,
+    write_format_stamp,
+)
+from app.services.uploads import open_source
+from app.services.docx_walker import (
+    ensure_cell_paragraph,
+    iter_paragraphs_between,
+    iter_table_cells,
+    walk_body,
+)
+from app.services.paragraph_classifier import (
+    FIGURE_CAPTION,
+    HEADING,
+    HINT,
+    TABLE_CAPTION,
+    TOC_ENTRY,
+    TOC_TITLE,
+    TOC_TITLES,
+    ParagraphClassifier,
+    classify_paragraph,
+)
 from app.services.docx_fields import (
     _add_page_number_field,
     _add_page_number_field_complex,
@@ -48,22 +91,17 @@ from app.services.docx_fields import (
 # =========================================================================
 # MODULE-LEVEL COMPILED REGEX PATTERNS (Performance Optimization)
 # =========================================================================
-# Compile regex once at module load instead of every function call
-NUMBERED_HEADING_PATTERN = re.compile(r'^(\d+(?:\.\d+)*)\.\s+(.+)$')
-
-# Separate patterns for Table vs Figure captions
-TABLE_CAPTION_PATTERN = re.compile(r'^Bảng[\s\d\.]*[:\.]?\s*(.+)$', re.IGNORECASE)
-FIGURE_CAPTION_PATTERN = re.compile(r'^(Hình|Sơ đồ|Biểu đồ)[\s\d\.]*[:\.]?\s*(.+)$', re.IGNORECASE)
-
-# Combined pattern for general caption detection (backward compatibility)
-CAPTION_PATTERN = re.compile(r'^(Hình|Sơ đồ|Bảng|Biểu đồ)[\s\d\.]*[:\.]?\s+(.+)$', re.IGNORECASE)
+# Caption/heading patterns nằm trong paragraph_classifier (import ở trên)
 WHITESPACE_PATTERN = re.compile(r"[ \t\u00A0]{2,}")
 
 
-def _paragraph_has_image(paragraph):
+def _paragraph_has_image(paragraph, index=None):
     """
     Kiểm tra paragraph có chứa hình ảnh không (an toàn, không làm mất hình)
+    Nếu có index (DocumentIndex) thì tra cứu chỉ mục thay vì chạy xpath
     """
+    if index is not None:
+        return index.paragraph_has_image(paragraph._p)
     try:
         # Kiểm tra trong XML: w:drawing (hình ảnh hiện đại) hoặc w:pict (hình ảnh cũ/shape)
         has_drawing = paragraph._element.xpath('.//w:drawing')
@@ -73,12 +111,12 @@ def _paragraph_has_image(paragraph):
         return False
 
 
-def _clean_leading_spaces(paragraph):
+def _clean_leading_spaces(paragraph, index=None):
     """
     Xóa khoảng trắng đầu dòng - AN TOÀN: Chỉ xử lý text, không ảnh hưởng hình ảnh
     """
     try:
-        if _paragraph_has_image(paragraph):
+        if _paragraph_has_image(paragraph, index):
             return
         for run in paragraph.runs:
             if not run.text:
@@ -91,12 +129,12 @@ def _clean_leading_spaces(paragraph):
         pass
 
 
-def _collapse_internal_spaces(paragraph):
+def _collapse_internal_spaces(paragraph, index=None):
     """
     Gộp khoảng trắng thừa - AN TOÀN: Chỉ xử lý text, không ảnh hưởng hình ảnh
     """
     try:
-        if _paragraph_has_image(paragraph):
+        if _paragraph_has_image(paragraph, index):
             return
         for run in paragraph.runs:
             if not run.text:
@@ -118,42 +156,38 @@ def _remove_paragraph(paragraph):
         pass
 
 
-def _looks_like_heading(text):
-    text = text.strip()
-    if not text or len(text) > 120:
-        return False
-    if text.endswith("."):
-        return False
-    return text.isupper()
+def _label(paragraph, classifier=None):
+    """Nhãn của paragraph: tra ParagraphClassifier nếu có, không thì phân loại trực tiếp"""
+    if classifier is not None:
+        return classifier.label(paragraph)
+    return classify_paragraph(paragraph)
 
-def _detect_numbered_heading(text):
-    """Detect numbered heading using cached compiled pattern."""
-    text = text.strip()
-    if not text:
-        return None, False
-    # Use module-level compiled pattern for performance
-    match = NUMBERED_HEADING_PATTERN.match(text)
-    if match:
-        number_part = match.group(1)
-        level = number_part.count('.') + 1
-        level = min(max(level, 1), 6)
-        return level, True
-    return None, False
 
-def _document_has_toc(doc):
-    for paragraph in doc.paragraphs:
-        for run in paragraph.runs:
-            # Check simple field
-            for child in run._element:
-                if child.tag.endswith("fldSimple"):
-                    instr = child.get(qn("w:instr"))
-                    if instr and "TOC" in instr:
-                        return True
-            # Check complex field
-            if "TOC" in run.text and "instrText" in [c.tag.split('}')[-1] for c in run._element.iter()]:
-                 return True
+def _paragraph_has_toc_field(paragraph, index=None):
+    if index is not None:
+        for run, kind, instr in index.paragraph_fields(paragraph._p):
+            if run is None:
+                continue
+            if kind == "simple" and "TOC" in instr:
+                return True
+            if kind == "complex" and "TOC" in run.text:
+                return True
+        return False
+    for run in paragraph.runs:
+        # Check simple field
+        for child in run._element:
+            if child.tag.endswith("fldSimple"):
+                instr = child.get(qn("w:instr"))
+                if instr and "TOC" in instr:
+                    return True
+        # Check complex field
+        if "TOC" in run.text and "instrText" in [c.tag.split('}')[-1] for c in run._element.iter()]:
+             return True
     return False
 
+def _document_has_toc(doc):
+    return any(_paragraph_has_toc_field(paragraph) for paragraph in doc.paragraphs)
+
 def _find_toc_anchor(doc):
     for paragraph in doc.paragraphs:
         style_name = paragraph.style.name if paragraph.style else ""
@@ -161,18 +195,6 @@ def _find_toc_anchor(doc):
             return paragraph
     return doc.paragraphs[0] if doc.paragraphs else None
 
-def _insert_paragraph_after(paragraph, text=""):
-    try:
-        new_p = OxmlElement("w:p")
-        paragraph._p.addnext(new_p)
-        new_para = Paragraph(new_p, paragraph._parent)
-        if text:
-            new_para.add_run(text)
-        return new_para
-    except Exception:
-        logging.warning("Cannot insert paragraph after requested position.")
-        return paragraph
-
 def _add_section_break(paragraph):
     """
     Thêm section break (ngắt trang với section mới) vào paragraph
@@ -226,101 +248,113 @@ def _add_section_break(paragraph):
 # =========================================================================
 def _force_caption_font(run):
     """Force set font Times New Roman 13pt cho caption run"""
-    # Set qua API
-    run.font.name = STANDARD_FONT
-    run.font.size = TOC_FONT_SIZE
-    run.font.bold = False
-    run.font.italic = True
-    _ensure_east_asia_font(run)
-    
-    # Force set trong XML
-    r_pr = run._element.get_or_add_rPr()
-    
-    # Xóa font cũ
-    for child in list(r_pr):
-        tag_name = child.tag.split('}')[-1] if '}' in child.tag else child.tag
-        if tag_name in ["rFonts", "sz", "szCs"]:
-            r_pr.remove(child)
-    
-    # Set font Times New Roman
-    r_fonts = OxmlElement("w:rFonts")
-    r_fonts.set(qn("w:ascii"), STANDARD_FONT)
-    r_fonts.set(qn("w:hAnsi"), STANDARD_FONT)
-    r_fonts.set(qn("w:eastAsia"), STANDARD_FONT)
-    r_fonts.set(qn("w:cs"), STANDARD_FONT)
-    r_pr.insert(0, r_fonts)
-    
-    # Set size 13pt
-    sz_half_pts = int(TOC_FONT_SIZE.pt * 2)
-    sz = OxmlElement("w:sz")
-    sz.set(qn("w:val"), str(sz_half_pts))
-    r_pr.append(sz)
-    sz_cs = OxmlElement("w:szCs")
-    sz_cs.set(qn("w:val"), str(sz_half_pts))
-    r_pr.append(sz_cs)
-
-def _process_captions(doc):
+    # Set qua API (không đậm, nghiêng) + force set rFonts/sz/szCs trong XML
+    run_props_fragment(STANDARD_FONT, TOC_FONT_SIZE, bold=False, italic=True, force_xml=True).apply_to_run(run)
+
+def _process_caption_paragraph(paragraph, counters, index=None, classifier=None):
     """
-    Xử lý captions cho Bảng và Hình riêng biệt.
-    - Bảng: đánh số Bảng 1, Bảng 2, ...
-    - Hình/Sơ đồ/Biểu đồ: đánh số Hình 1, Hình 2, ...
+    Nhận diện và đánh số lại caption cho một paragraph.
+    counters: dict {"table": n, "figure": n} dùng chung cho cả tài liệu.
+    classifier: ParagraphClassifier của tài liệu (tùy chọn)
     """
-    _ensure_caption_style(doc)
-    figure_count = 0  # For: Hình, Sơ đồ, Biểu đồ
-    table_count = 0   # For: Bảng
+    label = _label(paragraph, classifier)
+    if label.caption_text is None:
+        return
+    has_image = _paragraph_has_image(paragraph, index)
     
-    for paragraph in doc.paragraphs:
-        has_image = _paragraph_has_image(paragraph)
-        text = paragraph.text.strip()
-        if not text: 
-            continue
-        
-        # Check for Table caption first
-        table_match = TABLE_CAPTION_PATTERN.match(text)
-        figure_match = FIGURE_CAPTION_PATTERN.match(text)
-        
-        new_text = None
-        
-        if table_match:
-            # This is a Table caption
-            table_count += 1
-            content = table_match.group(1).strip()
-            new_text = f"Bảng {table_count}: {content}"
-            paragraph.style = "UEL Figure"  # Reuse same style
-            paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            
-        elif figure_match:
-            # This is a Figure caption (Hình, Sơ đồ, Biểu đồ)
-            figure_count += 1
-            content = figure_match.group(2).strip()
-            new_text = f"Hình {figure_count}: {content}"
-            paragraph.style = "UEL Figure"
-            paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    new_text = None
+    
+    if label.kind == TABLE_CAPTION:
+        # This is a Table caption
+        counters["table"] += 1
+        new_text = f"Bảng {counters['table']}: {label.caption_text}"
+        paragraph.style = "UEL Figure"  # Reuse same style
+        paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
         
-        # Apply the new text if we found a caption
-        if new_text:
-            if has_image:
-                text_replaced = False
-                for run in paragraph.runs:
-                    if run.text.strip():
-                        if not text_replaced:
-                            run.text = new_text
-                            _force_caption_font(run)
-                            text_replaced = True
-                        else:
-                            run.text = ""
-            else:
-                paragraph.text = "" 
-                run = paragraph.add_run(new_text)
-                _force_caption_font(run)
+    elif label.kind == FIGURE_CAPTION:
+        # This is a Figure caption (Hình, Sơ đồ, Biểu đồ)
+        counters["figure"] += 1
+        new_text = f"Hình {counters['figure']}: {label.caption_text}"
+        paragraph.style = "UEL Figure"
+        paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
     
-    if figure_count > 0 or table_count > 0:
-        logging.info(f"Processed {table_count} tables and {figure_count} figures with font {STANDARD_FONT} {TOC_FONT_SIZE.pt}pt")
+    # Apply the new text if we found a caption
+    if new_text:
+        if has_image:
+            text_replaced = False
+            for run in paragraph.runs:
+                if run.text.strip():
+                    if not text_replaced:
+                        run.text = new_text
+                        _force_caption_font(run)
+                        text_replaced = True
+                    else:
+                        run.text = ""
+            # Ghi đè run.text có thể xóa luôn hình nằm chung run
+            if index is not None:
+                index.refresh_paragraph(paragraph._p)
+        else:
+            paragraph.text = "" 
+            run = paragraph.add_run(new_text)
+            _force_caption_font(run)
+        if classifier is not None:
+            classifier.refresh_paragraph(paragraph._p)
+
+
+def _log_caption_counts(counters):
+    if counters["figure"] > 0 or counters["table"] > 0:
+        logging.info(f"Processed {counters['table']} tables and {counters['figure']} figures with font {STANDARD_FONT} {TOC_FONT_SIZE.pt}pt")
+
 
 # =========================================================================
 # HÀM CHÈN TOC (MỤC LỤC) VÀ TOF (DANH MỤC HÌNH) - THỦ CÔNG
 # =========================================================================
-def _collect_headings_tables_figures_single_pass(doc):
+def _new_toc_collection():
+    """
+    Trạng thái thu thập headings/tables/figures dùng cho một lần duyệt.
+    Mỗi mục giữ phần tử w:p thay cho số trang; số trang được gán sau khi duyệt
+    xong (_resolve_toc_pages) vì cần chiều cao của toàn bộ body đã định dạng.
+    """
+    return {
+        "headings": [],
+        "tables": [],
+        "figures": [],
+    }
+
+
+def _collect_toc_paragraph(paragraph, collection, classifier=None):
+    """
+    Ghi nhận một paragraph vào collection (heading, caption bảng, caption hình).
+    """
+    text = paragraph.text.strip()
+    if not text:
+        return
+    
+    label = _label(paragraph, classifier)
+    if label.kind == HEADING and label.styled:
+        collection["headings"].append((text, label.outline_level, paragraph._p))
+    elif label.kind == TABLE_CAPTION:
+        collection["tables"].append((text, paragraph._p))
+    elif label.kind == FIGURE_CAPTION:
+        # Caption style không khớp "Bảng"/"Hình" cũng được xếp vào danh mục hình
+        collection["figures"].append((text, paragraph._p))
+
+
+def _resolve_toc_pages(doc, collection, options=None, classifier=None):
+    """
+    Gán số trang ước tính (PageEstimator: ngắt dòng theo độ rộng glyph, ảnh,
+    bảng, ngắt trang/section) cho các mục đã thu thập.
+    
+    Returns: (headings, tables, figures) dạng dùng cho _insert_table_of_contents
+    """
+    pages = PageEstimator(doc, options, classifier).block_pages()
+    headings = [(text, level, pages.get(p, 1)) for text, level, p in collection["headings"]]
+    tables = [(text, pages.get(p, 1)) for text, p in collection["tables"]]
+    figures = [(text, pages.get(p, 1)) for text, p in collection["figures"]]
+    return headings, tables, figures
+
+
+def _collect_headings_tables_figures_single_pass(doc, options=None):
     """
     OPTIMIZED: Thu thập headings, tables, VÀ figures trong MỘT LẦN duyệt duy nhất.
     Phân biệt Bảng vs Hình để tạo danh mục riêng biệt.
@@ -330,82 +364,30 @@ def _collect_headings_tables_figures_single_pass(doc):
         tables_list: list of (text, page_estimate) - Bảng captions
         figures_list: list of (text, page_estimate) - Hình/Sơ đồ/Biểu đồ captions
     """
-    headings = []
-    tables = []
-    figures = []
-    page_estimate = 1
-    lines_per_page = 35
-    line_count = 0
-    
+    classifier = ParagraphClassifier(doc)
+    collection = _new_toc_collection()
     for paragraph in doc.paragraphs:
-        style_name = paragraph.style.name if paragraph.style else ""
-        text = paragraph.text.strip()
-        
-        if not text:
-            line_count += 1
-            continue
-        
-        # Check if heading
-        if style_name.lower().startswith("heading"):
-            try:
-                level = int(style_name.split()[-1]) if style_name.split()[-1].isdigit() else 1
-            except:
-                level = 1
-            level = min(max(level, 1), 6)
-            headings.append((text, level, page_estimate))
-        
-        # Check if caption - separate tables from figures
-        if style_name in ["UEL Figure", "Caption"]:
-            # Check if it's a table or figure based on text content
-            if TABLE_CAPTION_PATTERN.match(text):
-                tables.append((text, page_estimate))
-            elif FIGURE_CAPTION_PATTERN.match(text):
-                figures.append((text, page_estimate))
-            else:
-                # Default to figures for unrecognized captions
-                figures.append((text, page_estimate))
-        elif TABLE_CAPTION_PATTERN.match(text):
-            tables.append((text, page_estimate))
-        elif FIGURE_CAPTION_PATTERN.match(text):
-            figures.append((text, page_estimate))
-        
-        # Estimate page number
-        line_count += max(1, len(text) // 80 + 1)
-        if line_count >= lines_per_page:
-            page_estimate += 1
-            line_count = 0
-    
-    return headings, tables, figures
-
-
-# Legacy wrapper functions for backward compatibility
-def _collect_headings_and_figures_single_pass(doc):
-    """Legacy wrapper for backward compatibility."""
-    headings, tables, figures = _collect_headings_tables_figures_single_pass(doc)
-    # Combine tables and figures for legacy callers
-    all_captions = tables + figures
-    return headings, all_captions
+        _collect_toc_paragraph(paragraph, collection, classifier)
+    return _resolve_toc_pages(doc, collection, options, classifier)
 
 
-def _collect_headings(doc):
-    """Legacy wrapper - calls optimized single-pass function."""
-    headings, _, _ = _collect_headings_tables_figures_single_pass(doc)
-    return headings
+def _detached_paragraph(text=""):
+    """Paragraph chưa gắn vào body: dựng đủ nội dung rồi mới chèn vào tài liệu."""
+    paragraph = Paragraph(OxmlElement("w:p"), None)
+    if text:
+        paragraph.add_run(text)
+    return paragraph
 
 
-def _collect_figures(doc):
-    """Legacy wrapper - calls optimized single-pass function."""
-    _, tables, figures = _collect_headings_tables_figures_single_pass(doc)
-    return tables + figures
-
-
-def _create_toc_entry(doc, text, level, page_num, after_para):
+@lru_cache(maxsize=None)
+def _toc_entry_template(level):
     """
-    Tạo một entry trong mục lục với format cố định Times New Roman 13pt
+    w:p mẫu cho entry mục lục ở cấp level: pPr (tab stop, giãn dòng, thụt lề) và
+    3 run đã có rPr (text, tab, số trang) nhưng chưa có nội dung.
+    Dựng một lần cho mỗi cấp, các entry sau chỉ deepcopy.
     """
-    # Tạo paragraph mới sau after_para
-    entry_para = _insert_paragraph_after(after_para)
-    
+    entry_para = _detached_paragraph()
+
     # Set paragraph format
     fmt = entry_para.paragraph_format
     fmt.tab_stops.clear_all()
@@ -413,64 +395,81 @@ def _create_toc_entry(doc, text, level, page_num, after_para):
     fmt.line_spacing = 1.5
     fmt.space_before = Pt(0)
     fmt.space_after = Pt(3)
-    
+
     # Thụt lề theo level (level 1 = 0, level 2 = 0.5cm, level 3 = 1cm...)
     indent = Cm((level - 1) * 0.5)
     fmt.left_indent = indent
     fmt.first_line_indent = Pt(0)
-    
-    # Tạo run cho text
-    run_text = entry_para.add_run(text)
-    run_text.font.name = STANDARD_FONT
-    run_text.font.size = TOC_FONT_SIZE
-    run_text.font.bold = (level == 1)  # Bold cho heading level 1
-    _ensure_east_asia_font(run_text)
-    _force_run_font_xml(run_text)
-    
-    # Tạo tab
+
+    # Run cho text (Bold cho heading level 1)
+    run_text = entry_para.add_run()
+    run_props_fragment(STANDARD_FONT, TOC_FONT_SIZE, bold=(level == 1), force_xml=True).apply_to_run(run_text)
+
+    # Run tab
     run_tab = entry_para.add_run("\t")
-    run_tab.font.name = STANDARD_FONT
-    run_tab.font.size = TOC_FONT_SIZE
-    _ensure_east_asia_font(run_tab)
-    
-    # Tạo run cho số trang
-    run_page = entry_para.add_run(str(page_num))
-    run_page.font.name = STANDARD_FONT
-    run_page.font.size = TOC_FONT_SIZE
-    _ensure_east_asia_font(run_page)
-    _force_run_font_xml(run_page)
-    
-    return entry_para
+    run_props_fragment(STANDARD_FONT, TOC_FONT_SIZE).apply_to_run(run_tab)
+
+    # Run cho số trang
+    run_page = entry_para.add_run()
+    run_props_fragment(STANDARD_FONT, TOC_FONT_SIZE, force_xml=True).apply_to_run(run_page)
+
+    return entry_para._p
+
+
+def _build_toc_entry(text, level, page_num):
+    """
+    Tạo w:p (chưa gắn vào body) cho một entry mục lục Times New Roman 13pt
+    từ bản sao của template cùng cấp.
+    """
+    p = deepcopy(_toc_entry_template(level))
+    run_text, _, run_page = p.r_lst
+    run_text.text = text
+    run_page.text = str(page_num)
+    return p
+
+
+def _toc_title_paragraph(text):
+    """Tiêu đề MỤC LỤC / DANH MỤC ...: căn giữa, đậm, cách dưới 12pt."""
+    title = _detached_paragraph(text)
+    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    title.paragraph_format.space_before = Pt(0)
+    title.paragraph_format.space_after = Pt(12)
+    for run in title.runs:
+        run_props_fragment(STANDARD_FONT, TOC_FONT_SIZE, bold=True, force_xml=True).apply_to_run(run)
+        _force_bold_xml(run)  # Force bold through XML
+    return title._p
+
+
+def _toc_placeholder_paragraph(text):
+    placeholder = _detached_paragraph(text)
+    placeholder.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    for run in placeholder.runs:
+        run_props_fragment(STANDARD_FONT, TOC_FONT_SIZE, italic=True).apply_to_run(run)
+    return placeholder._p
+
+
+def _page_break_paragraph():
+    page_break = _detached_paragraph()
+    page_break.add_run().add_break(WD_BREAK.PAGE)
+    return page_break._p
+
+
+def _toc_list_block(title, entries, placeholder_text):
+    """Tiêu đề + các entry (hoặc placeholder nếu danh sách rỗng) của một danh mục."""
+    block = [_toc_title_paragraph(title)]
+    if entries:
+        block.extend(_build_toc_entry(text, level, page_num) for text, level, page_num in entries)
+    else:
+        block.append(_toc_placeholder_paragraph(placeholder_text))
+    return block
 
 
 def _force_run_font_xml(run):
     """
     Force set font Times New Roman 13pt trong XML level
     """
-    r_pr = run._element.get_or_add_rPr()
-    
-    # Xóa font cũ (giữ lại bold nếu có)
-    for tag in ["rFonts", "sz", "szCs"]:
-        old = r_pr.find(qn(f"w:{tag}"))
-        if old is not None:
-            r_pr.remove(old)
-    
-    # Set font Times New Roman
-    r_fonts = OxmlElement("w:rFonts")
-    r_fonts.set(qn("w:ascii"), STANDARD_FONT)
-    r_fonts.set(qn("w:hAnsi"), STANDARD_FONT)
-    r_fonts.set(qn("w:eastAsia"), STANDARD_FONT)
-    r_fonts.set(qn("w:cs"), STANDARD_FONT)
-    r_pr.insert(0, r_fonts)
-    
-    # Set size 13pt (26 half-points)
-    size_half_pts = int(TOC_FONT_SIZE.pt * 2)
-    sz = OxmlElement("w:sz")
-    sz.set(qn("w:val"), str(size_half_pts))
-    r_pr.append(sz)
-    sz_cs = OxmlElement("w:szCs")
-    sz_cs.set(qn("w:val"), str(size_half_pts))
-    r_pr.append(sz_cs)
+    # Xóa font cũ (giữ lại bold nếu có), set 13pt (26 half-points)
+    forced_font_fragment(STANDARD_FONT, TOC_FONT_SIZE).apply_to_run(run)
 
 
 def _force_bold_xml(run):
@@ -487,147 +486,90 @@ def _force_bold_xml(run):
     r_pr.append(bold)
 
 
-def _insert_table_of_contents(doc, options, anchor=None):
+def _insert_table_of_contents(doc, options, anchor=None, collected=None, index=None):
     """
     Chèn Mục lục, Danh mục Bảng biểu, và Danh mục Hình ảnh THỦ CÔNG.
     Tạo 3 section riêng biệt với font Times New Roman 13pt.
+    
+    anchor: phần tử con của body mà vùng mục lục được chèn ngay trước (vị trí của
+    vùng cũ khi định dạng lại); None thì chèn trước paragraph đầu tiên.
+    collected: (headings, tables, figures) đã thu thập sẵn trong lần duyệt body;
+    nếu None sẽ tự duyệt lại tài liệu.
+    index: DocumentIndex sẽ bị đánh dấu cũ vì hàm này chèn paragraph và sectPr.
+    Vùng chèn được bọc bookmark (mark_generated_region) để lần sau tìm lại được.
+    
+    Returns: (paragraph đầu, paragraph cuối) của vùng vừa chèn, hoặc None.
     """
     if not options.get("insert_toc", True):
-        return
+        return None
     
     _copy_heading_style_to_toc(doc)
     _ensure_caption_style(doc) 
     
     # OPTIMIZED: Thu thập headings, tables, figures trong 1 lần duyệt duy nhất
-    headings, tables, figures = _collect_headings_tables_figures_single_pass(doc)
+    if collected is None:
+        collected = _collect_headings_tables_figures_single_pass(doc, options)
+    headings, tables, figures = collected
     
     logging.info(f"Found {len(headings)} headings, {len(tables)} tables, {len(figures)} figures")
     
+    # Dựng toàn bộ vùng mục lục ngoài cây XML rồi chèn vào body một lần
+    block = []
+
     # ==================== TẠO MỤC LỤC ====================
-    first_paragraph = doc.paragraphs[0] if doc.paragraphs else None
-    if first_paragraph is not None:
-        toc_heading = first_paragraph.insert_paragraph_before("MỤC LỤC")
-    else:
-        toc_heading = doc.add_paragraph("MỤC LỤC")
-    
-    toc_heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    toc_heading.paragraph_format.space_after = Pt(12)
-    toc_heading.paragraph_format.space_before = Pt(0)
-    for run in toc_heading.runs:
-        run.font.name = STANDARD_FONT
-        run.font.size = TOC_FONT_SIZE
-        run.font.bold = True
-        _ensure_east_asia_font(run)
-        _force_run_font_xml(run)
-        _force_bold_xml(run)  # Force bold through XML
-    
-    # Tạo các entry mục lục thủ công
-    current_para = toc_heading
-    
-    if headings:
-        for text, level, page_num in headings:
-            current_para = _create_toc_entry(doc, text, level, page_num, current_para)
-    else:
-        # Nếu không có heading, thêm placeholder
-        placeholder = _insert_paragraph_after(current_para, "(Chưa có mục lục - Hãy thêm các Heading vào văn bản)")
-        placeholder.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        for run in placeholder.runs:
-            run.font.name = STANDARD_FONT
-            run.font.size = TOC_FONT_SIZE
-            run.font.italic = True
-            _ensure_east_asia_font(run)
-        current_para = placeholder
-    
+    block += _toc_list_block(
+        "MỤC LỤC", headings, "(Chưa có mục lục - Hãy thêm các Heading vào văn bản)"
+    )
     # Page break sau mục lục
-    toc_page_break = _insert_paragraph_after(current_para)
-    toc_page_break.add_run().add_break(WD_BREAK.PAGE)
-    current_para = toc_page_break
-    
+    block.append(_page_break_paragraph())
+
     # ==================== TẠO DANH MỤC BẢNG BIỂU ====================
-    tot_heading = _insert_paragraph_after(current_para, "DANH MỤC BẢNG BIỂU")
-    tot_heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    tot_heading.paragraph_format.space_before = Pt(0)
-    tot_heading.paragraph_format.space_after = Pt(12)
-    for run in tot_heading.runs:
-        run.font.name = STANDARD_FONT
-        run.font.size = TOC_FONT_SIZE
-        run.font.bold = True
-        _ensure_east_asia_font(run)
-        _force_run_font_xml(run)
-        _force_bold_xml(run)  # Force bold through XML
-    
-    current_para = tot_heading
-    
-    if tables:
-        for text, page_num in tables:
-            current_para = _create_toc_entry(doc, text, 1, page_num, current_para)
-    else:
-        # Nếu không có bảng, thêm placeholder
-        placeholder = _insert_paragraph_after(current_para, "(Chưa có danh mục bảng biểu)")
-        placeholder.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        for run in placeholder.runs:
-            run.font.name = STANDARD_FONT
-            run.font.size = TOC_FONT_SIZE
-            run.font.italic = True
-            _ensure_east_asia_font(run)
-        current_para = placeholder
-    
+    block += _toc_list_block(
+        "DANH MỤC BẢNG BIỂU", [(text, 1, page_num) for text, page_num in tables], "(Chưa có danh mục bảng biểu)"
+    )
     # Page break sau danh mục bảng
-    tables_page_break = _insert_paragraph_after(current_para)
-    tables_page_break.add_run().add_break(WD_BREAK.PAGE)
-    current_para = tables_page_break
-    
+    block.append(_page_break_paragraph())
+
     # ==================== TẠO DANH MỤC HÌNH ẢNH ====================
-    tof_heading = _insert_paragraph_after(current_para, "DANH MỤC HÌNH ẢNH")
-    tof_heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    tof_heading.paragraph_format.space_before = Pt(0)
-    tof_heading.paragraph_format.space_after = Pt(12)
-    for run in tof_heading.runs:
-        run.font.name = STANDARD_FONT
-        run.font.size = TOC_FONT_SIZE
-        run.font.bold = True
-        _ensure_east_asia_font(run)
-        _force_run_font_xml(run)
-        _force_bold_xml(run)  # Force bold through XML
-    
-    current_para = tof_heading
-    
-    if figures:
-        for text, page_num in figures:
-            current_para = _create_toc_entry(doc, text, 1, page_num, current_para)
-    else:
-        # Nếu không có hình, thêm placeholder
-        placeholder = _insert_paragraph_after(current_para, "(Chưa có danh mục hình ảnh)")
-        placeholder.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        for run in placeholder.runs:
-            run.font.name = STANDARD_FONT
-            run.font.size = TOC_FONT_SIZE
-            run.font.italic = True
-            _ensure_east_asia_font(run)
-        current_para = placeholder
-    
+    block += _toc_list_block(
+        "DANH MỤC HÌNH ẢNH", [(text, 1, page_num) for text, page_num in figures], "(Chưa có danh mục hình ảnh)"
+    )
+
     # Ghi chú hướng dẫn
-    hint = _insert_paragraph_after(
-        current_para,
-        "(* Lưu ý: Mục lục được tạo thủ công. Số trang là ước tính, vui lòng kiểm tra và chỉnh sửa nếu cần. *)",
+    hint = _detached_paragraph(
+        "(* Lưu ý: Mục lục được tạo thủ công. Số trang là ước tính, vui lòng kiểm tra và chỉnh sửa nếu cần. *)"
     )
     hint.alignment = WD_ALIGN_PARAGRAPH.CENTER
     hint.paragraph_format.space_before = Pt(12)
     for run in hint.runs:
-        run.font.name = STANDARD_FONT
-        run.font.size = Pt(11)
-        run.font.italic = True
-        run.font.color.rgb = RGBColor(128, 128, 128)
-        _ensure_east_asia_font(run)
-    
+        run_props_fragment(STANDARD_FONT, Pt(11), italic=True, color=RGBColor(128, 128, 128)).apply_to_run(run)
+    block.append(hint._p)
+
     # Page break cuối
-    page_break_para = _insert_paragraph_after(hint)
-    page_break_para.add_run().add_break(WD_BREAK.PAGE)
-    
+    block.append(_page_break_paragraph())
+
+    # Chèn trước anchor, mặc định là paragraph đầu tiên của body
+    # (hoặc trước sectPr nếu body chưa có paragraph)
+    body = doc.element.body
+    if anchor is None:
+        anchor = body.find(qn("w:p"))
+    if anchor is None:
+        anchor = body.find(qn("w:sectPr"))
+    position = body.index(anchor) if anchor is not None else len(body)
+    body[position:position] = block
+    mark_generated_region(block[0], block[-1])
+
+    toc_heading = Paragraph(block[0], doc._body)
+    page_break_para = Paragraph(block[-1], doc._body)
+
     # Tạo section break để ngắt việc đánh số trang
     _add_section_break(page_break_para)
     
+    if index is not None:
+        index.invalidate()
+    
     logging.info(f"Created TOC with {len(headings)} headings, {len(tables)} tables, {len(figures)} figures")
+    return toc_heading, page_break_para
 
 # =========================================================================
 # [SỬA QUAN TRỌNG] HÀM TẠO FIELD PAGE NUMBER BẰNG COMPLEX FIELD
@@ -638,7 +580,12 @@ def _create_element(name):
 def _create_attribute(element, name, value):
     element.set(qn(name), value)
 
-def _apply_page_numbers(doc, options):
+def _apply_page_numbers(doc, options, has_toc_field=None, index=None):
+    """
+    has_toc_field: kết quả kiểm tra field TOC đã tính sẵn trong lần duyệt body;
+    nếu None sẽ tự duyệt lại tài liệu.
+    index: DocumentIndex để lấy số section mà không cần xpath lại.
+    """
     if not options.get("add_page_numbers", True):
         logging.info("add_page_numbers=False, skipping page numbering")
         return
@@ -648,16 +595,19 @@ def _apply_page_numbers(doc, options):
     instr_toc = "PAGE \\* ROMAN" if options.get("page_number_style") == "roman" else "PAGE"
     
     # Kiểm tra xem có Mục lục không để xác định Section bắt đầu đánh số 1
-    has_toc = _document_has_toc(doc) or options.get("insert_toc", True)
-    logging.info(f"Document sections: {len(doc.sections)}, has_toc: {has_toc}")
+    if has_toc_field is None:
+        has_toc_field = _document_has_toc(doc)
+    has_toc = has_toc_field or options.get("insert_toc", True)
+    section_count = index.section_count if index is not None else len(doc.sections)
+    logging.info(f"Document sections: {section_count}, has_toc: {has_toc}")
     
     # Nếu có TOC VÀ có nhiều hơn 1 section, nội dung chính ở Section 1 (bắt đầu đánh số từ 1)
     # Nếu chỉ có 1 section, bắt đầu đánh số từ section đó
-    target_section_idx = 1 if (has_toc and len(doc.sections) > 1) else 0
+    target_section_idx = 1 if (has_toc and section_count > 1) else 0
     logging.info(f"Target section to start numbering from 1: {target_section_idx}")
     
     for idx, section in enumerate(doc.sections):
-        logging.info(f"Processing section {idx}/{len(doc.sections)-1}")
+        logging.info(f"Processing section {idx}/{section_count-1}")
         
         # --- XỬ LÝ FOOTER ---
         # Đảm bảo footer tồn tại - truy cập footer để khởi tạo nếu chưa có
@@ -684,7 +634,7 @@ def _apply_page_numbers(doc, options):
         
         # Nếu là trang bìa (idx=0, có mục lục VÀ có nhiều hơn 1 section) thì KHÔNG đánh số
         # Nếu chỉ có 1 section thì vẫn phải đánh số dù có TOC
-        if has_toc and idx == 0 and len(doc.sections) > 1:
+        if has_toc and idx == 0 and section_count > 1:
             logging.info(f"Section {idx}: Skipped (cover page)")
             continue
         
@@ -706,39 +656,9 @@ def _apply_page_numbers(doc, options):
         
         # Format font cho run TRƯỚC khi chèn field để field thừa hưởng format này
         try:
-            # Format font thông qua API
-            run.font.name = STANDARD_FONT
-            run.font.size = PAGE_NUMBER_FONT_SIZE
-            _ensure_east_asia_font(run)
-            
+            # Format font qua API + force set trong XML để đảm bảo field thừa hưởng
             logging.info(f"Section {idx}: Setting font = {STANDARD_FONT}, size = {PAGE_NUMBER_FONT_SIZE.pt}pt")
-            
-            # Force set font trong XML để đảm bảo field thừa hưởng
-            r_pr = run._element.get_or_add_rPr()
-            
-            # Xóa các font properties cũ
-            for tag in ["rFonts", "sz", "szCs"]:
-                old = r_pr.find(qn(f"w:{tag}"))
-                if old is not None:
-                    r_pr.remove(old)
-            
-            # Set mới font properties
-            r_fonts = OxmlElement("w:rFonts")
-            r_fonts.set(qn("w:ascii"), STANDARD_FONT)
-            r_fonts.set(qn("w:hAnsi"), STANDARD_FONT)
-            r_fonts.set(qn("w:eastAsia"), STANDARD_FONT)
-            r_fonts.set(qn("w:cs"), STANDARD_FONT)
-            r_pr.append(r_fonts)
-            
-            page_size_half_pts = int(PAGE_NUMBER_FONT_SIZE.pt * 2)
-            logging.info(f"Section {idx}: Font size trong XML = {page_size_half_pts} half-points ({page_size_half_pts/2}pt)")
-            
-            sz = OxmlElement("w:sz")
-            sz.set(qn("w:val"), str(page_size_half_pts))
-            r_pr.append(sz)
-            sz_cs = OxmlElement("w:szCs")
-            sz_cs.set(qn("w:val"), str(page_size_half_pts))
-            r_pr.append(sz_cs)
+            run_props_fragment(STANDARD_FONT, PAGE_NUMBER_FONT_SIZE, force_xml=True).apply_to_run(run)
         except Exception as e:
             logging.error(f"Error formatting page number font: {e}")
         
@@ -766,18 +686,23 @@ def _apply_page_numbers(doc, options):
 # =========================================================================
 # CÁC HÀM XỬ LÝ CHÍNH
 # =========================================================================
-def _standardize_paragraph(paragraph, options):
-    style_name = paragraph.style.name if paragraph.style else ""
-    if style_name in ["UEL Figure", "Caption"] or style_name.startswith("TOC"):
+def _standardize_paragraph(paragraph, options, index=None, classifier=None):
+    label = _label(paragraph, classifier)
+    # Caption và mục lục (theo style) giữ nguyên định dạng riêng
+    if label.styled and (label.is_caption or label.is_toc):
         return
     
-    has_image = _paragraph_has_image(paragraph)
+    has_image = _paragraph_has_image(paragraph, index)
     text = paragraph.text
     
     if options.get("clean_whitespace", True) and not has_image:
-        _clean_leading_spaces(paragraph)
-        _collapse_internal_spaces(paragraph)
-        text = paragraph.text
+        _clean_leading_spaces(paragraph, index)
+        _collapse_internal_spaces(paragraph, index)
+        if paragraph.text != text:
+            text = paragraph.text
+            if classifier is not None:
+                classifier.refresh_paragraph(paragraph._p)
+            label = _label(paragraph, classifier)
         
     normalized = (text or "").strip()
     
@@ -796,41 +721,41 @@ def _standardize_paragraph(paragraph, options):
     heading_level = None
     
     if options.get("heading_detection", True):
-        if style_name.lower().startswith("heading"):
+        if label.kind == HEADING and label.styled:
             is_heading = True
-            try:
-                level_str = style_name.split()[-1]
-                if level_str.isdigit():
-                    heading_level = int(level_str)
-            except Exception:
-                heading_level = 1
+            heading_level = label.level
         elif options.get("auto_numbered_heading", True):
-            detected_level, detected_heading = _detect_numbered_heading(normalized)
-            if detected_heading:
+            if label.numbered:
                 is_heading = True
-                heading_level = detected_level
+                heading_level = label.level
                 try:
                     paragraph.style = f"Heading {heading_level}"
                 except Exception:
                     pass
-        elif _looks_like_heading(normalized):
+        elif label.caps:
             is_heading = True
             heading_level = 1
             try:
                 paragraph.style = "Heading 1"
             except Exception:
                 pass
+        if is_heading and not label.styled and classifier is not None:
+            classifier.refresh_paragraph(paragraph._p)
                 
     if options.get("normalize_font", True):
         target_size = HEADING_FONT_SIZE if is_heading else BODY_FONT_SIZE
         for run in paragraph.runs:
-            try:
-                run_has_image = (run._element.xpath('.//w:drawing') or
-                                run._element.xpath('.//w:pict'))
-                if run_has_image:
-                    continue 
-            except Exception:
-                pass
+            if index is not None:
+                if index.run_has_image(run._element):
+                    continue
+            else:
+                try:
+                    run_has_image = (run._element.xpath('.//w:drawing') or
+                                    run._element.xpath('.//w:pict'))
+                    if run_has_image:
+                        continue 
+                except Exception:
+                    pass
             
             if is_heading:
                 bold_flag = (heading_level == 1) if heading_level is not None else False
@@ -857,20 +782,19 @@ def _standardize_paragraph(paragraph, options):
             
             # Check if paragraph has Word list/numbering format
             has_list_format = False
-            try:
-                p_pr = paragraph._p.get_or_add_pPr()
-                # Check for numPr (numbering properties) in paragraph
-                if p_pr.find(qn("w:numPr")) is not None:
-                    has_list_format = True
-            except:
-                pass
-            
-            # Check if text starts with bullet-like characters
-            starts_with_bullet = clean_text.startswith(("-", "+", "•", "*", "–", "—", "›", "»", "○", "●"))
+            if index is not None:
+                has_list_format = index.paragraph_is_numbered(paragraph._p)
+            else:
+                try:
+                    p_pr = paragraph._p.get_or_add_pPr()
+                    # Check for numPr (numbering properties) in paragraph
+                    if p_pr.find(qn("w:numPr")) is not None:
+                        has_list_format = True
+                except:
+                    pass
             
-            # Check if text starts with number followed by dot/paren (e.g., "1.", "a)", "I.")
-            starts_with_number = bool(re.match(r'^[\dIVXivx]+[.)]\s', clean_text) or 
-                                       re.match(r'^[a-zA-Z][.)]\s', clean_text))
+            # Text bắt đầu bằng ký hiệu bullet hoặc số/chữ + dấu chấm/ngoặc ("-", "1.", "a)", "I.")
+            starts_with_list_marker = label.list_prefix
             
             # Estimate if paragraph is multi-line (rough: >80 chars per line)
             chars_per_line = 80  # approximate for standard page width
@@ -878,7 +802,7 @@ def _standardize_paragraph(paragraph, options):
             
             # Indentation Logic:
             # 1. Lists/Bullets: Apply Hanging Indent (Left 0.63cm, First Line -0.63cm)
-            if has_list_format or starts_with_bullet or starts_with_number:
+            if has_list_format or starts_with_list_marker:
                 fmt.left_indent = Cm(0.63)
                 fmt.first_line_indent = Cm(-0.63)
             
@@ -892,39 +816,160 @@ def _standardize_paragraph(paragraph, options):
                 fmt.left_indent = Pt(0)
                 fmt.first_line_indent = PARAGRAPH_INDENT
 
-def apply_standard_formatting(doc: Document, options=None):
+def _standardize_table(table, options, index=None, classifier=None):
+    """Chuẩn hóa paragraph trong từng ô vật lý (một lần mỗi ô), kể cả table lồng nhau"""
+    for cell in iter_table_cells(table):
+        for paragraph in cell.paragraphs:
+            _standardize_paragraph(paragraph, options, index, classifier)
+        ensure_cell_paragraph(cell)
+
+
+def apply_standard_formatting(doc: Document, options=None, progress=None, metrics=None):
+    """
+    Chuẩn hóa toàn bộ tài liệu theo options.
+    progress: hàm progress(stage, fraction) nhận tiến độ 0.0 -> 1.0 (tùy chọn)
+    metrics: FormatMetrics ghi thời gian/bộ đếm của từng stage (tùy chọn)
+
+    Định dạng lại một tài liệu đã qua formatter: vùng mục lục cũ được thay tại
+    chỗ (hoặc bỏ đi nếu insert_toc=False); nếu tài liệu không đổi kể từ lần trước (cùng options) thì trả về ngay.
+    """
     options = merge_options(options)
+    if metrics is None:
+        metrics = FormatMetrics()
+    
+    def report(stage, fraction):
+        if progress is not None:
+            progress(stage, fraction)
     
+    # Vùng mục lục do lần định dạng trước sinh ra: bỏ ra khỏi body để các stage
+    # không xử lý lại các entry như văn bản thường, rồi chèn vùng mới vào chỗ cũ
+    toc_anchor = None
+    with metrics.stage("generated"):
+        region = find_generated_region(doc)
+        previous_stamp = read_format_stamp(doc)
+        if previous_stamp is not None and previous_stamp == format_stamp(doc, options, region):
+            logging.info("Document unchanged since last formatting, skipping all stages")
+            report("done", 1.0)
+            return doc
+        if region is not None:
+            toc_anchor = remove_generated_region(doc, region)
+    
+    report("margins", 0.0)
     if options.get("adjust_margins", True):
-        try:
-            for section in doc.sections:
-                section.top_margin = UEL_MARGINS["top"]
-                section.bottom_margin = UEL_MARGINS["bottom"]
-                section.left_margin = UEL_MARGINS["left"]
-                section.right_margin = UEL_MARGINS["right"]
-        except Exception:
-            logging.warning("Cannot apply margins to document.")
-            
-    _process_captions(doc)
-    _copy_heading_style_to_toc(doc)
+        with metrics.stage("margins", elements=len(doc.sections)):
+            try:
+                for section in doc.sections:
+                    section.top_margin = UEL_MARGINS["top"]
+                    section.bottom_margin = UEL_MARGINS["bottom"]
+                    section.left_margin = UEL_MARGINS["left"]
+                    section.right_margin = UEL_MARGINS["right"]
+            except Exception:
+                logging.warning("Cannot apply margins to document.")
     
-    for paragraph in list(doc.paragraphs):
-        _standardize_paragraph(paragraph, options)
-        
+    with metrics.stage("styles"):
+        _ensure_caption_style(doc)
+        _copy_heading_style_to_toc(doc)
+        # Chế độ style_defaults: font/cỡ chữ chuẩn nằm ở docDefaults + Normal/Heading,
+        # run chỉ giữ thuộc tính khác với giá trị kế thừa
+        inherited_props = None
+        if options.get("style_defaults", False):
+            apply_style_defaults(doc)
+            inherited_props = InheritedRunProps(doc)
+    
+    # Chỉ mục cấu trúc (hình ảnh, field, numPr, sectPr) dùng chung cho mọi stage,
+    # cùng bộ phân loại paragraph (nhãn heading/caption/danh sách/mục lục...)
+    with metrics.stage("index"):
+        index = DocumentIndex(doc)
+        classifier = ParagraphClassifier(doc)
+    
+    # Duyệt body MỘT LẦN: mỗi paragraph đi qua caption -> chuẩn hóa ->
+    # thu thập mục lục -> format TOC -> kiểm tra field TOC
+    caption_counters = {"table": 0, "figure": 0}
+    toc_collection = _new_toc_collection()
+    toc_field_found = []
+    
+    paragraph_stages = [
+        metrics.wrap("captions", lambda paragraph: _process_caption_paragraph(paragraph, caption_counters, index, classifier)),
+        metrics.wrap("paragraphs", lambda paragraph: _standardize_paragraph(paragraph, options, index, classifier)),
+    ]
+    if options.get("insert_toc", True):
+        paragraph_stages.append(
+            metrics.wrap("toc_collect", lambda paragraph: _collect_toc_paragraph(paragraph, toc_collection, classifier))
+        )
+    paragraph_stages.append(
+        metrics.wrap("toc_format", lambda paragraph: _format_toc_paragraph(paragraph, classifier.label(paragraph)))
+    )
+    if inherited_props is not None:
+        paragraph_stages.append(
+            metrics.wrap("style_defaults", lambda paragraph: strip_block_run_props(paragraph._element, inherited_props))
+        )
+    # Gộp run sau khi mọi stage đã đặt xong rPr. Run có field/hình không bị gộp
+    # nên index (field, run chứa hình) và nhãn của classifier vẫn đúng.
+    run_counts = {"before": 0, "after": 0}
+    def _coalesce_runs(block):
+        before, after = coalesce_block_runs(block._element)
+        run_counts["before"] += before
+        run_counts["after"] += after
+    if options.get("coalesce_runs", False):
+        paragraph_stages.append(metrics.wrap("coalesce_runs", _coalesce_runs))
+    if options.get("add_page_numbers", True):
+        def _detect_toc_field(paragraph):
+            if not toc_field_found and _paragraph_has_toc_field(paragraph, index):
+                toc_field_found.append(True)
+        paragraph_stages.append(metrics.wrap("toc_field", _detect_toc_field))
+    
+    table_stages = []
     if options.get("format_tables", True):
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for paragraph in list(cell.paragraphs):
-                        _standardize_paragraph(paragraph, options)
-                        
-    _insert_table_of_contents(doc, options, anchor=None)
-    _copy_heading_style_to_toc(doc)
-    _format_toc_paragraphs(doc)
+        table_stages.append(metrics.wrap("tables", lambda table: _standardize_table(table, options, index, classifier)))
+    if inherited_props is not None:
+        table_stages.append(
+            metrics.wrap("style_defaults", lambda table: strip_block_run_props(table._element, inherited_props))
+        )
+    if options.get("coalesce_runs", False):
+        table_stages.append(metrics.wrap("coalesce_runs", _coalesce_runs))
+    
+    walk_body(
+        doc,
+        paragraph_stages,
+        table_stages,
+        progress=lambda done, total: report("body", 0.05 + 0.75 * done / total),
+    )
+    _log_caption_counts(caption_counters)
+    if options.get("coalesce_runs", False):
+        metrics.count("runs_before_coalesce", run_counts["before"])
+        metrics.count("runs_after_coalesce", run_counts["after"])
+        logging.info(f"Coalesced runs: {run_counts['before']} -> {run_counts['after']}")
+    
+    report("toc", 0.8)
+    collected = None
+    if options.get("insert_toc", True):
+        with metrics.stage("page_estimate", elements=len(doc.element.body)):
+            collected = _resolve_toc_pages(doc, toc_collection, options, classifier)
+    with metrics.stage("toc_insert") as toc_stage:
+        inserted = _insert_table_of_contents(
+            doc,
+            options,
+            anchor=toc_anchor,
+            collected=collected,
+            index=index,
+        )
+        _copy_heading_style_to_toc(doc)
+        if inserted is not None:
+            for paragraph in iter_paragraphs_between(*inserted):
+                _format_toc_paragraph(paragraph, classifier.label(paragraph))
+                if inherited_props is not None:
+                    strip_inherited_run_props(paragraph._p, inherited_props)
+                toc_stage.paragraphs += 1
     
     # GỌI HÀM ĐÁNH SỐ TRANG SAU CÙNG
-    _apply_page_numbers(doc, options)
+    report("page_numbers", 0.9)
+    with metrics.stage("page_numbers", elements=len(doc.sections)):
+        _apply_page_numbers(doc, options, has_toc_field=bool(toc_field_found), index=index)
     
+    with metrics.stage("stamp"):
+        write_format_stamp(doc, format_stamp(doc, options, find_generated_region(doc)))
+    
+    report("done", 1.0)
     return doc
 
 def _add_center_line(doc, text, size=HEADING_FONT_SIZE, bold=True):
@@ -989,9 +1034,13 @@ def create_template_report(payload, options=None):
     
     return apply_standard_formatting(doc, options)
 
-def build_report_stream(doc: Document, download_name: str):
+def build_report_stream(doc: Document, download_name: str, source=None, deflate_level=DOCX_DEFLATE_LEVEL):
+    """
+    Ghi doc ra BytesIO. source là file .docx gốc (file-like) để copy nguyên
+    các part nhị phân không đổi (ảnh...) thay vì nén lại.
+    """
     output_stream = BytesIO()
-    doc.save(output_stream)
+    save_document(doc, output_stream, source=source, deflate_level=deflate_level)
     output_stream.seek(0)
     return output_stream, download_name
 
@@ -1000,15 +1049,96 @@ def generate_template_stream(payload):
     doc = create_template_report(payload, options)
     return build_report_stream(doc, "bao-cao-uel.docx")
 
-def format_uploaded_stream(file_bytes, filename, options_payload):
-    options = merge_options(options_payload)
-    doc = Document(BytesIO(file_bytes))
-    apply_standard_formatting(doc, options)
+def _formatted_download_name(filename):
     # Clean filename - remove trailing underscores and ensure proper extension
     base_name = filename.rsplit('.', 1)[0] if '.' in filename else filename
     base_name = base_name.strip().rstrip('_')
-    safe_name = f"formatted-{base_name}.docx"
-    return build_report_stream(doc, safe_name)
+    return f"formatted-{base_name}.docx"
+
+def preflight_upload(source, metrics=None):
+    """
+    Chặn file hỏng/ZIP bomb trước khi python-docx giải nén bất cứ part nào.
+    zipfile không giải nén quá kích thước khai báo trong central directory,
+    nên giới hạn tổng dung lượng ở đây là giới hạn chặt.
+    Returns: báo cáo của preflight_docx
+    """
+    if metrics is None:
+        metrics = FormatMetrics()
+    with metrics.stage("preflight"):
+        return preflight_docx(source)
+
+def _format_upload(source, options, progress=None, metrics=None, preflight=True):
+    if metrics is None:
+        metrics = FormatMetrics()
+    if preflight:
+        preflight_upload(source, metrics)
+    with metrics.stage("parse"):
+        doc = Document(open_source(source))
+    apply_standard_formatting(doc, options, progress=progress, metrics=metrics)
+    return doc
+
+def _cached_result_key(source, options, metrics):
+    if not RESULT_CACHE_ENABLED:
+        return None
+    with metrics.stage("cache_key"):
+        return result_cache_key(source, options)
+
+def format_uploaded_stream(source, filename, options_payload, progress=None, metrics=None, preflight=True):
+    """
+    Định dạng file upload và trả về (stream, tên file tải về).
+    source: file .docx upload - bytes, đường dẫn hoặc file-like (có seek)
+    progress: hàm progress(stage, fraction) truyền xuống apply_standard_formatting
+    metrics: FormatMetrics ghi thời gian/bộ đếm của từng stage (tùy chọn)
+    preflight: False nếu người gọi đã chạy preflight_upload cho source
+    """
+    if metrics is None:
+        metrics = FormatMetrics()
+    options = merge_options(options_payload)
+    safe_name = _formatted_download_name(filename)
+    
+    # Cùng nội dung file + cùng options -> trả lại kết quả đã lưu, không parse lại
+    cache_key = _cached_result_key(source, options, metrics)
+    if cache_key is not None:
+        cached = get_result_cache().get(cache_key)
+        if cached is not None:
+            metrics.cache_hit = True
+            return BytesIO(cached), safe_name
+    
+    doc = _format_upload(source, options, progress, metrics, preflight)
+    with metrics.stage("save"):
+        stream, download_name = build_report_stream(
+            doc, safe_name, source=open_source(source), deflate_level=deflate_level_from_options(options)
+        )
+    if cache_key is not None:
+        get_result_cache().put(cache_key, stream.getvalue())
+    return stream, download_name
+
+def format_uploaded_to_file(
+    source, filename, options_payload, output_path, progress=None, metrics=None, preflight=True
+):
+    """
+    Định dạng file upload và ghi kết quả thẳng ra output_path (không qua BytesIO).
+    Dùng cho kho preview/download: file kết quả được gửi bằng sendfile.
+    preflight: như format_uploaded_stream
+
+    Returns: tên file tải về
+    """
+    if metrics is None:
+        metrics = FormatMetrics()
+    options = merge_options(options_payload)
+    safe_name = _formatted_download_name(filename)
+    
+    cache_key = _cached_result_key(source, options, metrics)
+    if cache_key is not None and get_result_cache().copy_to(cache_key, output_path):
+        metrics.cache_hit = True
+        return safe_name
+    
+    doc = _format_upload(source, options, progress, metrics, preflight)
+    with metrics.stage("save"):
+        save_document(doc, output_path, source=open_source(source), deflate_level=deflate_level_from_options(options))
+    if cache_key is not None:
+        get_result_cache().put_file(cache_key, output_path)
+    return safe_name
 
 def docx_to_html(doc: Document) -> str:
     """
@@ -1016,45 +1146,41 @@ def docx_to_html(doc: Document) -> str:
     Improved version that better represents TOC, page numbers, and formatting.
     """
     html_parts = ['<div class="docx-preview">']
+    classifier = ParagraphClassifier(doc)
     
     for paragraph in doc.paragraphs:
         text = paragraph.text.strip()
-        style_name = paragraph.style.name if paragraph.style else ""
         
         # Skip empty paragraphs but add spacing
         if not text:
             html_parts.append('<p class="empty-line">&nbsp;</p>')
             continue
         
-        # Detect paragraph type
-        is_heading = style_name.lower().startswith("heading") if style_name else False
-        is_caption = style_name in ["UEL Figure", "Caption"]
-        is_toc = style_name.startswith("TOC") or "MỤC LỤC" in text or "DANH MỤC" in text
-        is_toc_entry = style_name.startswith("TOC") and style_name != "TOC Heading"
+        # Detect paragraph type (nhãn dùng chung với các stage định dạng)
+        label = classifier.label(paragraph)
+        is_heading = label.kind == HEADING and label.styled
+        # Chỉ paragraph có style caption; text "Hình..."/"Bảng..." ở style khác vẫn là văn bản
+        is_caption = label.is_caption and label.styled
+        is_toc_entry = label.kind == TOC_ENTRY
         
-        # Check for centered titles
+        # Check for centered titles (kể cả tiêu đề mục lục mang style Heading)
         is_centered_title = (
-            text in ["MỤC LỤC", "DANH MỤC HÌNH ẢNH"] or
+            label.kind == TOC_TITLE or text in TOC_TITLES or
             (paragraph.alignment == WD_ALIGN_PARAGRAPH.CENTER and len(text) < 50 and text.isupper())
         )
         
         # Check if this is a hint/note line
-        is_hint = text.startswith("(* Lưu ý:") or text.startswith("(*")
+        is_hint = label.kind == HINT
         
         # Determine CSS class and tag
         if is_centered_title:
             css_class = "toc-title"
             tag = "h2"
-        elif is_toc_entry or (is_toc and "\t" in paragraph.text):
+        elif is_toc_entry:
             css_class = "toc-entry"
             tag = "p"
         elif is_heading:
-            level = 1
-            try:
-                level = int(style_name.split()[-1]) if style_name.split()[-1].isdigit() else 1
-            except:
-                level = 1
-            level = min(max(level, 1), 6)
+            level = label.outline_level
             css_class = f"heading-{level}"
             tag = f"h{level}"
         elif is_caption:
@@ -1070,7 +1196,7 @@ def docx_to_html(doc: Document) -> str:
         # Build content with proper formatting
         content_html = ""
         
-        if is_toc_entry or (is_toc and "\t" in paragraph.text):
+        if is_toc_entry:
             # Format TOC entry with dots
             # Parse text and page number
             parts = text.split("\t") if "\t" in text else [text]
@@ -1238,4 +1364,13 @@ def docx_to_html_stream(doc: Document) -> BytesIO:
     html_bytes = html_content.encode('utf-8')
     stream = BytesIO(html_bytes)
     stream.seek(0)
-    return stream
\ No newline at end of file
+    return stream
+
+def format_uploaded_html(source, filename, options_payload, metrics=None, preflight=True):
+    """Định dạng file upload rồi render HTML preview (dùng khi không có ConvertAPI)."""
+    if metrics is None:
+        metrics = FormatMetrics()
+    stream, _ = format_uploaded_stream(source, filename, options_payload, metrics=metrics, preflight=preflight)
+    with metrics.stage("html"):
+        stream.seek(0)
+        return docx_to_html(Document(stream))
@@ -0,0 +1,226 @@
+"""
+Module cache kết quả định dạng theo nội dung (content-addressed result cache)
+Khóa cache = SHA-256 của (nội dung file upload, options sau merge_options,
+fingerprint cấu hình định dạng trong app.config và mã nguồn formatter).
+Cache hit trả lại file .docx đã lưu mà không cần parse lại tài liệu.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import app.config as app_config
+from app.config import (
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_DISK_LIMIT,
+    RESULT_CACHE_MEMORY_LIMIT,
+)
+from app.services.uploads import source_sha256
+
+APP_DIR = Path(__file__).resolve().parent.parent
+
+# Mã nguồn ảnh hưởng tới kết quả định dạng - đổi code thì cache cũ tự hết hiệu lực
+_FINGERPRINT_SOURCE_DIRS = ("services", "utils")
+
+# Các hằng số cấu hình không ảnh hưởng tới kết quả định dạng
+_FINGERPRINT_EXCLUDE = {"CONVERTAPI_SECRET"}
+
+
+def _compute_config_fingerprint():
+    digest = hashlib.sha256()
+    for name in sorted(vars(app_config)):
+        if not name.isupper() or name in _FINGERPRINT_EXCLUDE:
+            continue
+        value = getattr(app_config, name)
+        if isinstance(value, Path):
+            continue
+        digest.update(f"{name}={value!r}\n".encode("utf-8"))
+    for folder in _FINGERPRINT_SOURCE_DIRS:
+        for source in sorted((APP_DIR / folder).glob("*.py")):
+            digest.update(source.name.encode("utf-8"))
+            digest.update(source.read_bytes())
+    return digest.hexdigest()
+
+
+CONFIG_FINGERPRINT = _compute_config_fingerprint()
+
+
+def result_cache_key(source, options):
+    """
+    Tạo khóa cache cho một lần định dạng.
+
+    Args:
+        source: File .docx upload (bytes, đường dẫn hoặc file-like)
+        options: Options đã qua merge_options
+    """
+    digest = hashlib.sha256()
+    digest.update(source_sha256(source))
+    digest.update(json.dumps(options, sort_keys=True, default=str).encode("utf-8"))
+    digest.update(CONFIG_FINGERPRINT.encode("ascii"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Cache LRU 2 tầng: RAM (bytes, riêng từng process) và đĩa (file <key>.docx chia
+    theo 2 ký tự đầu, dùng chung cho mọi worker process).
+    Tầng đĩa không có chỉ mục trong RAM: thư mục cache là nguồn dữ liệu duy nhất,
+    mtime (cập nhật mỗi lần hit) là thứ tự LRU, giới hạn dung lượng được áp bằng
+    cách quét thư mục mỗi khi ghi entry mới.
+    """
+
+    def __init__(self, directory, memory_limit, disk_limit):
+        self._directory = Path(directory)
+        self._memory_limit = memory_limit
+        self._disk_limit = disk_limit
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._evict_disk()
+
+    def _path_for(self, key):
+        return self._directory / key[:2] / f"{key}.docx"
+
+    @staticmethod
+    def _temp_path_for(path):
+        # Thread ident trùng nhau giữa các worker process, nên thêm pid vào tên file tạm
+        return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+    @staticmethod
+    def _touch(path):
+        """Đánh dấu entry vừa được dùng (mtime) để process khác không xóa nó trước."""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _evict_disk(self):
+        """Xóa các entry cũ nhất (theo mtime) cho tới khi cả thư mục dưới giới hạn."""
+        entries = []
+        for path in self._directory.glob("*/*.docx"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self._disk_limit:
+                break
+            try:
+                path.unlink(missing_ok=True)
+            except OSError:
+                continue
+            total -= size
+
+    def _evict_memory(self):
+        while self._memory_bytes > self._memory_limit and self._memory:
+            _, data = self._memory.popitem(last=False)
+            self._memory_bytes -= len(data)
+
+    def _remember(self, key, data):
+        if len(data) > self._memory_limit:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        self._evict_memory()
+
+    def _memory_get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+        if data is not None:
+            self._touch(self._path_for(key))
+        return data
+
+    def get(self, key):
+        """Trả về bytes của file đã định dạng, hoặc None nếu chưa có."""
+        data = self._memory_get(key)
+        if data is not None:
+            return data
+
+        # Entry có thể do process khác ghi: đọc thẳng từ đĩa
+        path = self._path_for(key)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        self._touch(path)
+        with self._lock:
+            self._remember(key, data)
+        return data
+
+    def copy_to(self, key, target_path):
+        """
+        Ghi entry ra file target_path; entry trên đĩa được copy file-sang-file
+        (shutil.copyfile dùng sendfile) mà không đọc vào RAM.
+
+        Returns: True nếu cache hit
+        """
+        data = self._memory_get(key)
+        if data is not None:
+            Path(target_path).write_bytes(data)
+            return True
+
+        path = self._path_for(key)
+        try:
+            shutil.copyfile(path, target_path)
+        except OSError:
+            return False
+        self._touch(path)
+        return True
+
+    def put_file(self, key, source_path):
+        """Lưu file kết quả vào tầng đĩa (copy file-sang-file, không giữ trong RAM)."""
+        path = self._path_for(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._temp_path_for(path)
+            shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as exc:
+            logging.warning(f"Cannot write result cache entry: {exc}")
+            return
+        self._evict_disk()
+
+    def put(self, key, data):
+        """Lưu kết quả vào cache (ghi file tạm rồi rename để tránh đọc file dở dang)."""
+        with self._lock:
+            self._remember(key, data)
+        path = self._path_for(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._temp_path_for(path)
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError as exc:
+            logging.warning(f"Cannot write result cache entry: {exc}")
+            return
+        self._evict_disk()
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Cache dùng chung cho toàn process, khởi tạo khi dùng lần đầu."""
+    global _result_cache
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = ResultCache(
+                    RESULT_CACHE_DIR,
+                    memory_limit=RESULT_CACHE_MEMORY_LIMIT,
+                    disk_limit=RESULT_CACHE_DISK_LIMIT,
+                )
+    return _result_cache
@@ -0,0 +1,88 @@
+"""
+Module nhận file upload với giới hạn dung lượng cứng
+- Upload được đọc theo từng khối và ghi thẳng ra file tạm trên đĩa; vượt
+  UPLOAD_MAX_BYTES thì dừng đọc ngay
+- Formatter nhận trực tiếp bytes, đường dẫn hoặc file-like (không copy thành bytes)
+Giới hạn dung lượng sau giải nén được kiểm tra trong docx_preflight.
+"""
+import hashlib
+import os
+import uuid
+from io import BytesIO
+from pathlib import Path
+
+from app.config import (
+    UPLOAD_MAX_BYTES,
+    UPLOAD_TEMP_DIR,
+)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    """File upload vượt giới hạn dung lượng (trả về HTTP 413)."""
+
+    def __init__(self, message, limit):
+        super().__init__(message)
+        self.limit = limit
+
+    def __reduce__(self):
+        # Giữ nguyên limit khi lỗi được gửi về từ worker process
+        return (type(self), (str(self), self.limit))
+
+
+def _copy_limited(src, dst, max_bytes):
+    total = 0
+    while True:
+        chunk = src.read(CHUNK_SIZE)
+        if not chunk:
+            return total
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds {max_bytes} bytes", max_bytes)
+        dst.write(chunk)
+
+
+def save_upload(src, path, max_bytes=UPLOAD_MAX_BYTES):
+    """Ghi upload ra file path theo từng khối; file dở dang bị xóa nếu vượt giới hạn."""
+    try:
+        with open(path, "wb") as dst:
+            return _copy_limited(src, dst, max_bytes)
+    except BaseException:
+        Path(path).unlink(missing_ok=True)
+        raise
+
+
+def new_upload_path(suffix=".docx"):
+    """Đường dẫn file tạm cho upload đang xử lý (người gọi tự xóa sau khi dùng)."""
+    UPLOAD_TEMP_DIR.mkdir(parents=True, exist_ok=True)
+    return UPLOAD_TEMP_DIR / f"{uuid.uuid4().hex}{suffix}"
+
+
+def open_source(source):
+    """
+    Chuẩn hóa nguồn .docx cho Document()/ZipFile(): bytes -> BytesIO,
+    đường dẫn giữ nguyên, file-like được seek về đầu.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return BytesIO(source)
+    if isinstance(source, (str, os.PathLike)):
+        return source
+    source.seek(0)
+    return source
+
+
+def source_sha256(source):
+    """SHA-256 của nội dung nguồn, đọc theo từng khối."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(source).digest()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return hashlib.file_digest(f, "sha256").digest()
+    source.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+    source.seek(0)
+    return digest.digest()
+
@@ -1,7 +1,7 @@
 import json
 import logging
 
-from app.config import LINE_SPACING
+from app.config import DOCX_DEFLATE_LEVEL, LINE_SPACING
 
 
 DEFAULT_OPTIONS = {
@@ -12,10 +12,13 @@ DEFAULT_OPTIONS = {
     "adjust_margins": True,
     "indent_spacing": True,
     "format_tables": True,
+    "coalesce_runs": False,  # Gộp các run kề nhau có cùng định dạng sau khi chuẩn hóa font
+    "style_defaults": False,  # Font/cỡ chữ chuẩn đặt ở docDefaults + style, bỏ thuộc tính trùng trên từng run
     "insert_toc": True,
     "add_page_numbers": True,
     "page_number_style": "arabic",
     "line_spacing": LINE_SPACING,
+    "deflate_level": DOCX_DEFLATE_LEVEL,  # Mức nén 0-9 khi ghi file .docx kết quả
 }
 
 
@@ -0,0 +1,69 @@
+"""
+Fake ConvertAPI - server giả lập endpoint /convert/docx/to/pdf
+Dùng để test và load-test đường chuyển đổi PDF mà không cần mạng/secret thật.
+
+Chạy riêng:  uvicorn backend.fake_convertapi:app --port 8100
+rồi đặt CONVERTAPI_BASE_URL=http://127.0.0.1:8100 khi chạy backend chính,
+hoặc đặt PDF_CONVERTER_BACKEND=fake để gọi ngay trong process.
+
+Biến môi trường:
+- FAKE_CONVERTAPI_LATENCY: thời gian "chuyển đổi" giả lập (giây, mặc định 0)
+- FAKE_CONVERTAPI_FAILURE_RATE: tỉ lệ request trả 503 (0..1, mặc định 0)
+"""
+
+from fastapi import FastAPI, File, Query, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+import asyncio
+import os
+import random
+
+app = FastAPI(title="Fake ConvertAPI")
+
+LATENCY = float(os.getenv("FAKE_CONVERTAPI_LATENCY", "0"))
+FAILURE_RATE = float(os.getenv("FAKE_CONVERTAPI_FAILURE_RATE", "0"))
+
+
+def build_pdf(text):
+    """Tạo một file PDF 1 trang hợp lệ chứa dòng text."""
+    content = f"BT /F1 12 Tf 72 770 Td ({text}) Tj ET".encode("latin-1")
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+        b"/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Times-Roman >>",
+        b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content),
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+@app.post("/convert/docx/to/pdf")
+async def convert(File: UploadFile = File(...), Secret: str = Query(""), download: str = Query("")):
+    if not Secret:
+        return JSONResponse({"Code": 4013, "Message": "Secret is required"}, status_code=401)
+
+    size = 0
+    while chunk := await File.read(64 * 1024):
+        size += len(chunk)
+
+    if LATENCY:
+        await asyncio.sleep(LATENCY)
+    if FAILURE_RATE and random.random() < FAILURE_RATE:
+        return JSONResponse({"Code": 5000, "Message": "Service busy"}, status_code=503, headers={"Retry-After": "1"})
+
+    pdf = build_pdf(f"Fake conversion of {File.filename} ({size} bytes)")
+    return StreamingResponse(
+        iter([pdf]),
+        media_type="application/pdf",
+        headers={"Content-Disposition": 'attachment; filename="document.pdf"'},
+    )
@@ -3,19 +3,20 @@ EasyWord - FastAPI Backend
 Serves frontend files and provides API endpoints for document processing.
 """
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse, JSONResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 from pathlib import Path
+import asyncio
 import uuid
 import io
 import sys
 import os
 import logging
 import tempfile
-import requests
-import base64
+import time
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -28,19 +29,110 @@ if str(current_dir) not in sys.path:
 
 # Import processing logic
 try:
-    from app.services.report_formatter import format_uploaded_stream
-    from app.config import TEMP_DIR
+    from app.services.report_formatter import format_uploaded_to_file, format_uploaded_html, preflight_upload
+    from app.services.cpu_executor import ServerBusyError, get_cpu_executor
+    from app.services.pdf_converter import ConversionError, create_pdf_converter
+    from app.services.pdf_preview import PDF_SUFFIX, ensure_pdf_preview
+    from app.services.preview_store import get_preview_store
+    from app.services.uploads import UploadTooLargeError, new_upload_path, save_upload
+    from app.services.docx_preflight import InvalidDocumentError, preflight_docx
+    from app.services.jobs import get_job_manager
+    from app.services.pipeline_metrics import get_metrics_registry, run_measured, server_timing_header
+    from app.config import (
+        TEMP_DIR, CONVERTAPI_BASE_URL, PDF_CONVERTER_BACKEND, SERVER_TIMING_ENABLED, UPLOAD_MAX_BYTES
+    )
 except ImportError as e:
     logger.error(f"Import error: {e}")
     logger.info("Make sure to run from the example-python directory")
 
+# Client chuyển đổi PDF dùng chung (pool kết nối keep-alive); None = không có ConvertAPI
+pdf_converter = None
+
+@asynccontextmanager
+async def lifespan(app):
+    global pdf_converter
+    pdf_converter = create_pdf_converter(
+        CONVERTAPI_SECRET,
+        backend=os.getenv("PDF_CONVERTER_BACKEND", PDF_CONVERTER_BACKEND),
+        base_url=os.getenv("CONVERTAPI_BASE_URL", CONVERTAPI_BASE_URL),
+    )
+    try:
+        yield
+    finally:
+        if pdf_converter is not None:
+            await pdf_converter.aclose()
+        get_cpu_executor().shutdown()
+
 # Create FastAPI app
 app = FastAPI(
     title="EasyWord API",
     description="API for processing Word documents",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+@app.exception_handler(ServerBusyError)
+async def server_busy_handler(request: Request, exc: ServerBusyError):
+    """Quá tải: trả 429/503 kèm Retry-After thay vì để request chờ vô hạn"""
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(UploadTooLargeError)
+async def upload_too_large_handler(request: Request, exc: UploadTooLargeError):
+    """File vượt giới hạn dung lượng (upload hoặc sau giải nén)"""
+    return JSONResponse(status_code=413, content={"detail": str(exc), "max_bytes": exc.limit})
+
+@app.exception_handler(InvalidDocumentError)
+async def invalid_document_handler(request: Request, exc: InvalidDocumentError):
+    """File không phải .docx hợp lệ (phát hiện ở bước pre-flight)"""
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+class UploadSizeLimitMiddleware:
+    """
+    Giới hạn dung lượng body của request ngay trong lúc nhận dữ liệu:
+    Content-Length quá lớn bị từ chối trước khi đọc, body gửi dạng chunked
+    bị ngắt khi vượt giới hạn thay vì đợi nhận hết.
+    """
+
+    # Phần dư cho boundary và header của multipart
+    MULTIPART_OVERHEAD = 64 * 1024
+
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes + self.MULTIPART_OVERHEAD
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            await self.app(scope, receive, send)
+            return
+        
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = JSONResponse(
+                status_code=413,
+                content={"detail": "Request body too large", "max_bytes": UPLOAD_MAX_BYTES}
+            )
+            await response(scope, receive, send)
+            return
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+        
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(UploadSizeLimitMiddleware, max_bytes=UPLOAD_MAX_BYTES)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -95,6 +187,71 @@ async def register():
 # API ENDPOINTS
 # ============================================================================
 
+@asynccontextmanager
+async def spooled_upload(file):
+    """Ghi upload ra file tạm theo từng khối (có giới hạn dung lượng), trả về đường dẫn"""
+    upload_path = new_upload_path()
+    await asyncio.to_thread(save_upload, file.file, upload_path)
+    try:
+        yield str(upload_path)
+    finally:
+        upload_path.unlink(missing_ok=True)
+
+async def run_formatting(fn, source, *args):
+    """
+    Chạy fn(source, *args) trong worker pool, ở làn fast/bulk theo chi phí ước lượng.
+    Pre-flight (vài ms) chạy trước: file hỏng/ZIP bomb bị từ chối trước khi chiếm worker,
+    worker được báo bỏ qua pre-flight để không quét lại file lần nữa.
+    Returns: (kết quả của fn, giá trị header Server-Timing)
+    """
+    started = time.perf_counter()
+    report, preflight_timings = await asyncio.to_thread(run_measured, preflight_upload, source)
+    result, timings = await get_cpu_executor().run(
+        run_measured, fn, source, *args, preflight=False, cost=report["estimated_cost"]
+    )
+    timings["stages"] = {**preflight_timings["stages"], **timings["stages"]}
+    get_metrics_registry().observe(timings)
+    return result, server_timing_header(timings, total=time.perf_counter() - started)
+
+def timing_headers(server_timing):
+    """Header Server-Timing gửi kèm response (nếu bật SERVER_TIMING_ENABLED)"""
+    if SERVER_TIMING_ENABLED and server_timing:
+        return {"Server-Timing": server_timing}
+    return {}
+
+async def format_into_store(source, filename, options):
+    """
+    Định dạng trong worker pool, ghi kết quả thẳng vào kho preview (không qua BytesIO).
+    Returns: (file_id, tên file tải về, giá trị header Server-Timing)
+    """
+    store = get_preview_store()
+    file_id = store.new_id()
+    tmp_path = store.temp_path_for(file_id)
+    try:
+        result_name, server_timing = await run_formatting(
+            format_uploaded_to_file, source, filename, options, str(tmp_path)
+        )
+        await asyncio.to_thread(store.save_file, tmp_path, ".docx", file_id)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return file_id, result_name, server_timing
+
+def docx_file_response(file_id, result_name, server_timing=None):
+    """Gửi file kết quả theo đường dẫn (FileResponse) thay vì stream từ RAM"""
+    # Clean filename - remove any trailing underscores or special chars
+    clean_name = result_name.strip().rstrip('_')
+    if not clean_name.endswith('.docx'):
+        clean_name = clean_name.rstrip('.') + '.docx'
+    
+    return FileResponse(
+        get_preview_store().path_for(file_id),
+        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        headers={
+            "Content-Disposition": f'attachment; filename="{clean_name}"',
+            **timing_headers(server_timing),
+        }
+    )
+
 def get_processing_options():
     """Default processing options"""
     return {
@@ -120,28 +277,15 @@ async def process_file(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail="Only .docx files are supported")
     
     try:
-        # Read file content
-        content = await file.read()
-        
-        # Process the file
+        # Process the file (in the worker pool, off the event loop)
         options = get_processing_options()
-        result_stream, result_name = format_uploaded_stream(content, file.filename, options)
+        async with spooled_upload(file) as upload_path:
+            file_id, result_name, server_timing = await format_into_store(upload_path, file.filename, options)
         
         # Return the processed file
-        result_stream.seek(0)
-        
-        # Clean filename - remove any trailing underscores or special chars
-        clean_name = result_name.strip().rstrip('_')
-        if not clean_name.endswith('.docx'):
-            clean_name = clean_name.rstrip('.') + '.docx'
-        
-        return StreamingResponse(
-            result_stream,
-            media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            headers={
-                "Content-Disposition": f'attachment; filename="{clean_name}"'
-            }
-        )
+        return docx_file_response(file_id, result_name, server_timing)
+    except (ServerBusyError, UploadTooLargeError, InvalidDocumentError):
+        raise
     except Exception as e:
         logger.error(f"Processing error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -158,37 +302,104 @@ async def run_test():
         raise HTTPException(status_code=404, detail="Test file not found")
     
     try:
-        # Read test file
-        with open(test_file, 'rb') as f:
-            content = f.read()
-        
-        # Process the file
+        # Process the file (in the worker pool, off the event loop)
         options = get_processing_options()
-        result_stream, result_name = format_uploaded_stream(content, "test_result.docx", options)
+        file_id, result_name, server_timing = await format_into_store(
+            str(test_file), "test_result.docx", options
+        )
         
         # Return the processed file
-        result_stream.seek(0)
-        
-        # Clean filename
-        clean_name = result_name.strip().rstrip('_')
-        if not clean_name.endswith('.docx'):
-            clean_name = clean_name.rstrip('.') + '.docx'
-        
-        return StreamingResponse(
-            result_stream,
-            media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            headers={
-                "Content-Disposition": f'attachment; filename="{clean_name}"'
-            }
-        )
+        return docx_file_response(file_id, result_name, server_timing)
+    except (ServerBusyError, UploadTooLargeError, InvalidDocumentError):
+        raise
     except Exception as e:
         logger.error(f"Test error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/preflight")
+async def preflight_file(file: UploadFile = File(...)):
+    """
+    Quick structural check of a .docx without parsing it.
+    Returns part sizes, image count, estimated paragraph count and size class.
+    """
+    async with spooled_upload(file) as upload_path:
+        return await asyncio.to_thread(preflight_docx, upload_path)
+
+def submit_job(upload, filename, options):
+    """Pre-flight rồi đưa file vào hàng đợi job (chạy trong thread, không chặn event loop)"""
+    # Từ chối file hỏng/quá lớn ngay, không để job chiếm worker rồi mới lỗi
+    report = preflight_docx(upload)
+    job_id = get_job_manager().submit(upload, filename, options)
+    return job_id, report
+
+@app.post("/api/jobs", status_code=202)
+async def create_job(file: UploadFile = File(...), options: str | None = Form(None)):
+    """
+    Queue an uploaded DOCX for background formatting.
+    Returns the job_id right away; poll status_url for progress and the result.
+    """
+    if not file.filename.lower().endswith('.docx'):
+        raise HTTPException(status_code=400, detail="Only .docx files are supported")
+
+    try:
+        job_id, report = await asyncio.to_thread(submit_job, file.file, file.filename, options)
+    except (UploadTooLargeError, InvalidDocumentError):
+        raise
+    except Exception as e:
+        logger.error(f"Job submit error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/api/jobs/{job_id}",
+        "size_class": report["size_class"],
+        "estimated_paragraphs": report["estimated_paragraphs"],
+        "image_count": report["image_count"],
+    }
+
+@app.get("/api/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Job state (queued/running/done/failed) with progress and the result URL when done"""
+    job = await asyncio.to_thread(get_job_manager().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+@app.get("/api/download/{file_id}")
+async def download_result(file_id: str, filename: str = "bao-cao-chuan.docx"):
+    """Download a formatted file from the preview store (e.g. a finished job's result)"""
+    if get_preview_store().get(file_id) is None:
+        raise HTTPException(status_code=404, detail="File not found or expired")
+    return docx_file_response(file_id, filename)
+
 @app.get("/api/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "version": "1.0.0"}
+    return {
+        "status": "healthy",
+        "version": "1.0.0",
+        "format_queue": get_cpu_executor().stats(),
+    }
+
+@app.get("/api/metrics")
+async def metrics():
+    """
+    Per-stage timings and counters of the formatting pipeline (Prometheus text format),
+    plus the current depth of each formatting lane.
+    """
+    lanes = get_cpu_executor().stats()["lanes"]
+    gauges = [
+        (f"docx_format_lane_{field}", description, [({"lane": name}, stats[field]) for name, stats in lanes.items()])
+        for field, description in (
+            ("running", "Formatting jobs currently running in a lane"),
+            ("waiting", "Formatting jobs waiting for a worker in a lane"),
+            ("workers", "Worker processes of a lane"),
+        )
+    ]
+    return Response(
+        get_metrics_registry().render_prometheus(gauges),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
 
 # ConvertAPI secret for PDF conversion
 # Try env variable first, then fallback to config.py
@@ -198,56 +409,67 @@ try:
 except ImportError:
     CONVERTAPI_SECRET = os.getenv("CONVERTAPI_SECRET", "")
 
+async def store_pdf_preview(file_id):
+    """Chuyển file .docx trong kho preview sang PDF, trả về file_id hoặc None nếu thất bại"""
+    store = get_preview_store()
+    try:
+        await ensure_pdf_preview(store, file_id, pdf_converter)
+    except ConversionError as e:
+        logger.warning(f"PDF conversion error: {e}")
+        return None
+    return file_id
+
+def pdf_preview_response(file_id, server_timing=None):
+    """JSON trả về cho frontend: PDF được tải riêng (nhị phân, hỗ trợ Range) qua url"""
+    return JSONResponse({
+        "type": "pdf",
+        "file_id": file_id,
+        "url": f"/api/preview/{file_id}/pdf"
+    }, headers=timing_headers(server_timing))
+
 @app.post("/api/preview")
 async def preview_file(file: UploadFile = File(...)):
     """
     Process file and return PDF preview using ConvertAPI.
-    Returns base64 encoded PDF data.
+    Returns the URL of the stored PDF (see /api/preview/{file_id}/pdf).
     """
     if not file.filename.endswith('.docx'):
         raise HTTPException(status_code=400, detail="Only .docx files are supported")
     
-    if not CONVERTAPI_SECRET:
+    if pdf_converter is None:
         # Fallback: return HTML preview
         try:
-            content = await file.read()
-            from docx import Document
-            from app.services.report_formatter import docx_to_html, apply_standard_formatting, merge_options
-            
-            doc = Document(io.BytesIO(content))
             options = get_processing_options()
-            apply_standard_formatting(doc, options)
-            html_content = docx_to_html(doc)
+            async with spooled_upload(file) as upload_path:
+                html_content, server_timing = await run_formatting(
+                    format_uploaded_html, upload_path, file.filename, options
+                )
             
             return JSONResponse({
                 "type": "html",
                 "content": html_content
-            })
+            }, headers=timing_headers(server_timing))
+        except (ServerBusyError, UploadTooLargeError, InvalidDocumentError):
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
     
     try:
-        content = await file.read()
-        
         # Process the file first
         options = get_processing_options()
-        result_stream, _ = format_uploaded_stream(content, file.filename, options)
-        result_stream.seek(0)
+        async with spooled_upload(file) as upload_path:
+            file_id, _, server_timing = await format_into_store(upload_path, file.filename, options)
         
         # Convert to PDF using ConvertAPI
-        url = f"https://v2.convertapi.com/convert/docx/to/pdf?Secret={CONVERTAPI_SECRET}&download=attachment"
-        files = {'File': ('document.docx', result_stream, 'application/vnd.openxmlformats-officedocument.wordprocessingml.document')}
-        response = requests.post(url, files=files, timeout=60)
+        file_id = await store_pdf_preview(file_id)
         
-        if response.status_code == 200:
-            pdf_base64 = base64.b64encode(response.content).decode('utf-8')
-            return JSONResponse({
-                "type": "pdf",
-                "content": pdf_base64
-            })
+        if file_id is not None:
+            return pdf_preview_response(file_id, server_timing)
         else:
             raise HTTPException(status_code=500, detail="PDF conversion failed")
             
+    except (ServerBusyError, UploadTooLargeError, InvalidDocumentError):
+        raise
     except Exception as e:
         logger.error(f"Preview error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -263,43 +485,68 @@ async def preview_test():
         raise HTTPException(status_code=404, detail="Test file not found")
     
     try:
-        with open(test_file, 'rb') as f:
-            content = f.read()
-        
         options = get_processing_options()
-        result_stream, _ = format_uploaded_stream(content, "test_result.docx", options)
-        result_stream.seek(0)
-        
-        if CONVERTAPI_SECRET:
+        if pdf_converter is not None:
+            file_id, _, server_timing = await format_into_store(str(test_file), "test_result.docx", options)
+            
             # Convert to PDF
-            url = f"https://v2.convertapi.com/convert/docx/to/pdf?Secret={CONVERTAPI_SECRET}&download=attachment"
-            files = {'File': ('document.docx', result_stream, 'application/vnd.openxmlformats-officedocument.wordprocessingml.document')}
-            response = requests.post(url, files=files, timeout=60)
+            file_id = await store_pdf_preview(file_id)
             
-            if response.status_code == 200:
-                pdf_base64 = base64.b64encode(response.content).decode('utf-8')
-                return JSONResponse({
-                    "type": "pdf",
-                    "content": pdf_base64
-                })
+            if file_id is not None:
+                return pdf_preview_response(file_id, server_timing)
         
         # Fallback: return HTML preview
-        from docx import Document
-        from app.services.report_formatter import docx_to_html
-        
-        result_stream.seek(0)
-        doc = Document(result_stream)
-        html_content = docx_to_html(doc)
+        html_content, server_timing = await run_formatting(
+            format_uploaded_html, str(test_file), "test_result.docx", options
+        )
         
         return JSONResponse({
             "type": "html",
             "content": html_content
-        })
+        }, headers=timing_headers(server_timing))
         
+    except (ServerBusyError, UploadTooLargeError, InvalidDocumentError):
+        raise
     except Exception as e:
         logger.error(f"Preview test error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/preview/{file_id}/pdf")
+async def preview_pdf(file_id: str, request: Request):
+    """
+    Stream the stored PDF preview (application/pdf).
+    Supports Range requests and ETag/If-None-Match; converts once if the PDF is missing.
+    """
+    store = get_preview_store()
+    try:
+        if pdf_converter is not None:
+            pdf_path = await ensure_pdf_preview(store, file_id, pdf_converter)
+        else:
+            pdf_path = store.get(file_id, PDF_SUFFIX)
+    except ConversionError as e:
+        logger.error(f"Preview PDF error: {e}")
+        raise HTTPException(status_code=502, detail="PDF conversion failed")
+    
+    if pdf_path is None:
+        raise HTTPException(status_code=404, detail="Preview not found or expired")
+    
+    # Nội dung PDF của một file_id không bao giờ đổi; thời hạn cache = thời hạn trong kho
+    etag = f'"{file_id}-pdf"'
+    max_age = max(0, int(pdf_path.stat().st_mtime - time.time()))
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={max_age}"}
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    if any(tag.strip().removeprefix("W/") in (etag, "*") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    
+    return FileResponse(
+        pdf_path,
+        media_type="application/pdf",
+        headers=headers,
+        filename="preview.pdf",
+        content_disposition_type="inline"
+    )
+
 # ============================================================================
 # RUN SERVER
 # ============================================================================
@@ -0,0 +1 @@
+# Benchmark của pipeline định dạng: bộ sinh tài liệu mẫu (corpus) và runner đo thời gian.
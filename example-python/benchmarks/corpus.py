@@ -0,0 +1,186 @@
+"""
+Bộ sinh tài liệu Word tổng hợp (synthetic corpus) cho benchmark và load-test
+Kích thước điều chỉnh được theo từng thành phần: đoạn văn, heading (style và
+đánh số kiểu "1.2. ..."), caption bảng/hình, bảng có ô gộp, hình ảnh, section.
+Cùng tham số + cùng seed luôn cho ra cùng nội dung.
+
+Chạy riêng để ghi corpus ra thư mục:
+    python -m benchmarks.corpus --out bench_corpus
+"""
+import argparse
+import random
+import struct
+import zlib
+from io import BytesIO
+from pathlib import Path
+
+from docx import Document
+from docx.enum.section import WD_SECTION
+from docx.shared import Cm
+
+# Các mức kích thước dùng cho size sweep (số lượng của từng thành phần)
+SIZE_SWEEP = {
+    "small": {
+        "chapters": 3, "sections_per_chapter": 2, "paragraphs_per_section": 4,
+        "tables": 2, "table_rows": 5, "table_cols": 4, "images": 1, "sections": 1,
+    },
+    "medium": {
+        "chapters": 6, "sections_per_chapter": 4, "paragraphs_per_section": 8,
+        "tables": 10, "table_rows": 20, "table_cols": 6, "images": 5, "sections": 2,
+    },
+    "large": {
+        "chapters": 10, "sections_per_chapter": 8, "paragraphs_per_section": 15,
+        "tables": 30, "table_rows": 60, "table_cols": 8, "images": 15, "sections": 3,
+    },
+    "xlarge": {
+        "chapters": 20, "sections_per_chapter": 12, "paragraphs_per_section": 20,
+        "tables": 60, "table_rows": 200, "table_cols": 10, "images": 30, "sections": 4,
+    },
+}
+
+_WORDS = (
+    "phân tích kinh tế thị trường doanh nghiệp chính sách tăng trưởng đầu tư "
+    "xuất khẩu nghiên cứu số liệu mô hình kết quả đánh giá giải pháp phát triển "
+    "thương mại tài chính ngân hàng lao động sản xuất dịch vụ quản lý hiệu quả"
+).split()
+
+
+def _sentence(rng, words=12):
+    text = " ".join(rng.choice(_WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def _body_text(rng):
+    # Đoạn văn bản có khoảng trắng thừa ở đầu/giữa để stage làm sạch có việc để làm
+    text = " ".join(_sentence(rng, rng.randint(8, 20)) for _ in range(rng.randint(2, 6)))
+    if rng.random() < 0.3:
+        text = "   " + text.replace(" ", "   ", 3)
+    return text
+
+
+def tiny_png(width=64, height=48, color=(70, 130, 180)):
+    """Ảnh PNG một màu (không cần Pillow)."""
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xFFFFFFFF)
+
+    row = b"\x00" + bytes(color) * width
+    raw = zlib.compress(row * height)
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", raw) + chunk(b"IEND", b"")
+
+
+def _add_table(doc, rng, rows, cols, number):
+    doc.add_paragraph(f"Bảng {number}. {_sentence(rng, 6)}")
+    table = doc.add_table(rows=rows, cols=cols)
+    for r, row in enumerate(table.rows):
+        for c, cell in enumerate(row.cells):
+            cell.text = f"{rng.randint(0, 99999):,}" if r else f"Cột {c + 1}"
+    # Ô gộp: dòng tiêu đề gộp 2 cột đầu, cột đầu gộp 2 dòng kế tiếp
+    if cols >= 2:
+        table.cell(0, 0).merge(table.cell(0, 1))
+    if rows >= 3:
+        table.cell(1, 0).merge(table.cell(2, 0))
+
+
+def _add_image(doc, rng, number, image_bytes):
+    doc.add_paragraph().add_run().add_picture(BytesIO(image_bytes), width=Cm(rng.uniform(6, 12)))
+    caption = rng.choice(("Hình", "Sơ đồ", "Biểu đồ"))
+    doc.add_paragraph(f"{caption} {number}: {_sentence(rng, 6)}")
+
+
+def build_document(chapters=3, sections_per_chapter=2, paragraphs_per_section=4,
+                   tables=2, table_rows=5, table_cols=4, images=1, sections=1, seed=0):
+    """
+    Tạo Document tổng hợp.
+
+    Args:
+        chapters: Số chương (Heading 1)
+        sections_per_chapter: Số mục con mỗi chương - xen kẽ Heading 2 và heading
+            đánh số dạng text ("1.2. ...") để stage nhận diện heading có việc
+        paragraphs_per_section: Số đoạn văn mỗi mục
+        tables: Tổng số bảng (kèm caption "Bảng n."), có ô gộp
+        table_rows, table_cols: Kích thước mỗi bảng
+        images: Tổng số hình (kèm caption "Hình/Sơ đồ/Biểu đồ n:")
+        sections: Số section (ngắt section kiểu trang mới)
+        seed: Seed cho nội dung ngẫu nhiên
+    """
+    rng = random.Random(seed)
+    doc = Document()
+    image_bytes = tiny_png()
+
+    doc.add_paragraph("TRƯỜNG ĐẠI HỌC KINH TẾ - LUẬT")
+    doc.add_paragraph("BÁO CÁO TỔNG HỢP")
+
+    total_sections = chapters * sections_per_chapter
+    # Rải đều bảng, hình và section break trên các mục
+    table_slots = {round(i * total_sections / tables) for i in range(tables)} if tables else set()
+    image_slots = {round(i * total_sections / images) for i in range(images)} if images else set()
+    break_slots = {round(i * total_sections / sections) for i in range(1, sections)} if sections > 1 else set()
+    tables_left, images_left = tables, images
+    table_number = image_number = 0
+
+    slot = 0
+    for chapter in range(1, chapters + 1):
+        doc.add_heading(f"CHƯƠNG {chapter}. {_sentence(rng, 4).rstrip('.').upper()}", level=1)
+        for sub in range(1, sections_per_chapter + 1):
+            title = _sentence(rng, 5).rstrip(".")
+            if sub % 2:
+                doc.add_heading(f"{chapter}.{sub}. {title}", level=2)
+            else:
+                doc.add_paragraph(f"{chapter}.{sub}. {title}")
+            for _ in range(paragraphs_per_section):
+                doc.add_paragraph(_body_text(rng))
+            if rng.random() < 0.5:
+                doc.add_paragraph(f"- {_sentence(rng, 8)}")
+                doc.add_paragraph(f"a) {_sentence(rng, 8)}")
+            if slot in table_slots and tables_left:
+                table_number += 1
+                tables_left -= 1
+                _add_table(doc, rng, table_rows, table_cols, table_number)
+            if slot in image_slots and images_left:
+                image_number += 1
+                images_left -= 1
+                _add_image(doc, rng, image_number, image_bytes)
+            if slot in break_slots:
+                doc.add_section(WD_SECTION.NEW_PAGE)
+            slot += 1
+    return doc
+
+
+def generate_docx(seed=0, **params):
+    """Tạo tài liệu tổng hợp và trả về nội dung file .docx (bytes)."""
+    stream = BytesIO()
+    build_document(seed=seed, **params).save(stream)
+    return stream.getvalue()
+
+
+def generate_sweep(sizes=None, seed=0):
+    """Trả về {tên mức: bytes .docx} cho các mức trong SIZE_SWEEP."""
+    return {name: generate_docx(seed=seed, **SIZE_SWEEP[name]) for name in (sizes or SIZE_SWEEP)}
+
+
+def write_corpus(out_dir, sizes=None, seed=0):
+    """Ghi corpus ra out_dir/<mức>.docx, trả về danh sách đường dẫn."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for name, data in generate_sweep(sizes, seed).items():
+        path = out_dir / f"{name}.docx"
+        path.write_bytes(data)
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sinh corpus .docx tổng hợp cho benchmark")
+    parser.add_argument("--out", default="bench_corpus", help="Thư mục ghi file")
+    parser.add_argument("--sizes", nargs="+", choices=sorted(SIZE_SWEEP), help="Các mức kích thước (mặc định: tất cả)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    for path in write_corpus(args.out, args.sizes, args.seed):
+        print(f"{path} ({path.stat().st_size:,} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+"""
+Công cụ load-test end-to-end cho backend Flask (app/routes/report.py) và FastAPI (backend/main.py)
+Phát lại một hỗn hợp request dùng corpus tổng hợp (benchmarks/corpus.py) với
+nhiều client chạy song song, rồi báo cáo throughput, độ trễ p50/p95/p99, tỉ lệ
+lỗi theo từng loại request và RSS của server theo thời gian.
+
+Các loại request (--mix tên=trọng số):
+- Flask:   format-report (POST /api/format-report), preview (GET /api/preview/<id>),
+           download (GET /api/download/<id>), generate-report (POST /api/generate-report)
+- FastAPI: process (POST /api/process), pdf-preview (POST /api/preview),
+           pdf-get (GET /api/preview/<id>/pdf)
+preview/download/pdf-get dùng file_id từ các request trước; chưa có thì gửi
+request tạo file tương ứng.
+
+Với --spawn, công cụ tự chạy server ở local (FastAPI dùng ConvertAPI giả lập:
+PDF_CONVERTER_BACKEND=fake) và đo RSS của cả cây process (gồm worker pool).
+Với server chạy sẵn, truyền --flask-pid/--fastapi-pid để đo RSS.
+
+Ví dụ:
+    python -m benchmarks.loadtest --spawn --duration 30 --concurrency 8
+    python -m benchmarks.loadtest --backends fastapi --fastapi-url http://127.0.0.1:8000 \\
+        --mix process=3 pdf-preview=1 --out load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+
+from benchmarks.corpus import SIZE_SWEEP, generate_docx
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# Loại request -> backend phục vụ nó
+OPERATIONS = {
+    "format-report": "flask",
+    "preview": "flask",
+    "download": "flask",
+    "generate-report": "flask",
+    "process": "fastapi",
+    "pdf-preview": "fastapi",
+    "pdf-get": "fastapi",
+}
+
+DEFAULT_MIX = {
+    "format-report": 4,
+    "preview": 3,
+    "download": 2,
+    "generate-report": 1,
+    "process": 3,
+    "pdf-preview": 1,
+    "pdf-get": 1,
+}
+
+DEFAULT_URLS = {"flask": "http://127.0.0.1:5000", "fastapi": "http://127.0.0.1:8000"}
+
+# Đường dẫn kiểm tra server đã sẵn sàng
+_READY_PATHS = {"flask": "/", "fastapi": "/api/health"}
+
+
+# ============================================================================
+# SERVER (--spawn) VÀ ĐO RSS
+# ============================================================================
+def spawn_server(backend, url):
+    """Chạy server local cho backend ("flask"/"fastapi") tại cổng của url, trả về Popen."""
+    port = str(httpx.URL(url).port)
+    env = dict(os.environ, PYTHONPATH=str(PROJECT_ROOT))
+    if backend == "fastapi":
+        env["PDF_CONVERTER_BACKEND"] = "fake"
+        command = [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1", "--port", port,
+                   "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "main", "run", "--port", port, "--no-reload"]
+    return subprocess.Popen(command, cwd=PROJECT_ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_ready(client, backend, url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get(url + _READY_PATHS[backend])
+            if response.status_code < 500:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"{backend} server at {url} did not become ready in {timeout}s")
+
+
+def _child_pids(pid):
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as handle:
+                children.extend(int(child) for child in handle.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def process_tree_rss(pid):
+    """Tổng RSS (bytes) của process và các process con (đọc /proc); None nếu không đọc được."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as handle:
+                for line in handle:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            if current == pid:
+                return None
+            continue
+        pending.extend(_child_pids(current))
+    return total
+
+
+async def sample_rss(pids, samples, started, interval, stop):
+    """Ghi {t, backend: rss} mỗi interval giây cho đến khi stop được set."""
+    while not stop.is_set():
+        sample = {"t": round(time.monotonic() - started, 2)}
+        for backend, pid in pids.items():
+            sample[backend] = process_tree_rss(pid)
+        samples.append(sample)
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+# ============================================================================
+# CÁC LOẠI REQUEST
+# ============================================================================
+class LoadState:
+    """Trạng thái dùng chung giữa các client: corpus, file_id đã tạo, kết quả đo."""
+
+    def __init__(self, urls, corpus, rng):
+        self.urls = urls
+        self.corpus = corpus
+        self.rng = rng
+        self.flask_ids = []
+        self.pdf_ids = []
+        self.records = []  # (tên request, status hoặc None, độ trễ giây, lỗi)
+
+    def pick_document(self):
+        name = self.rng.choice(sorted(self.corpus))
+        return f"{name}.docx", self.corpus[name]
+
+    def remember(self, ids, file_id, limit=200):
+        ids.append(file_id)
+        if len(ids) > limit:
+            del ids[0]
+
+
+async def _format_report(client, state):
+    filename, data = state.pick_document()
+    response = await client.post(
+        state.urls["flask"] + "/api/format-report",
+        files={"file": (filename, data, DOCX_MIME)},
+    )
+    if response.status_code == 200:
+        state.remember(state.flask_ids, response.json()["file_id"])
+    return response
+
+
+async def _preview(client, state):
+    file_id = state.rng.choice(state.flask_ids)
+    return await client.get(state.urls["flask"] + f"/api/preview/{file_id}", headers={"Accept-Encoding": "gzip"})
+
+
+async def _download(client, state):
+    file_id = state.rng.choice(state.flask_ids)
+    return await client.get(state.urls["flask"] + f"/api/download/{file_id}")
+
+
+async def _generate_report(client, state):
+    return await client.post(
+        state.urls["flask"] + "/api/generate-report",
+        json={"studentName": "Nguyễn Văn A", "reportTitle": "Báo cáo load-test"},
+    )
+
+
+async def _process(client, state):
+    filename, data = state.pick_document()
+    return await client.post(
+        state.urls["fastapi"] + "/api/process",
+        files={"file": (filename, data, DOCX_MIME)},
+    )
+
+
+async def _pdf_preview(client, state):
+    filename, data = state.pick_document()
+    response = await client.post(
+        state.urls["fastapi"] + "/api/preview",
+        files={"file": (filename, data, DOCX_MIME)},
+    )
+    if response.status_code == 200 and response.json().get("type") == "pdf":
+        state.remember(state.pdf_ids, response.json()["file_id"])
+    return response
+
+
+async def _pdf_get(client, state):
+    file_id = state.rng.choice(state.pdf_ids)
+    return await client.get(state.urls["fastapi"] + f"/api/preview/{file_id}/pdf")
+
+
+_HANDLERS = {
+    "format-report": _format_report,
+    "preview": _preview,
+    "download": _download,
+    "generate-report": _generate_report,
+    "process": _process,
+    "pdf-preview": _pdf_preview,
+    "pdf-get": _pdf_get,
+}
+
+
+def _resolve(name, state):
+    """Request cần file_id mà chưa có -> gửi request tạo file trước."""
+    if name in ("preview", "download") and not state.flask_ids:
+        return "format-report"
+    if name == "pdf-get" and not state.pdf_ids:
+        return "pdf-preview"
+    return name
+
+
+async def client_loop(client, state, mix, deadline):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    while time.monotonic() < deadline:
+        name = _resolve(state.rng.choices(names, weights)[0], state)
+        started = time.perf_counter()
+        try:
+            response = await _HANDLERS[name](client, state)
+            await response.aread()
+            state.records.append((name, response.status_code, time.perf_counter() - started, None))
+        except httpx.HTTPError as exc:
+            state.records.append((name, None, time.perf_counter() - started, type(exc).__name__))
+
+
+# ============================================================================
+# BÁO CÁO
+# ============================================================================
+def percentile(sorted_values, fraction):
+    """Percentile theo nearest-rank trên danh sách đã sắp xếp."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def _latency_summary(records, elapsed):
+    latencies = sorted(latency for _, _, latency, _ in records)
+    statuses = defaultdict(int)
+    errors = 0
+    for _, status, _, error in records:
+        statuses[str(status) if status is not None else error] += 1
+        if status is None or status >= 400:
+            errors += 1
+    return {
+        "requests": len(records),
+        "throughput_rps": len(records) / elapsed if elapsed else 0.0,
+        "error_rate": errors / len(records) if records else 0.0,
+        "p50_ms": _ms(percentile(latencies, 0.50)),
+        "p95_ms": _ms(percentile(latencies, 0.95)),
+        "p99_ms": _ms(percentile(latencies, 0.99)),
+        "max_ms": _ms(latencies[-1] if latencies else None),
+        "statuses": dict(statuses),
+    }
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+def build_report(state, elapsed, rss_samples, settings):
+    by_operation = defaultdict(list)
+    for record in state.records:
+        by_operation[record[0]].append(record)
+    return {
+        "settings": settings,
+        "elapsed_seconds": round(elapsed, 2),
+        "overall": _latency_summary(state.records, elapsed),
+        "operations": {name: _latency_summary(records, elapsed) for name, records in sorted(by_operation.items())},
+        "rss": rss_samples,
+    }
+
+
+def print_report(report):
+    overall = report["overall"]
+    print(f"{report['elapsed_seconds']}s, {overall['requests']} requests, "
+          f"{overall['throughput_rps']:.1f} req/s, error rate {overall['error_rate']:.1%}")
+    print(f"{'operation':<16} {'count':>6} {'req/s':>7} {'err':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, stats in report["operations"].items():
+        print(f"{name:<16} {stats['requests']:>6} {stats['throughput_rps']:>7.1f} {stats['error_rate']:>6.1%} "
+              f"{stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}")
+    for name, stats in report["operations"].items():
+        failed = {status: count for status, count in stats["statuses"].items() if not status.startswith(("2", "3"))}
+        if failed:
+            print(f"  {name} failures: {failed}")
+    for backend in ("flask", "fastapi"):
+        values = [sample[backend] for sample in report["rss"] if sample.get(backend)]
+        if values:
+            print(f"{backend} RSS: start {values[0] / 2**20:.0f} MiB, max {max(values) / 2**20:.0f} MiB, "
+                  f"end {values[-1] / 2**20:.0f} MiB")
+
+
+# ============================================================================
+# CHẠY
+# ============================================================================
+def parse_mix(items):
+    mix = {}
+    for item in items:
+        name, _, weight = item.partition("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r} (choose from {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def run_load(backends, urls, mix, concurrency, duration, sizes, spawn=False, pids=None,
+                   rss_interval=1.0, seed=0, timeout=120):
+    """Chạy load-test và trả về báo cáo dạng dict (ghi được ra JSON)."""
+    mix = {name: weight for name, weight in mix.items() if OPERATIONS[name] in backends and weight > 0}
+    if not mix:
+        raise ValueError("No operation in the mix is served by the selected backends")
+
+    corpus = {name: generate_docx(seed=seed, **SIZE_SWEEP[name]) for name in sizes}
+    state = LoadState(urls, corpus, random.Random(seed))
+    pids = dict(pids or {})
+    servers = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        try:
+            if spawn:
+                for backend in backends:
+                    server = spawn_server(backend, urls[backend])
+                    servers.append(server)
+                    pids[backend] = server.pid
+            for backend in backends:
+                await wait_ready(client, backend, urls[backend])
+
+            rss_samples = []
+            stop = asyncio.Event()
+            started = time.monotonic()
+            sampler = asyncio.create_task(sample_rss(pids, rss_samples, started, rss_interval, stop))
+            deadline = started + duration
+            await asyncio.gather(*(client_loop(client, state, mix, deadline) for _ in range(concurrency)))
+            elapsed = time.monotonic() - started
+            stop.set()
+            await sampler
+        finally:
+            for server in servers:
+                server.terminate()
+                try:
+                    server.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+
+    settings = {
+        "backends": list(backends),
+        "urls": {backend: urls[backend] for backend in backends},
+        "mix": mix,
+        "concurrency": concurrency,
+        "duration": duration,
+        "sizes": list(sizes),
+        "spawned": spawn,
+    }
+    return build_report(state, elapsed, rss_samples, settings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test backend Flask/FastAPI với corpus .docx tổng hợp")
+    parser.add_argument("--backends", nargs="+", choices=("flask", "fastapi"), default=["flask", "fastapi"])
+    parser.add_argument("--flask-url", default=DEFAULT_URLS["flask"])
+    parser.add_argument("--fastapi-url", default=DEFAULT_URLS["fastapi"])
+    parser.add_argument("--spawn", action="store_true", help="Tự chạy server local (FastAPI dùng ConvertAPI giả lập)")
+    parser.add_argument("--flask-pid", type=int, help="PID server Flask chạy sẵn (để đo RSS)")
+    parser.add_argument("--fastapi-pid", type=int, help="PID server FastAPI chạy sẵn (để đo RSS)")
+    parser.add_argument("--mix", nargs="+", metavar="NAME=WEIGHT", help="Hỗn hợp request (mặc định: tất cả)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Số client chạy song song")
+    parser.add_argument("--duration", type=float, default=30, help="Thời gian chạy (giây)")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZE_SWEEP), default=["small", "medium"])
+    parser.add_argument("--rss-interval", type=float, default=1.0, help="Chu kỳ đo RSS (giây)")
+    parser.add_argument("--timeout", type=float, default=120, help="Timeout mỗi request (giây)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Ghi báo cáo ra file JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        mix = parse_mix(args.mix) if args.mix else dict(DEFAULT_MIX)
+    except argparse.ArgumentTypeError as exc:
+        parser.error(str(exc))
+    pids = {backend: pid for backend, pid in (("flask", args.flask_pid), ("fastapi", args.fastapi_pid)) if pid}
+
+    report = asyncio.run(run_load(
+        args.backends,
+        {"flask": args.flask_url.rstrip("/"), "fastapi": args.fastapi_url.rstrip("/")},
+        mix,
+        args.concurrency,
+        args.duration,
+        args.sizes,
+        spawn=args.spawn,
+        pids=pids,
+        rss_interval=args.rss_interval,
+        seed=args.seed,
+        timeout=args.timeout,
+    ))
+    print_report(report)
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""
+Runner benchmark cho pipeline định dạng
+Đo apply_standard_formatting, docx_to_html và build_report_stream trên các
+mức kích thước của corpus tổng hợp, lưu kết quả dạng JSON và (tùy chọn) so
+sánh với một baseline đã lưu để phát hiện regression.
+
+Ví dụ:
+    python -m benchmarks.run --sizes small medium --repeat 5 --out bench.json
+    python -m benchmarks.run --baseline bench.json          # exit code 1 nếu chậm hơn
+"""
+import argparse
+import json
+import logging
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+from pathlib import Path
+
+from docx import Document
+
+# Cho phép chạy bằng "python benchmarks/run.py" ngoài "python -m benchmarks.run"
+_PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(_PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(_PROJECT_ROOT))
+
+from benchmarks.corpus import SIZE_SWEEP, generate_docx  # noqa: E402
+from app.services.report_formatter import (  # noqa: E402
+    apply_standard_formatting,
+    build_report_stream,
+    docx_to_html,
+)
+
+TARGETS = ("apply_standard_formatting", "docx_to_html", "build_report_stream")
+
+# Chậm hơn baseline quá tỉ lệ này (theo median) thì bị coi là regression
+DEFAULT_TOLERANCE = 0.15
+
+
+def _summary(samples):
+    return {
+        "runs": len(samples),
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "max": max(samples),
+    }
+
+
+def bench_document(data, repeat=3, options=None):
+    """
+    Đo các target trên một file .docx (bytes). Mỗi lần lặp parse lại từ bytes
+    (thời gian parse không tính) vì apply_standard_formatting sửa tài liệu tại chỗ.
+    Returns: {target: {runs, min, median, mean, max}} (giây)
+    """
+    samples = {target: [] for target in TARGETS}
+    for _ in range(repeat):
+        doc = Document(BytesIO(data))
+
+        started = time.perf_counter()
+        apply_standard_formatting(doc, options)
+        samples["apply_standard_formatting"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        docx_to_html(doc)
+        samples["docx_to_html"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        build_report_stream(doc, "bench.docx", source=BytesIO(data))
+        samples["build_report_stream"].append(time.perf_counter() - started)
+    return {target: _summary(values) for target, values in samples.items()}
+
+
+def run_benchmarks(sizes=None, repeat=3, seed=0, options=None):
+    """Chạy size sweep, trả về kết quả dạng dict (ghi được ra JSON)."""
+    results = {}
+    for name in sizes or SIZE_SWEEP:
+        data = generate_docx(seed=seed, **SIZE_SWEEP[name])
+        logging.info(f"Benchmarking {name} ({len(data):,} bytes)")
+        results[name] = {
+            "input_bytes": len(data),
+            "params": SIZE_SWEEP[name],
+            "targets": bench_document(data, repeat=repeat, options=options),
+        }
+    return {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def compare_results(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    So sánh median của từng (mức, target) với baseline.
+    Returns: danh sách dict {size, target, baseline, current, ratio, regression}
+    (chỉ gồm các cặp có mặt trong cả hai kết quả)
+    """
+    rows = []
+    for size, entry in current["results"].items():
+        base_entry = baseline.get("results", {}).get(size)
+        if base_entry is None:
+            continue
+        for target, stats in entry["targets"].items():
+            base_stats = base_entry["targets"].get(target)
+            if base_stats is None or base_stats["median"] <= 0:
+                continue
+            ratio = stats["median"] / base_stats["median"]
+            rows.append({
+                "size": size,
+                "target": target,
+                "baseline": base_stats["median"],
+                "current": stats["median"],
+                "ratio": ratio,
+                "regression": ratio > 1 + tolerance,
+            })
+    return rows
+
+
+def _print_results(results):
+    print(f"{'size':<8} {'target':<27} {'median ms':>10} {'min ms':>10}")
+    for size, entry in results["results"].items():
+        for target, stats in entry["targets"].items():
+            print(f"{size:<8} {target:<27} {stats['median'] * 1000:>10.1f} {stats['min'] * 1000:>10.1f}")
+
+
+def _print_comparison(rows):
+    print(f"{'size':<8} {'target':<27} {'base ms':>10} {'now ms':>10} {'ratio':>7}")
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(
+            f"{row['size']:<8} {row['target']:<27} {row['baseline'] * 1000:>10.1f} "
+            f"{row['current'] * 1000:>10.1f} {row['ratio']:>7.2f}{flag}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark pipeline định dạng .docx")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZE_SWEEP), help="Các mức kích thước (mặc định: tất cả)")
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần lặp mỗi mức")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="Ghi kết quả ra file JSON")
+    parser.add_argument("--baseline", help="File JSON kết quả cũ để so sánh")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Tỉ lệ chậm hơn cho phép so với baseline (mặc định 0.15 = 15%%)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    results = run_benchmarks(args.sizes, repeat=args.repeat, seed=args.seed)
+    _print_results(results)
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        rows = compare_results(results, baseline, args.tolerance)
+        print()
+        _print_comparison(rows)
+        if any(row["regression"] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
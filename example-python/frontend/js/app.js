@@ -227,9 +227,9 @@ async function showPreview(isTest = false) {
         const data = await response.json();
 
         if (data.type === 'pdf') {
-            // Store PDF data for zoom operations
-            currentPDFData = data.content;
-            await renderPDFWithZoom(data.content, previewFrame);
+            // Store PDF URL for zoom operations (PDF is fetched as binary, browser-cached)
+            currentPDFData = data.url;
+            await renderPDFWithZoom(data.url, previewFrame);
             setupZoomControls();
         } else if (data.type === 'html') {
             previewFrame.innerHTML = `
@@ -260,19 +260,12 @@ async function loadPDFJS() {
 }
 
 // Render PDF with zoom capability
-async function renderPDFWithZoom(base64Content, container, scale = null) {
+async function renderPDFWithZoom(pdfUrl, container, scale = null) {
     try {
         await loadPDFJS();
 
-        // Convert base64 to Uint8Array
-        const pdfData = atob(base64Content);
-        const pdfArray = new Uint8Array(pdfData.length);
-        for (let i = 0; i < pdfData.length; i++) {
-            pdfArray[i] = pdfData.charCodeAt(i);
-        }
-
-        // Load PDF
-        const pdf = await pdfjsLib.getDocument({ data: pdfArray }).promise;
+        // Load PDF (PDF.js uses HTTP Range requests when the server supports them)
+        const pdf = await pdfjsLib.getDocument({ url: pdfUrl }).promise;
         currentPDFDocument = pdf;
 
         // If scale is not specified, calculate fit-to-width
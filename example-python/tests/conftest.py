@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# Cho phép import package app khi chạy pytest từ bất kỳ thư mục nào
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
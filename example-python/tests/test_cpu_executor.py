@@ -0,0 +1,58 @@
+"""
+Worker chết trong một làn: việc đang chạy nhận 503 (ServerBusyError), pool của
+làn được tạo lại và các việc sau vẫn chạy được.
+"""
+import asyncio
+import os
+
+import pytest
+
+from app.services.cpu_executor import BULK_LANE, FAST_LANE, CpuExecutor, ServerBusyError
+
+
+def _executor():
+    return CpuExecutor(
+        lanes={FAST_LANE: (1, 4, 30), BULK_LANE: (1, 4, 30)},
+        fast_lane_max_cost=10,
+        retry_after=7,
+    )
+
+
+def test_crashed_worker_returns_503_and_lane_recovers():
+    executor = _executor()
+
+    async def scenario():
+        with pytest.raises(ServerBusyError) as info:
+            await executor.run(os._exit, 1, cost=1)
+        assert info.value.status_code == 503
+        assert info.value.retry_after == 7
+        # Pool mới được tạo ở lần dùng sau, slot đã được trả
+        assert await executor.run(pow, 2, 10, cost=1) == 1024
+
+    try:
+        asyncio.run(scenario())
+        stats = executor.stats()["lanes"][FAST_LANE]
+        assert stats["crashed"] == 1
+        assert stats["running"] == 0
+    finally:
+        executor.shutdown(wait=True)
+
+
+def test_lane_broken_before_submit_is_retried_on_a_new_pool():
+    executor = _executor()
+    lane = executor._lanes[BULK_LANE]
+
+    async def scenario():
+        assert await executor.run(pow, 3, 2) == 9
+        broken = lane.executor
+        with pytest.raises(ServerBusyError):
+            await executor.run(os._exit, 1)
+        # Giả lập làn vẫn giữ pool hỏng: việc chưa chạy được submit lại trên pool mới
+        lane.executor = broken
+        assert await executor.run(pow, 3, 3) == 27
+        assert lane.executor is not broken
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        executor.shutdown(wait=True)
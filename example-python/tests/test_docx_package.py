@@ -0,0 +1,57 @@
+"""
+Round-trip của save_document: part copy nguyên khối (raw) và part ghi lại bằng
+writestr phải cho ra file zip hợp lệ, đọc lại đúng nội dung như file gốc.
+"""
+import zipfile
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from docx import Document
+
+import app.services.docx_package as docx_package
+from app.services.docx_package import raw_copy_supported, save_document
+
+SAMPLE_DOCX = Path(__file__).resolve().parent.parent / "test.docx"
+
+
+def _media_members(zip_file):
+    return {info.filename: info for info in zip_file.infolist() if info.filename.startswith("word/media/")}
+
+
+def _round_trip(monkeypatch, raw_copy):
+    monkeypatch.setattr(docx_package, "raw_copy_supported", lambda: raw_copy)
+    source = SAMPLE_DOCX.read_bytes()
+    doc = Document(BytesIO(source))
+    doc.add_paragraph("Đoạn thêm sau khi mở")
+    output = BytesIO()
+    copied, written = save_document(doc, output, source=BytesIO(source))
+    return source, output, copied, written
+
+
+def test_raw_copy_supported_on_this_python():
+    assert raw_copy_supported()
+
+
+@pytest.mark.parametrize("raw_copy", [True, False])
+def test_save_document_round_trip(monkeypatch, raw_copy):
+    source, output, copied, written = _round_trip(monkeypatch, raw_copy)
+
+    with zipfile.ZipFile(BytesIO(source)) as original, zipfile.ZipFile(output) as saved:
+        assert saved.testzip() is None
+        original_media = _media_members(original)
+        saved_media = _media_members(saved)
+        assert original_media
+        assert saved_media.keys() == original_media.keys()
+        for name, info in original_media.items():
+            assert saved.read(name) == original.read(name)
+            assert saved_media[name].compress_type == info.compress_type
+
+    # Ngoài ảnh còn các part nhị phân khác (theme, font...) cũng được copy nguyên
+    if raw_copy:
+        assert copied >= len(original_media)
+    else:
+        assert copied == 0
+    assert written > 0
+    output.seek(0)
+    assert Document(output).paragraphs[-1].text == "Đoạn thêm sau khi mở"
@@ -0,0 +1,64 @@
+"""
+Gộp run: chỉ run kề nhau trực tiếp, cùng rPr và chỉ chứa văn bản thuần mới được
+gộp; khoảng trắng ở đầu/cuối w:t sau khi nối phải được giữ (xml:space).
+"""
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls, qn
+
+from app.services.docx_runs import XML_SPACE, coalesce_block_runs, coalesce_paragraph_runs
+
+BOLD = "<w:rPr><w:b/></w:rPr>"
+
+
+def _paragraph(*children):
+    return parse_xml(f"<w:p {nsdecls('w')}>{''.join(children)}</w:p>")
+
+
+def _run(text, r_pr=""):
+    space = ' xml:space="preserve"' if text != text.strip() else ""
+    return f"<w:r>{r_pr}<w:t{space}>{text}</w:t></w:r>"
+
+
+def _texts(p):
+    return ["".join(t.text or "" for t in r.iter(qn("w:t"))) for r in p.iter(qn("w:r"))]
+
+
+def test_joined_text_keeps_surrounding_spaces():
+    p = _paragraph(_run("Chương"), _run(" 1 "), _run("mở đầu"))
+    assert coalesce_paragraph_runs(p) == (3, 1)
+
+    (t,) = p.iter(qn("w:t"))
+    assert t.text == "Chương 1 mở đầu"
+
+    p = _paragraph(_run("Kết luận"), _run(" "))
+    coalesce_paragraph_runs(p)
+    (t,) = p.iter(qn("w:t"))
+    assert t.text == "Kết luận "
+    assert t.get(XML_SPACE) == "preserve"
+
+
+def test_runs_separated_by_proof_err_are_not_merged():
+    p = _paragraph(
+        _run("Báo "),
+        '<w:proofErr w:type="spellStart"/>',
+        _run("caó"),
+        '<w:proofErr w:type="spellEnd"/>',
+        _run(" tổng"),
+        _run(" kết"),
+    )
+    assert coalesce_paragraph_runs(p) == (4, 3)
+    assert _texts(p) == ["Báo ", "caó", " tổng kết"]
+    assert len(p.findall(qn("w:proofErr"))) == 2
+
+
+def test_only_runs_with_identical_rpr_and_plain_text_are_merged():
+    field = '<w:r><w:fldChar w:fldCharType="begin"/></w:r>'
+    p = _paragraph(_run("A", BOLD), _run("B", BOLD), _run("C"), field, _run("D"), _run("E"))
+    assert coalesce_paragraph_runs(p) == (6, 4)
+    assert _texts(p) == ["AB", "C", "", "DE"]
+
+
+def test_block_runs_include_nested_table_paragraphs():
+    cell = f"<w:tc><w:p>{_run('x')}{_run('y')}</w:p></w:tc>"
+    table = parse_xml(f"<w:tbl {nsdecls('w')}><w:tr>{cell}{cell}</w:tr></w:tbl>")
+    assert coalesce_block_runs(table) == (4, 2)
@@ -0,0 +1,149 @@
+"""
+Chế độ style_defaults chỉ được làm gọn XML: thuộc tính run hiệu lực (font,
+cỡ chữ, đậm, nghiêng) của từng ký tự phải giống hệt khi tắt chế độ này.
+Font/cỡ chữ complex script (cs, szCs) không được so sánh: chúng chỉ áp dụng cho
+chữ Ả Rập, Thái..., không có trong các tài liệu dưới đây.
+"""
+import logging
+from pathlib import Path
+
+import pytest
+from docx import Document
+from docx.oxml.ns import qn
+
+from app.services.report_formatter import apply_standard_formatting
+
+SAMPLE_DOCX = Path(__file__).resolve().parent.parent / "test.docx"
+
+_FONT_SLOTS = ("ascii", "hAnsi", "eastAsia", "cs")
+_COMPARED = ("ascii", "hAnsi", "eastAsia", "sz", "b", "i")
+_THEME_SLOTS = {"asciiTheme": "ascii", "hAnsiTheme": "hAnsi", "eastAsiaTheme": "eastAsia", "cstheme": "cs"}
+_OFF_VALUES = ("0", "false", "off")
+# Giá trị khi không tầng nào đặt: không đậm/nghiêng, cỡ chữ 10pt
+_IMPLICIT = {"b": False, "i": False, "sz": "20", "szCs": "20"}
+
+
+def _apply_rpr(props, r_pr):
+    if r_pr is None:
+        return
+    r_fonts = r_pr.find(qn("w:rFonts"))
+    if r_fonts is not None:
+        for slot in _FONT_SLOTS:
+            if r_fonts.get(qn(f"w:{slot}")) is not None:
+                props[slot] = r_fonts.get(qn(f"w:{slot}"))
+        for attr, slot in _THEME_SLOTS.items():
+            if r_fonts.get(qn(f"w:{attr}")) is not None:
+                props[slot] = "theme:" + r_fonts.get(qn(f"w:{attr}"))
+    for key in ("sz", "szCs"):
+        element = r_pr.find(qn(f"w:{key}"))
+        if element is not None:
+            props[key] = element.get(qn("w:val"))
+    for key in ("b", "i"):
+        element = r_pr.find(qn(f"w:{key}"))
+        if element is not None:
+            props[key] = element.get(qn("w:val")) not in _OFF_VALUES
+
+
+def _style_chain(styles, style_id):
+    """Các style từ gốc (basedOn) tới style_id."""
+    chain = []
+    while style_id is not None and style_id in styles and styles[style_id] not in chain:
+        style = styles[style_id]
+        chain.insert(0, style)
+        based_on = style.find(qn("w:basedOn"))
+        style_id = based_on.get(qn("w:val")) if based_on is not None else None
+    return chain
+
+
+def _conditional_types(p):
+    """Loại định dạng có điều kiện của style bảng áp dụng cho ô chứa p (theo tblLook mặc định)."""
+    tc = next(p.iterancestors(qn("w:tc")))
+    tr = tc.getparent()
+    row = tr.getparent().index(tr) - sum(1 for c in tr.getparent() if c.tag != qn("w:tr"))
+    col = [c for c in tr if c.tag == qn("w:tc")].index(tc)
+    types = ["band1Horz" if row % 2 == 1 else "band2Horz"]
+    if col == 0:
+        types.append("firstCol")
+    if row == 0:
+        types.append("firstRow")
+    return types
+
+
+def _effective_chars(doc):
+    """[(ký tự, thuộc tính hiệu lực)] theo thứ tự trong body."""
+    styles_element = doc.styles.element
+    styles = {style.get(qn("w:styleId")): style for style in styles_element.iterfind(qn("w:style"))}
+    defaults = dict(_IMPLICIT)
+    _apply_rpr(defaults, styles_element.find(f"{qn('w:docDefaults')}/{qn('w:rPrDefault')}/{qn('w:rPr')}"))
+    normal = doc.styles.default(doc.styles["Normal"].type).style_id
+
+    chars = []
+    for p in doc.element.body.iter(qn("w:p")):
+        props = dict(defaults)
+        table = next(p.iterancestors(qn("w:tbl")), None)
+        tbl_style = table.find(f"{qn('w:tblPr')}/{qn('w:tblStyle')}") if table is not None else None
+        if tbl_style is not None:
+            chain = _style_chain(styles, tbl_style.get(qn("w:val")))
+            for style in chain:
+                _apply_rpr(props, style.find(qn("w:rPr")))
+            for kind in _conditional_types(p):
+                for style in chain:
+                    for style_pr in style.iterfind(qn("w:tblStylePr")):
+                        if style_pr.get(qn("w:type")) == kind:
+                            _apply_rpr(props, style_pr.find(qn("w:rPr")))
+        p_style = p.find(f"{qn('w:pPr')}/{qn('w:pStyle')}")
+        for style in _style_chain(styles, p_style.get(qn("w:val")) if p_style is not None else normal):
+            _apply_rpr(props, style.find(qn("w:rPr")))
+        for r in p.iter(qn("w:r")):
+            if r.getparent().tag not in (qn("w:p"), qn("w:hyperlink")):
+                continue
+            run_props = dict(props)
+            _apply_rpr(run_props, r.find(qn("w:rPr")))
+            text = "".join(t.text or "" for t in r.iter(qn("w:t")))
+            compared = tuple(run_props.get(key) for key in _COMPARED)
+            chars.extend((char, compared) for char in text)
+    return chars
+
+
+def _table_document():
+    doc = Document()
+    doc.add_paragraph("Mở đầu báo cáo")
+    table = doc.add_table(rows=3, cols=2)
+    table.style = "Light Grid Accent 1"
+    for row in range(3):
+        for col in range(2):
+            table.cell(row, col).text = f"Ô {row}{col}"
+    return doc
+
+
+def _sample_document():
+    return Document(str(SAMPLE_DOCX))
+
+
+@pytest.mark.parametrize("build", [_table_document, _sample_document])
+def test_style_defaults_keeps_effective_run_properties(build):
+    logging.disable(logging.CRITICAL)
+    try:
+        results = []
+        for style_defaults in (False, True):
+            doc = build()
+            apply_standard_formatting(doc, {"style_defaults": style_defaults})
+            results.append(_effective_chars(doc))
+    finally:
+        logging.disable(logging.NOTSET)
+
+    plain, compact = results
+    assert plain
+    assert compact == plain
+
+
+def test_header_row_keeps_explicit_bold_off():
+    logging.disable(logging.CRITICAL)
+    try:
+        doc = _table_document()
+        apply_standard_formatting(doc, {"style_defaults": True})
+    finally:
+        logging.disable(logging.NOTSET)
+
+    run = doc.tables[0].cell(0, 0).paragraphs[0].runs[0]
+    assert run.bold is False
@@ -0,0 +1,61 @@
+"""
+JobManager phải tự phục hồi khi một worker chết: pool được tạo lại, job chưa
+bắt đầu được chạy lại và job mới vẫn nhận được.
+"""
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from app.services.jobs import STATUS_DONE, STATUS_FAILED, JobManager, _connect
+
+SAMPLE_DOCX = Path(__file__).resolve().parent.parent / "test.docx"
+
+
+def _wait(manager, job_id, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = manager.get(job_id)
+        if job["status"] in (STATUS_DONE, STATUS_FAILED):
+            return job
+        time.sleep(0.2)
+    raise AssertionError(f"Job {job_id} did not finish: {manager.get(job_id)}")
+
+
+def test_pool_is_rebuilt_after_a_worker_dies(tmp_path):
+    manager = JobManager(tmp_path / "jobs.sqlite3", tmp_path / "inputs", workers=1)
+    try:
+        # Worker duy nhất thoát ngay: pool hỏng trong khi job phía sau còn đang chờ
+        manager._executor.submit(os._exit, 1)
+        queued_id = manager.submit(SAMPLE_DOCX.read_bytes(), "test.docx")
+        assert _wait(manager, queued_id)["status"] == STATUS_DONE
+
+        # Pool đã hỏng từ trước khi submit
+        broken = manager._executor
+        broken.submit(os._exit, 1)
+        while not broken._broken:
+            time.sleep(0.05)
+        later_id = manager.submit(SAMPLE_DOCX.read_bytes(), "test.docx")
+        assert _wait(manager, later_id)["status"] == STATUS_DONE
+        assert manager._executor is not broken
+    finally:
+        manager.shutdown(wait=True)
+
+
+def test_job_never_left_queued_when_dispatch_fails(tmp_path, monkeypatch):
+    manager = JobManager(tmp_path / "jobs.sqlite3", tmp_path / "inputs", workers=1)
+    try:
+        def fail(job_id):
+            raise RuntimeError("no worker available")
+
+        monkeypatch.setattr(manager, "_dispatch", fail)
+        with pytest.raises(RuntimeError):
+            manager.submit(SAMPLE_DOCX.read_bytes(), "test.docx")
+
+        assert list((tmp_path / "inputs").iterdir()) == []
+        with _connect(tmp_path / "jobs.sqlite3") as conn:
+            rows = conn.execute("SELECT status FROM jobs").fetchall()
+        assert [row["status"] for row in rows] == [STATUS_FAILED]
+    finally:
+        manager.shutdown(wait=True)
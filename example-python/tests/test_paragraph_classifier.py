@@ -0,0 +1,45 @@
+"""
+Nhãn của paragraph: style Heading được ưu tiên hơn các luật theo text
+(tiêu đề "MỤC LỤC"/"DANH MỤC ...", dòng ghi chú "(* ...").
+"""
+import logging
+
+import pytest
+from docx import Document
+
+from app.config import HEADING_FONT_SIZE
+from app.services.paragraph_classifier import HEADING, HINT, TOC_TITLE, classify_text
+from app.services.report_formatter import apply_standard_formatting
+
+
+@pytest.mark.parametrize("text", ["MỤC LỤC", "DANH MỤC BẢNG BIỂU", "DANH MỤC HÌNH ẢNH"])
+def test_toc_title_text_without_heading_style(text):
+    assert classify_text("Normal", text).kind == TOC_TITLE
+
+
+@pytest.mark.parametrize("text", ["MỤC LỤC", "DANH MỤC HÌNH ẢNH", "(* Ghi chú chương"])
+def test_heading_style_wins_over_text_rules(text):
+    label = classify_text("Heading 1", text)
+    assert label.kind == HEADING
+    assert label.styled
+    assert label.level == 1
+
+
+def test_hint_text_without_heading_style():
+    assert classify_text("Normal", "(* Lưu ý: ghi chú").kind == HINT
+
+
+def test_heading_styled_toc_title_is_formatted_as_heading():
+    logging.disable(logging.CRITICAL)
+    try:
+        doc = Document()
+        doc.add_heading("MỤC LỤC", level=1)
+        doc.add_paragraph("Nội dung mở đầu của báo cáo.")
+        apply_standard_formatting(doc)
+    finally:
+        logging.disable(logging.NOTSET)
+
+    heading = next(p for p in doc.paragraphs if p.text == "MỤC LỤC" and p.style.name == "Heading 1")
+    assert {run.font.size for run in heading.runs} == {HEADING_FONT_SIZE}
+    # Vẫn có mặt trong mục lục được chèn
+    assert any(p.text.startswith("MỤC LỤC\t") for p in doc.paragraphs)
@@ -0,0 +1,35 @@
+"""
+PreviewStore.save ghi qua file tạm riêng cho mỗi lần gọi và không để lại file
+.tmp, kể cả khi ghi lỗi giữa chừng.
+"""
+import io
+
+import pytest
+
+from app.services.preview_store import PreviewStore
+
+
+class _BrokenStream(io.RawIOBase):
+    def readinto(self, buffer):
+        raise OSError("client disconnected")
+
+
+def _store(tmp_path):
+    return PreviewStore(tmp_path, ttl_seconds=60, max_bytes=10_000)
+
+
+def test_save_leaves_no_temp_files(tmp_path):
+    store = _store(tmp_path)
+    file_id = store.save(b"docx bytes")
+    store.save(io.BytesIO(b"<html>"), ".html", file_id)
+
+    assert store.get(file_id).read_bytes() == b"docx bytes"
+    assert store.get(file_id, ".html").read_bytes() == b"<html>"
+    assert list(tmp_path.glob("*/*.tmp")) == []
+
+
+def test_failed_save_removes_its_temp_file(tmp_path):
+    store = _store(tmp_path)
+    with pytest.raises(OSError):
+        store.save(_BrokenStream())
+    assert list(tmp_path.glob("*/*")) == []
@@ -0,0 +1,46 @@
+"""
+Tầng đĩa của ResultCache dùng chung giữa các worker process: entry do process
+khác ghi phải được tìm thấy, và giới hạn dung lượng áp cho cả thư mục.
+Mỗi ResultCache dưới đây đóng vai một process riêng (RAM riêng, cùng thư mục).
+"""
+import os
+
+from app.services.result_cache import ResultCache
+
+KEY_A = "aa" + "0" * 62
+KEY_B = "bb" + "0" * 62
+KEY_C = "cc" + "0" * 62
+
+
+def _cache(directory, disk_limit=10_000):
+    return ResultCache(directory, memory_limit=10_000, disk_limit=disk_limit)
+
+
+def test_entry_written_by_another_process_is_a_hit(tmp_path):
+    writer = _cache(tmp_path)
+    reader = _cache(tmp_path)
+    writer.put(KEY_A, b"formatted")
+
+    assert reader.get(KEY_A) == b"formatted"
+    target = tmp_path / "out.docx"
+    source = tmp_path / "result.docx"
+    source.write_bytes(b"from file")
+    writer.put_file(KEY_B, source)
+    assert reader.copy_to(KEY_B, target)
+    assert target.read_bytes() == b"from file"
+    assert reader.get(KEY_C) is None
+    assert not reader.copy_to(KEY_C, tmp_path / "missing.docx")
+
+
+def test_disk_limit_counts_entries_of_every_process(tmp_path):
+    first = _cache(tmp_path, disk_limit=250)
+    second = _cache(tmp_path, disk_limit=250)
+    first.put(KEY_A, b"a" * 100)
+    os.utime(first._path_for(KEY_A), (1, 1))
+    second.put(KEY_B, b"b" * 100)
+    os.utime(second._path_for(KEY_B), (2, 2))
+    # Mỗi process chỉ ghi 100-200 bytes, nhưng cả thư mục vượt 250: entry cũ nhất bị xóa
+    first.put(KEY_C, b"c" * 100)
+
+    remaining = sorted(path.stem for path in tmp_path.glob("*/*.docx"))
+    assert remaining == [KEY_B, KEY_C]